@@ -0,0 +1,372 @@
+"""
+Compact memory-mapped index of ASINs fetched across jobs
+
+A Python set of tens of millions of ASIN strings takes gigabytes, and
+reading them back from SQLite for every job is slow.  The index keeps one
+file per marketplace holding every ASIN fetched so far as a sorted array of
+10-byte ASINs followed by a parallel array of 4-byte fetch times (Unix
+seconds), 14 bytes an ASIN::
+
+    b'ASINIDX1' | count (uint64) | count * 10 byte ASINs | count * uint32 times
+
+The file is memory-mapped read-only, so lookups are a binary search over the
+page cache without loading anything, and every process and job reading the
+same file shares one copy of it.
+
+A job records the ASINs it fetched and merges them in when it finishes.  The
+merge copies the old arrays around the new ASINs into a new file, under a
+file lock so that concurrent jobs merge one at a time, and swaps it in with
+os.replace: readers keep the file they mapped and the next job maps the new
+one.
+"""
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+
+import aws_searcher.config as config
+import aws_searcher.models as models
+
+MAGIC = b'ASINIDX1'
+HEADER = struct.Struct('<8sQ')
+TIMESTAMP = struct.Struct('<I')
+ASIN_WIDTH = 10
+
+
+def index_path(marketplace: str) -> Path:
+    """
+    Index file of a marketplace in the home directory
+
+    Args:
+        marketplace: MWS marketplace id
+
+    Returns:
+        Path of the index file
+    """
+    return Path.home() / config.INDEX_DIRECTORY / ('%s.idx' % marketplace)
+
+
+class _Keys(object):
+    """
+    Sequence view of the ASIN array for bisect, without copying it
+    """
+
+    def __init__(self, buffer, count: int):
+        self.buffer = buffer
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, position: int) -> bytes:
+        start = _offset(position)
+        return self.buffer[start:start + ASIN_WIDTH]
+
+
+class AsinIndex(object):
+    """
+    Read-only view of an index file, plus the ASINs recorded since it was opened
+
+    Args:
+        path: Index file, an empty index if it does not exist yet
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._mmap = None
+        self._keys = _Keys(b'', 0)
+        self._recorded = {}
+        self._lock = threading.Lock()
+        self._map()
+
+    def _map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._keys = _Keys(b'', 0)
+        if not self.path.exists() or self.path.stat().st_size <= HEADER.size:
+            return
+        with self.path.open('rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not an ASIN index' % self.path)
+        self._keys = _Keys(self._mmap, count)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _position(self, asin: str) -> Optional[int]:
+        if not is_asin(asin):
+            return None
+        key = asin.encode('ascii')
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            return position
+        return None
+
+    def __contains__(self, asin: str) -> bool:
+        return self._position(asin) is not None
+
+    def fetched_at(self, asin: str) -> Optional[int]:
+        """
+        When an earlier job fetched an ASIN
+
+        Args:
+            asin: ASIN
+
+        Returns:
+            Unix time of the last fetch merged into the index, None if never fetched
+        """
+        position = self._position(asin)
+        if position is None:
+            return None
+        return TIMESTAMP.unpack_from(self._mmap, _offset(len(self._keys))
+                                     + position * TIMESTAMP.size)[0]
+
+    def known(self, asins: Iterable[str]) -> List[str]:
+        """
+        ASINs fetched by earlier jobs
+
+        Args:
+            asins: Candidate ASINs
+
+        Returns:
+            The candidates found in the index, in order
+        """
+        return [asin for asin in asins if asin in self]
+
+    def new_first(self, asins: Iterable[str]) -> Tuple[List[str], int]:
+        """
+        Order candidates so that ASINs no earlier job fetched come before known ones
+
+        Args:
+            asins: Candidate ASINs
+
+        Returns:
+            Tuple of the reordered candidates (each group in its original order) and the
+            number of new ones
+        """
+        new, known = [], []
+        for asin in asins:
+            (known if asin in self else new).append(asin)
+        return new + known, len(new)
+
+    def fresh(self, asins: Iterable[str], max_age: float) -> List[str]:
+        """
+        ASINs an earlier job fetched recently
+
+        Args:
+            asins: Candidate ASINs
+            max_age: Seconds since the fetch
+
+        Returns:
+            The candidates fetched within max_age seconds, in order
+        """
+        cutoff = time.time() - max_age
+        return [asin for asin in asins if (self.fetched_at(asin) or 0) >= cutoff]
+
+    def record(self, asins: Iterable[str], fetched_at: float = None):
+        """
+        Note ASINs this job fetched, merged into the file by merge
+
+        Args:
+            asins: ASINs fetched, any that are not 10 ascii characters are left out
+
+        Keyword Args:
+            fetched_at: Unix time of the fetch, now if not given
+
+        """
+        fetched_at = int(fetched_at if fetched_at is not None else time.time())
+        with self._lock:
+            for asin in asins:
+                if is_asin(asin):
+                    self._recorded[asin] = fetched_at
+
+    def merge(self) -> int:
+        """
+        Merge the recorded ASINs into the index file and map the merged file
+
+        Returns:
+            Number of ASINs merged
+        """
+        with self._lock:
+            recorded, self._recorded = self._recorded, {}
+        if recorded:
+            merge_index(self.path, recorded)
+        self._map()
+        return len(recorded)
+
+    def close(self):
+        """
+        Unmap the index file
+
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._keys = _Keys(b'', 0)
+
+
+def is_asin(asin: str) -> bool:
+    """
+    Whether a value can be an index key: ASIN_WIDTH ascii characters
+
+    Args:
+        asin: Candidate ASIN
+
+    Returns:
+        True if it can be stored and looked up
+    """
+    return len(asin) == ASIN_WIDTH and all(ord(char) < 128 for char in asin)
+
+
+def _key(asin: str) -> bytes:
+    if not is_asin(asin):
+        raise ValueError('ASINs are %d ASCII characters, got %r' % (ASIN_WIDTH, asin))
+    return asin.encode('ascii')
+
+
+def _offset(position: int) -> int:
+    # Offset of an ASIN, and with the ASIN count as position that of the fetch times
+    return HEADER.size + position * ASIN_WIDTH
+
+
+def merge_index(path: Path, entries: Dict[str, float]) -> int:
+    """
+    Merge ASINs and fetch times into an index file, keeping the later time of an ASIN
+    already in it
+
+    Args:
+        path: Index file, created if missing
+        entries: Fetch time by ASIN
+
+    Returns:
+        ASINs in the merged index
+
+    Raises:
+        ValueError: An ASIN is not 10 ASCII characters
+    """
+    new = sorted((_key(asin), int(fetched_at)) for asin, fetched_at in entries.items())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.as_posix() + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        old = AsinIndex(path)
+        try:
+            count = len(old)
+            positions = [bisect.bisect_left(old._keys, key) for key, _ in new]
+            existing = [position < count and old._keys[position] == key
+                        for (key, _), position in zip(new, positions)]
+            temporary = path.with_name(path.name + '.tmp')
+            with temporary.open('wb') as f:
+                _write_merged(f, old, new, positions, existing)
+        finally:
+            old.close()
+        os.replace(temporary.as_posix(), path.as_posix())
+    return count + existing.count(False)
+
+
+def _write_merged(f, old: AsinIndex, new: List[tuple], positions: List[int],
+                  existing: List[bool]):
+    """
+    Write the merged index, copying the old arrays in runs between the new ASINs
+
+    Args:
+        f: Binary file to write to
+        old: Index merged into
+        new: Sorted (ASIN key, fetch time) pairs
+        positions: Position of each new ASIN in the old index
+        existing: Whether each new ASIN is already in the old index
+
+    """
+    count = len(old)
+    buffer = memoryview(old._mmap) if old._mmap is not None else memoryview(b'')
+    try:
+        f.write(HEADER.pack(MAGIC, count + existing.count(False)))
+        # ASINs, replacing the ones already in the index
+        start = 0
+        for (key, _), position, exists in zip(new, positions, existing):
+            f.write(buffer[_offset(start):_offset(position)])
+            f.write(key)
+            start = position + exists
+        f.write(buffer[_offset(start):_offset(count)])
+        # Fetch times in the same order, ASINs already in the index keep the later time
+        times = _offset(count)
+        start = 0
+        for (_, fetched_at), position, exists in zip(new, positions, existing):
+            f.write(buffer[times + start * TIMESTAMP.size:times + position * TIMESTAMP.size])
+            if exists:
+                fetched_at = max(fetched_at, TIMESTAMP.unpack_from(
+                    buffer, times + position * TIMESTAMP.size)[0])
+            f.write(TIMESTAMP.pack(fetched_at))
+            start = position + exists
+        f.write(buffer[times + start * TIMESTAMP.size:times + count * TIMESTAMP.size])
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        buffer.release()
+
+
+def write_index(path: Path, entries: Iterable[tuple]) -> int:
+    """
+    Write an index file from scratch
+
+    Args:
+        path: Index file, replaced if it exists
+        entries: (ASIN, fetch time) pairs sorted by ASIN without repeats, ASINs that are
+            not 10 ascii characters are left out
+
+    Returns:
+        ASINs written
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    times = array('I')
+    temporary = path.with_name(path.name + '.tmp')
+    with open(path.as_posix() + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with temporary.open('wb') as f:
+            f.write(HEADER.pack(MAGIC, 0))
+            for asin, fetched_at in entries:
+                if is_asin(asin):
+                    f.write(asin.encode('ascii'))
+                    times.append(int(fetched_at))
+            if sys.byteorder != 'little':
+                times.byteswap()
+            f.write(times.tobytes())
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, len(times)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary.as_posix(), path.as_posix())
+    return len(times)
+
+
+def build_index(engine, marketplace: str, path: Path) -> int:
+    """
+    Rebuild a marketplace's index from the asin_snapshots table, e.g. for a db that
+    predates the index
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+        marketplace: MWS marketplace id
+        path: Index file, replaced
+
+    Returns:
+        ASINs written
+    """
+    table = models.AsinSnapshots.__table__
+    query = select([table.c.asin, table.c.checked_at]) \
+        .where(table.c.marketplace == marketplace).order_by(table.c.asin)
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        return write_index(path, ((asin, checked_at.timestamp()) for asin, checked_at in result
+                                  if checked_at is not None))
@@ -0,0 +1,201 @@
+"""
+Job budgets and resumable state
+
+A job can be capped by wall clock time (max_duration), search pages read
+(max_pages) and MWS requests sent (max_api_calls).  Workers take a page or
+an API call from the budget before each request; once a budget is spent
+they defer their work instead of doing it.  The page budget only stops page
+intake, the ASINs already found are still looked up.  Running out of time
+or API calls stops the job: the pipeline stops queueing, defers everything
+still queued, waits for the requests in flight and finalizes what was
+gathered as usual.
+
+Deferred work is written to the job directory as resume.json, so that a
+later job can pick up the pending ASINs (at their depth), detail pages,
+pricing batches and search pages where this one stopped.
+"""
+import json
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import aws_searcher.config as config
+from aws_searcher.timeouts import Deadline
+
+MAX_DURATION = 'max_duration'
+MAX_PAGES = 'max_pages'
+MAX_API_CALLS = 'max_api_calls'
+# Stop reason of a job that ran out of work
+COMPLETE = 'complete'
+
+
+class JobBudget(object):
+    """
+    Time, search page and MWS request limits of one job, and the work it deferred
+
+    Keyword Args:
+        max_duration: Seconds the job may crawl for
+        max_pages: Search result pages read
+        max_api_calls: MWS requests sent, pricing requests included
+    """
+
+    def __init__(self, max_duration: float = None, max_pages: int = None,
+                 max_api_calls: int = None):
+        self.deadline = Deadline(max_duration)
+        self.max_pages = max_pages
+        self.max_api_calls = max_api_calls
+        self.pages = 0
+        self.api_calls = 0
+        self.reason = None
+        self.pending = {'asins': [], 'details': [], 'pricing': [], 'pages': []}
+        self._lock = threading.Lock()
+
+    @property
+    def limited(self) -> bool:
+        """
+        Whether the job can be stopped before it runs out of work
+
+        Returns:
+            True with a max_duration or max_api_calls budget
+        """
+        return self.deadline.expires is not None or self.max_api_calls is not None
+
+    def _hit(self, reason: str):
+        # A stopping budget replaces the page budget as the reason, the first one stays
+        if self.reason is None or self.reason == MAX_PAGES and reason != MAX_PAGES:
+            self.reason = reason
+
+    def stopped(self) -> bool:
+        """
+        Whether the job has run out of time or API calls
+
+        Returns:
+            True once the job should stop
+        """
+        with self._lock:
+            if self.deadline.expired():
+                self._hit(MAX_DURATION)
+            return self.reason in (MAX_DURATION, MAX_API_CALLS)
+
+    def take_page(self) -> bool:
+        """
+        Count a search page about to be read
+
+        Returns:
+            False if the page budget is spent or the job has stopped
+        """
+        if self.stopped():
+            return False
+        with self._lock:
+            if self.max_pages is not None and self.pages >= self.max_pages:
+                self._hit(MAX_PAGES)
+                return False
+            self.pages += 1
+            return True
+
+    def take_api_calls(self, count: int = 1) -> bool:
+        """
+        Count MWS requests about to be sent
+
+        Keyword Args:
+            count: Requests sent together
+
+        Returns:
+            False if fewer requests are left or the job has stopped
+        """
+        if self.stopped():
+            return False
+        with self._lock:
+            if self.max_api_calls is not None and self.api_calls + count > self.max_api_calls:
+                self._hit(MAX_API_CALLS)
+                return False
+            self.api_calls += count
+            return True
+
+    def defer(self, kind: str, items: Iterable):
+        """
+        Keep work that was not done for a later job
+
+        Args:
+            kind: 'asins' for (ASIN, depth) pairs, 'details' or 'pricing' for ASINs,
+                'pages' for search page numbers
+            items: Deferred work
+
+        """
+        with self._lock:
+            self.pending[kind].extend(items)
+
+    def deferred(self) -> int:
+        """
+        Amount of work deferred so far
+
+        Returns:
+            ASINs and pages deferred
+        """
+        with self._lock:
+            return sum(len(items) for items in self.pending.values())
+
+    def usage(self) -> Dict[str, int]:
+        """
+        Budget spent so far
+
+        Returns:
+            Dict of 'pages' and 'api_calls'
+        """
+        return {'pages': self.pages, 'api_calls': self.api_calls}
+
+
+def save_state(this_job_dir: Path, state: dict) -> Path:
+    """
+    Write a job's resumable state
+
+    Args:
+        this_job_dir: Job output directory
+        state: JSON serializable state
+
+    Returns:
+        Path of the state file
+    """
+    path = this_job_dir / config.RESUME_STATE_FILE
+    with path.open('w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    return path
+
+
+def load_state(this_job_dir: Path) -> dict:
+    """
+    Read a job's resumable state
+
+    Args:
+        this_job_dir: Job output directory
+
+    Returns:
+        State dict, None if the job left nothing to resume
+    """
+    path = this_job_dir / config.RESUME_STATE_FILE
+    if not path.exists():
+        return None
+    with path.open() as f:
+        return json.load(f)
+
+
+def first_pending_page(pages: List[int], queued: int, last_page: int = None) -> int:
+    """
+    Search page a resumed job starts reading from
+
+    Args:
+        pages: Page numbers deferred
+        queued: Highest page number queued
+
+    Keyword Args:
+        last_page: Last page number, if known
+
+    Returns:
+        Lowest deferred page, else the page after the last one queued, None when every
+        page was read
+    """
+    if pages:
+        return min(pages)
+    if last_page is None or queued < last_page:
+        return queued + 1
+    return None
@@ -0,0 +1,285 @@
+"""
+On-disk HTTP response cache for Amazon pages, keyed by URL
+
+Bodies are stored zlib compressed in a SQLite file so that several threads and
+several processes can share one cache safely.  Entries expire after a TTL and
+the least recently used entries are evicted once the total compressed size
+passes the configured limit.
+
+Lookups must not turn into writes under many threads and processes: the total
+size is kept in a counters row updated in the same transaction as each store,
+so stores never sum the table, and access times and hit/miss counts are held
+in memory and written in one transaction every CACHE_FLUSH_LOOKUPS lookups.
+"""
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Optional
+
+import aws_searcher.config as config
+
+
+class CacheMiss(Exception):
+    """
+    Raised in offline (cache-only) mode when a URL is not in the cache
+    """
+    pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0);
+INSERT OR IGNORE INTO counters (name, value) SELECT 'bytes', COALESCE(SUM(size), 0)
+    FROM responses;
+"""
+
+
+class ResponseCache(object):
+    """
+    URL keyed response cache backed by a SQLite file
+
+    Args:
+        cache_path: Path object for the SQLite cache file (created if not present)
+
+    Keyword Args:
+        ttl: Seconds a cached response stays fresh
+        max_bytes: Upper bound on the total compressed size of stored bodies
+        offline: Serve only from the cache, raising CacheMiss instead of going to network.
+            Expired entries are still served in offline mode
+        flush_lookups: Lookups between writes of access times and hit/miss counts
+    """
+
+    def __init__(self, cache_path: Path,
+                 ttl: int = config.CACHE_TTL_SECONDS,
+                 max_bytes: int = config.CACHE_MAX_BYTES,
+                 offline: bool = False,
+                 flush_lookups: int = config.CACHE_FLUSH_LOOKUPS):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.flush_lookups = flush_lookups
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._accessed = {}  # type: Dict[str, float]
+        self._pending = {'hits': 0, 'misses': 0}
+
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread, SQLite handles locking between processes
+
+        Returns:
+            sqlite3 connection in autocommit mode
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.cache_path.as_posix(), timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def _count(self, name: str, url: str = None, now: float = None):
+        """
+        Bump the in-process counter for hits or misses, and write the pending counts and
+        access times once flush_lookups lookups are pending
+
+        Args:
+            name: 'hits' or 'misses'
+
+        Keyword Args:
+            url: URL served from the cache, its access time is noted
+            now: Time of the lookup
+
+        """
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+            self._pending[name] += 1
+            if url is not None:
+                self._accessed[url] = now
+            due = sum(self._pending.values()) >= self.flush_lookups
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending access times and hit/miss counts in one transaction
+
+        """
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+            pending, self._pending = self._pending, {'hits': 0, 'misses': 0}
+        if not accessed and not any(pending.values()):
+            return
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('UPDATE responses SET accessed_at = MAX(accessed_at, ?) '
+                                   'WHERE url = ?',
+                                   [(now, url) for url, now in accessed.items()])
+            connection.executemany('UPDATE counters SET value = value + ? WHERE name = ?',
+                                   [(count, name) for name, count in pending.items() if count])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get(self, url: str) -> Optional[str]:
+        """
+        Look up a cached response body
+
+        Args:
+            url: Request url
+
+        Returns:
+            Decompressed body or None if missing or expired
+        """
+        now = time.time()
+        row = self._connection().execute('SELECT body, fetched_at FROM responses WHERE url = ?',
+                                         (url,)).fetchone()
+
+        if row is None or (not self.offline and now - row[1] > self.ttl):
+            self._count('misses')
+            if self.offline:
+                raise CacheMiss(url)
+            return None
+
+        self._count('hits', url, now)
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def set(self, url: str, body: str):
+        """
+        Store a response body and evict least recently used entries if over size
+
+        Args:
+            url: Request url
+            body: Response text
+
+        """
+        if self.offline:
+            return
+        now = time.time()
+        compressed = zlib.compress(body.encode('utf-8'))
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            old = connection.execute('SELECT size FROM responses WHERE url = ?',
+                                     (url,)).fetchone()
+            connection.execute('INSERT OR REPLACE INTO responses '
+                               '(url, body, size, fetched_at, accessed_at) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (url, compressed, len(compressed), now, now))
+            connection.execute("UPDATE counters SET value = value + ? WHERE name = 'bytes'",
+                               (len(compressed) - (old[0] if old else 0),))
+            total = self._total(connection)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        if total > self.max_bytes:
+            self._evict()
+
+    @staticmethod
+    def _total(connection: sqlite3.Connection) -> int:
+        return connection.execute("SELECT value FROM counters WHERE name = 'bytes'").fetchone()[0]
+
+    def _evict(self) -> int:
+        """
+        Drop least recently used entries once the stored total passes max_bytes
+
+        Returns:
+            Number of entries removed
+        """
+        self.flush()
+        connection = self._connection()
+        removed = 0
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            total = self._total(connection)
+            if total > self.max_bytes:
+                while total > self.max_bytes:
+                    rows = connection.execute('SELECT url, size FROM responses '
+                                              'ORDER BY accessed_at LIMIT 100').fetchall()
+                    if not rows:
+                        break
+                    for url, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        connection.execute('DELETE FROM responses WHERE url = ?', (url,))
+                        total -= size
+                        removed += 1
+                connection.execute("UPDATE counters SET value = ? WHERE name = 'bytes'",
+                                   (max(total, 0),))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return removed
+
+    def prune(self, clear: bool = False) -> int:
+        """
+        Remove expired entries and enforce the size limit
+
+        Keyword Args:
+            clear: Remove every entry regardless of age
+
+        Returns:
+            Number of entries removed
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if clear:
+                removed = connection.execute('DELETE FROM responses').rowcount
+            else:
+                removed = connection.execute('DELETE FROM responses WHERE fetched_at < ?',
+                                             (time.time() - self.ttl,)).rowcount
+            # Pruning is rare, so the stored total is simply recomputed
+            connection.execute("UPDATE counters SET value = (SELECT COALESCE(SUM(size), 0) "
+                               "FROM responses) WHERE name = 'bytes'")
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return removed + self._evict()
+
+    def stats(self) -> dict:
+        """
+        Cache size and hit/miss statistics
+
+        Returns:
+            Dict with entry count, stored bytes, this process' hits and misses and the
+            persisted totals across all processes
+        """
+        self.flush()
+        connection = self._connection()
+        entries = connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        totals = dict(connection.execute('SELECT name, value FROM counters').fetchall())
+        size = totals.get('bytes', 0)
+        total_lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        return {'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'total_hits': totals.get('hits', 0),
+                'total_misses': totals.get('misses', 0),
+                'hit_ratio': totals.get('hits', 0) / total_lookups if total_lookups else 0.0}
@@ -1,138 +1,472 @@
 """
 CLI access for AWS Searcher tooling
+
+Only click and the standard library are imported at module load.  pandas,
+SQLAlchemy, BeautifulSoup and mws are imported inside the commands that need
+them so that --help and light commands start quickly.
 """
 import click
-import threading
-from queue import Queue
 from pathlib import Path
-import logging
-
-import pandas as pd
 
 import aws_searcher.config as config
-import aws_searcher.tasks as tasks
-import aws_searcher.models as models
+from aws_searcher.cache import ResponseCache
+from aws_searcher.logger import configure_logging
+
+
+def _response_cache(ttl: int = config.CACHE_TTL_SECONDS, offline: bool = False) -> ResponseCache:
+    """
+    Open the shared on-disk response cache
+
+    Keyword Args:
+        ttl: Seconds a cached page stays fresh
+        offline: Serve only from cache
+
+    Returns:
+        ResponseCache object
+    """
+    cache_file = Path.home() / config.CACHE_DIRECTORY / config.CACHE_FILE_NAME
+    return ResponseCache(cache_file, ttl=ttl, offline=offline)
 
 
-@click.command()
+@click.group()
+def cli():
+    """
+    AWS Searcher tooling
+
+    """
+    pass
+
+
+@cli.command()
 @click.option('--category', help="Amazon Search Category")
 @click.option('--terms', help='Search terms')
 @click.option('--market', default=config.MARKETPLACE_IDS['US'], help='Region Marketplace ID')
-def run(category, terms, market):
+@click.option('--cache/--no-cache', default=False, help='Cache search result pages on disk')
+@click.option('--cache-ttl', default=config.CACHE_TTL_SECONDS, help='Seconds a cached page stays fresh')
+@click.option('--offline', is_flag=True, help='Replay search result pages from the cache only')
+@click.option('--details', is_flag=True, help='Also crawl product detail pages for buy box data')
+@click.option('--pricing', is_flag=True,
+              help='Also fetch competitive and lowest offer prices in batches of 20 ASINs')
+@click.option('--incremental', is_flag=True,
+              help='Only write ASINs that are new or changed since earlier jobs')
+@click.option('--refresh-hours', default=config.INCREMENTAL_REFRESH_HOURS,
+              help='With --incremental, skip ASINs checked within this many hours')
+@click.option('--max-depth', default=config.FRONTIER_MAX_DEPTH,
+              help='Relationship hops to follow from search result ASINs')
+@click.option('--asin-budget', default=config.FRONTIER_ASIN_BUDGET,
+              help='Maximum distinct ASINs sent to MWS for the job')
+@click.option('--max-duration', type=float,
+              help='Seconds the crawl may take before queued work is deferred and results saved')
+@click.option('--max-pages', type=int, help='Search result pages read before page intake stops')
+@click.option('--max-api-calls', type=int,
+              help='MWS requests sent before queued work is deferred and results saved')
+@click.option('--hedge', is_flag=True,
+              help='Resend search page requests slower than the 95th latency percentile')
+@click.option('--proxy', 'proxies', multiple=True, default=config.EGRESS_PROXIES,
+              help="HTTP proxy to spread page requests over ('direct' for none), may be repeated")
+@click.option('--log-json', is_flag=True, help='Log one JSON object per line')
+@click.option('--log-sample-rate', default=config.LOG_SAMPLE_RATE,
+              help='Per-batch log lines per second allowed for each message type')
+@click.option('--profile', is_flag=True,
+              help='Write a sampled profile of all threads to the job directory')
+@click.option('--trace-memory', is_flag=True,
+              help='Write a tracemalloc allocation diff of the finalize step to the job directory')
+def run(category, terms, market, cache, cache_ttl, offline, details, pricing, incremental,
+        refresh_hours, max_depth, asin_budget, max_duration, max_pages, max_api_calls, hedge,
+        proxies, log_json, log_sample_rate, profile, trace_memory):
     """
     Public Access Point
 
     """
-    logging.basicConfig(level=logging.INFO,
-                        format='%(asctime)s | %(threadName)s | %(levelname)s | %(message)s')
+    listener = configure_logging(json_output=log_json, sample_rate=log_sample_rate)
+
+    import aws_searcher.pipeline as pipeline
+    import aws_searcher.searcher as searcher
+    from aws_searcher.egress import EgressPool
+    from aws_searcher.timeouts import Hedger
+
+    if cache or offline:
+        searcher.configure_cache(_response_cache(cache_ttl, offline))
+    if hedge:
+        searcher.configure_hedging(Hedger())
+    if proxies:
+        searcher.configure_egress(EgressPool.from_proxies(list(proxies)))
+
+    try:
+        pipeline.run_job(category, terms, market, details=details, pricing=pricing,
+                         incremental=incremental, refresh_hours=refresh_hours,
+                         max_depth=max_depth, asin_budget=asin_budget,
+                         max_duration=max_duration, max_pages=max_pages,
+                         max_api_calls=max_api_calls, profile=profile, trace_memory=trace_memory)
+    finally:
+        listener.stop()
+
+
+@cli.command()
+@click.argument('job_id', type=int)
+@click.option('--market', default=config.MARKETPLACE_IDS['US'], help='Region Marketplace ID')
+@click.option('--log-json', is_flag=True, help='Log one JSON object per line')
+def retry(job_id, market, log_json):
+    """
+    Re-run the ASINs a job dead-lettered as a new job
+
+    """
+    import aws_searcher.models as models
+    import aws_searcher.pipeline as pipeline
+    from aws_searcher.retry import dead_lettered_asins, mark_retried
+
+    engine = models.results_engine()
+    jobs = models.Jobs.__table__
+    job = engine.execute(jobs.select().where(jobs.c.id == job_id)).fetchone()
+    if job is None:
+        raise click.ClickException('No job %d' % job_id)
+
+    asins = dead_lettered_asins(engine, job_id)
+    if not asins:
+        click.echo('Job %d has no dead-lettered ASINs to retry' % job_id)
+        return
+
+    listener = configure_logging(json_output=log_json)
+    try:
+        retry_job_id = pipeline.run_job(job['category'], job['terms'], market, seeds=asins,
+                                        search=False, max_depth=0, pause=False)
+    finally:
+        listener.stop()
+    mark_retried(engine, job_id, retry_job_id)
+    click.echo('Retried %d ASINs from job %d as job %d' % (len(asins), job_id, retry_job_id))
+
+
+@cli.command()
+@click.argument('job_id', type=int)
+@click.option('--max-duration', type=float,
+              help='Seconds the crawl may take before queued work is deferred and results saved')
+@click.option('--max-pages', type=int, help='Search result pages read before page intake stops')
+@click.option('--max-api-calls', type=int,
+              help='MWS requests sent before queued work is deferred and results saved')
+@click.option('--log-json', is_flag=True, help='Log one JSON object per line')
+def resume(job_id, max_duration, max_pages, max_api_calls, log_json):
+    """
+    Carry on with the work a job stopped by its budget left, as a new job
+
+    """
+    import aws_searcher.pipeline as pipeline
+    from aws_searcher.budget import load_state, save_state
+
+    this_job_dir = Path.home() / config.JOBS_DIRECTORY / str(job_id)
+    state = load_state(this_job_dir)
+    if state is None:
+        raise click.ClickException('Job %d left no work to resume' % job_id)
+    if state.get('resumed_job') is not None:
+        raise click.ClickException('Job %d was already resumed as job %d'
+                                   % (job_id, state['resumed_job']))
+
+    listener = configure_logging(json_output=log_json)
+    try:
+        resumed_job_id = pipeline.run_job(state['category'], state['terms'], state['market'],
+                                          search=state['first_page'] is not None, resume=state,
+                                          max_duration=max_duration, max_pages=max_pages,
+                                          max_api_calls=max_api_calls, **state['options'])
+    finally:
+        listener.stop()
+    save_state(this_job_dir, dict(state, resumed_job=resumed_job_id))
+    click.echo('Resumed job %d as job %d' % (job_id, resumed_job_id))
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', help='Interface to bind')
+@click.option('--port', default=8765, help='Port for the job API')
+@click.option('--max-jobs', default=config.DAEMON_MAX_JOBS, help='Jobs run at the same time')
+@click.option('--cache/--no-cache', default=False, help='Cache search result pages on disk')
+@click.option('--cache-ttl', default=config.CACHE_TTL_SECONDS, help='Seconds a cached page stays fresh')
+@click.option('--hedge', is_flag=True,
+              help='Resend search page requests slower than the 95th latency percentile')
+@click.option('--proxy', 'proxies', multiple=True, default=config.EGRESS_PROXIES,
+              help="HTTP proxy to spread page requests over ('direct' for none), may be repeated")
+@click.option('--log-json', is_flag=True, help='Log one JSON object per line')
+@click.option('--log-sample-rate', default=config.LOG_SAMPLE_RATE,
+              help='Per-batch log lines per second allowed for each message type')
+def daemon(host, port, max_jobs, cache, cache_ttl, hedge, proxies, log_json, log_sample_rate):
+    """
+    Run jobs submitted over a local HTTP API on warm shared state
+
+    """
+    listener = configure_logging(json_output=log_json, sample_rate=log_sample_rate)
+
+    import aws_searcher.daemon as job_daemon
+    import aws_searcher.searcher as searcher
+    from aws_searcher.egress import EgressPool
+    from aws_searcher.timeouts import Hedger
+
+    if cache:
+        searcher.configure_cache(_response_cache(cache_ttl))
+    if hedge:
+        searcher.configure_hedging(Hedger())
+    if proxies:
+        searcher.configure_egress(EgressPool.from_proxies(list(proxies)))
+
+    try:
+        job_daemon.serve(job_daemon.JobManager(max_jobs=max_jobs), host, port)
+    finally:
+        listener.stop()
+
+
+@cli.command()
+@click.option('--category', required=True, help="Amazon Search Category")
+@click.option('--terms', required=True, help='Search terms')
+@click.option('--market', default=config.MARKETPLACE_IDS['US'], help='Region Marketplace ID')
+@click.option('--details', is_flag=True, help='Also crawl product detail pages for buy box data')
+@click.option('--pricing', is_flag=True,
+              help='Also fetch competitive and lowest offer prices in batches of 20 ASINs')
+@click.option('--incremental', is_flag=True,
+              help='Only write ASINs that are new or changed since earlier jobs')
+@click.option('--refresh-hours', default=config.INCREMENTAL_REFRESH_HOURS,
+              help='With --incremental, skip ASINs checked within this many hours')
+@click.option('--max-depth', default=config.FRONTIER_MAX_DEPTH,
+              help='Relationship hops to follow from search result ASINs')
+@click.option('--asin-budget', default=config.FRONTIER_ASIN_BUDGET,
+              help='Maximum distinct ASINs sent to MWS for the job')
+@click.option('--max-duration', type=float,
+              help='Seconds the crawl may take before queued work is deferred and results saved')
+@click.option('--max-pages', type=int, help='Search result pages read before page intake stops')
+@click.option('--max-api-calls', type=int,
+              help='MWS requests sent before queued work is deferred and results saved')
+@click.option('--daemon-url', default=config.DAEMON_URL, help='Base url of the running daemon')
+@click.option('--wait', is_flag=True, help='Wait for the job to finish, printing its progress')
+def submit(category, terms, market, details, pricing, incremental, refresh_hours, max_depth,
+           asin_budget, max_duration, max_pages, max_api_calls, daemon_url, wait):
+    """
+    Submit a job to a running daemon
+
+    """
+    import json
+    import aws_searcher.daemon as job_daemon
+
+    try:
+        status = job_daemon.submit_job(daemon_url, {
+            'category': category, 'terms': terms, 'market': market, 'details': details,
+            'pricing': pricing,
+            'incremental': incremental, 'refresh_hours': refresh_hours,
+            'max_depth': max_depth, 'asin_budget': asin_budget, 'max_duration': max_duration,
+            'max_pages': max_pages, 'max_api_calls': max_api_calls})
+        click.echo('Submitted as %d' % status['id'])
+        if wait:
+            status = job_daemon.wait_for_job(
+                daemon_url, status['id'],
+                on_poll=lambda polled: click.echo(json.dumps(polled['progress']), err=True))
+    except (job_daemon.DaemonError, OSError) as e:
+        raise click.ClickException(str(e))
+    if wait:
+        click.echo(json.dumps(status))
+        if status['state'] == 'failed':
+            raise click.ClickException('Job failed: %s' % status['error'])
+
+
+@cli.command()
+@click.option('--category', required=True, help="Amazon Search Category")
+@click.option('--terms', required=True, help='Search terms')
+@click.option('--market', default=config.MARKETPLACE_IDS['US'], help='Region Marketplace ID')
+@click.option('--pricing', is_flag=True, help='Include the competitive pricing stage')
+@click.option('--max-depth', default=config.FRONTIER_MAX_DEPTH,
+              help='Relationship hops the crawl would follow')
+@click.option('--asin-budget', default=config.FRONTIER_ASIN_BUDGET,
+              help='Maximum distinct ASINs the crawl would send to MWS')
+@click.option('--sample-pages', default=config.ESTIMATE_SAMPLE_PAGES,
+              help='Search pages read, page 1 included')
+@click.option('--sample-asins', default=config.ESTIMATE_SAMPLE_ASINS,
+              help='ASINs looked up on MWS per relationship hop')
+def estimate(category, terms, market, pricing, max_depth, asin_budget, sample_pages,
+             sample_asins):
+    """
+    Print the pages, ASINs, MWS requests and runtime a crawl would take, as JSON
 
-    data_dir = Path.home() / config.DATA_DIRECTORY
-    db_dir = Path.home() / config.DB_DIRECTORY
-    jobs_dir = Path.home() / config.JOBS_DIRECTORY
+    """
+    import json
+    from aws_searcher.estimate import estimate as estimate_crawl
+
+    listener = configure_logging()
+    try:
+        result = estimate_crawl(category, terms, market, sample_pages=sample_pages,
+                                sample_asins=sample_asins, max_depth=max_depth,
+                                asin_budget=asin_budget, pricing=pricing)
+    finally:
+        listener.stop()
+    click.echo(json.dumps(result))
+
+
+@cli.command()
+@click.argument('submission_id', type=int, required=False)
+@click.option('--daemon-url', default=config.DAEMON_URL, help='Base url of the running daemon')
+def status(submission_id, daemon_url):
+    """
+    Print the status of daemon submissions as JSON lines
 
-    db_dir.mkdir(parents=True, exist_ok=True)
-    data_dir.mkdir(parents=True, exist_ok=True)
-    jobs_dir.mkdir(parents=True, exist_ok=True)
+    """
+    import json
+    import aws_searcher.daemon as job_daemon
+
+    try:
+        statuses = job_daemon.job_status(daemon_url, submission_id)
+    except (job_daemon.DaemonError, OSError) as e:
+        raise click.ClickException(str(e))
+    for job in statuses if submission_id is None else [statuses]:
+        click.echo(json.dumps(job))
+
+
+@cli.command()
+@click.option('--asin', 'asins', multiple=True, help='ASIN to match, may be repeated')
+@click.option('--brand', 'brands', multiple=True, help='Brand to match, may be repeated')
+@click.option('--job-from', type=int, help='Lowest job id')
+@click.option('--job-to', type=int, help='Highest job id')
+@click.option('--last-jobs', type=int, help='Only the most recent N jobs')
+@click.option('--min-price', type=float, help='Lowest price')
+@click.option('--max-price', type=float, help='Highest price')
+@click.option('--limit', type=int, help='Maximum rows')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'json']), default='csv',
+              help='CSV with a header, or one JSON object per line')
+@click.option('--output', type=click.File('w'), default='-', help='Output file (stdout by default)')
+@click.option('--backfill', is_flag=True,
+              help='First index results of jobs that ran before product_results existed')
+def query(asins, brands, job_from, job_to, last_jobs, min_price, max_price, limit,
+          output_format, output, backfill):
+    """
+    Look up results across all jobs
 
-    logging.info('Confirming db exists and creating job entry')
-    engine = models.get_engine(db_dir / 'amazon.db')
-    models.BASE.metadata.create_all(bind=engine)
+    """
+    import aws_searcher.models as models
+    import aws_searcher.query as results
 
-    job_record = engine.execute(models.Jobs.__table__.insert().values(category=category,
-                                                                      terms=terms))
-    job_id = job_record.inserted_primary_key[0]
+    engine = models.results_engine()
+    if backfill:
+        click.echo('Indexed %d rows from earlier jobs' % results.backfill(engine), err=True)
+    if last_jobs is not None:
+        job_from = max(job_from or 0, results.last_jobs_start(engine, last_jobs) or 0)
 
-    this_job_dir = jobs_dir / str(job_id)
+    rows = results.iter_results(engine, asins=list(asins), brands=list(brands),
+                                job_from=job_from, job_to=job_to, min_price=min_price,
+                                max_price=max_price, limit=limit)
+    writer = results.write_json if output_format == 'json' else results.write_csv
+    click.echo('%d rows' % writer(rows, output), err=True)
 
-    this_job_dir.mkdir(parents=True, exist_ok=True)
 
-    output_name = '_'.join([category.lower(), terms.lower()])
+@cli.command()
+@click.argument('asin')
+@click.option('--market', default=config.MARKETPLACE_IDS['US'], help='Region Marketplace ID')
+@click.option('--max-age', default=config.FAMILY_MAX_AGE_HOURS,
+              help='Ignore relationships last seen more than this many hours ago')
+def family(asin, market, max_age):
+    """
+    Print the variation family of an ASIN known from earlier jobs, parent first
 
-    logging.info("Processing page 1")
+    """
+    import aws_searcher.models as models
+    from aws_searcher.family import FamilyGraph
 
-    first_page_dict = tasks.get_first_page(category, terms)
-    logging.info("Page processed, adding ASINs to queue")
+    members = FamilyGraph(models.results_engine(), market, max_age=max_age).family(asin)
+    if not members:
+        raise click.ClickException('No known variation family for %s' % asin)
+    for member in members:
+        click.echo(member)
+
+
+@cli.group()
+def cache():
+    """
+    Inspect or prune the search result page cache
 
-    asin_queue = Queue()
-    processed_queue = Queue()
-    blocker_queue = Queue()
+    """
+    pass
 
-    for asin_group in tasks.grouper(5, first_page_dict['asins']):
-        asin_queue.put(asin_group)
 
-    page_queue = Queue()
-    pages = list(range(2, first_page_dict['last_page_number'] + 1))
-    for page in pages:
-        page_queue.put({'category': category, 'search_terms': terms, 'page_number': page})
+@cache.command()
+def stats():
+    """
+    Print cache size and hit/miss statistics
 
-    for thread_number in range(4):
-        worker = threading.Thread(target=tasks.page_worker, args=(page_queue,
-                                                                  asin_queue,
-                                                                  processed_queue,))
-        worker.setDaemon(True)
-        worker.start()
+    """
+    for key, value in _response_cache().stats().items():
+        click.echo('%s: %s' % (key, value))
 
-    page_queue.join()
 
-    for thread_number in range(4):
-        worker = threading.Thread(target=tasks.api_worker, args=(asin_queue,
-                                                                 processed_queue,
-                                                                 blocker_queue,
-                                                                 market,))
-        worker.setDaemon(True)
-        worker.start()
+@cache.command()
+@click.option('--ttl', default=config.CACHE_TTL_SECONDS, help='Remove entries older than this')
+@click.option('--all', 'clear', is_flag=True, help='Remove every entry')
+def prune(ttl, clear):
+    """
+    Remove expired entries and enforce the cache size limit
 
-    asin_queue.join()
+    """
+    removed = _response_cache(ttl).prune(clear=clear)
+    click.echo('Removed %d cached responses' % removed)
 
-    logging.info("Collecting JSON data into one file")
-    tasks.combine_json_files(output_name)
 
-    logging.info("Collecting output data for db load and final output")
-    all_data_files = pd.concat(pd.read_csv(f.as_posix()) for f in data_dir.glob('*.csv'))
-    all_data_files['job'] = job_id
+@cli.group()
+def index():
+    """
+    Inspect or rebuild the index of ASINs fetched across jobs
 
-    all_relationship_files = pd.concat(pd.read_csv(f.as_posix()) for f in data_dir.glob('*.dat'))
-    all_relationship_files['job'] = job_id
+    """
+    pass
 
-    all_attribute_files = pd.concat(pd.read_csv(f.as_posix()) for f in data_dir.glob('*.txt'))
-    all_attribute_files['job'] = job_id
 
-    tasks.remove_files(data_dir, 'csv')
-    tasks.remove_files(data_dir, 'txt')
-    tasks.remove_files(data_dir, 'dat')
+@index.command('stats')
+@click.option('--market', default=config.MARKETPLACE_IDS['US'], help='Region Marketplace ID')
+def index_stats(market):
+    """
+    Print the ASIN count and file size of a marketplace's index
 
-    out_data_csv = this_job_dir / (output_name + '.csv')
-    out_relationship_csv = this_job_dir / (output_name + '_relationships.csv')
-    out_attributes_csv = this_job_dir / (output_name + '_attributes.csv')
-    failed_asins_txt = this_job_dir / (output_name + '_failed_asins.txt')
+    """
+    from aws_searcher.asin_index import AsinIndex, index_path
 
-    logging.info("Saving %s" % out_data_csv)
-    all_data_files.to_csv(out_data_csv.as_posix(), index=False)
+    path = index_path(market)
+    asin_index = AsinIndex(path)
+    click.echo('asins: %d' % len(asin_index))
+    click.echo('bytes: %d' % (path.stat().st_size if path.exists() else 0))
+    asin_index.close()
 
-    logging.info("Inserting annotated data into database")
-    all_data_files.to_sql('annotated_data_' + str(job_id),
-                          con=engine, if_exists='append', index=False)
 
-    logging.info("Saving %s" % out_relationship_csv)
-    all_relationship_files.to_csv(out_relationship_csv.as_posix(), index=False)
-    logging.info("Inserting relationships into database")
-    all_relationship_files.to_sql('relationships', con=engine, if_exists='append', index=False)
+@index.command('build')
+@click.option('--market', default=config.MARKETPLACE_IDS['US'], help='Region Marketplace ID')
+def index_build(market):
+    """
+    Rebuild a marketplace's index from the asin_snapshots table
 
-    logging.info("Saving %s" % out_attributes_csv)
-    all_attribute_files.to_csv(out_attributes_csv.as_posix(), index=False)
-    logging.info("Inserting attributes into database")
-    all_attribute_files.to_sql('attributes_' + str(job_id), con=engine, if_exists='append',
-                               index=False)
+    """
+    import aws_searcher.models as models
+    from aws_searcher.asin_index import build_index, index_path
+
+    written = build_index(models.results_engine(), market, index_path(market))
+    click.echo('Indexed %d ASINs' % written)
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', help='Interface to bind')
+@click.option('--search-port', default=8080, help='Port for synthetic search result pages')
+@click.option('--mws-port', default=8081, help='Port for the GetMatchingProduct stand-in')
+@click.option('--pages', default=config.SIMULATOR_PAGE_COUNT, help='Result pages per search')
+@click.option('--per-page', default=config.SIMULATOR_RESULTS_PER_PAGE, help='ASINs per page')
+@click.option('--children', default=0, help='Variation children per search result ASIN')
+@click.option('--latency', default=0.0, help='Mean added response latency in seconds')
+@click.option('--stall-rate', default=0.0, help='Fraction of responses that stall')
+@click.option('--stall-seconds', default=10.0, help='Seconds a stalled response waits')
+@click.option('--block-rate', default=0.0, help='Fraction of pages answered with a robot check')
+@click.option('--error-rate', default=0.0, help='Fraction of MWS requests that fail')
+@click.option('--quota', default=config.SIMULATOR_MWS_QUOTA, help='MWS maximum request quota')
+@click.option('--restore-rate', default=config.SIMULATOR_MWS_RESTORE_RATE,
+              help='MWS quota restored per second')
+def simulate(host, search_port, mws_port, pages, per_page, children, latency, stall_rate,
+             stall_seconds, block_rate, error_rate, quota, restore_rate):
+    """
+    Serve local stand-ins for Amazon search and MWS for load testing
 
-    failed_asins_list = list(blocker_queue.queue)
-    if failed_asins_list:
-        logging.warning("Serializing failed asins, total %d" % len(failed_asins_list))
-        with failed_asins_txt.open('w') as outfile:
-            outfile.write(','.join(failed_asins_list))
-        logging.warning("Failed ASINs are failed")
+    """
+    from aws_searcher.simulator import Simulator, serve
 
-    logging.info("Run complete")
+    serve(Simulator(page_count=pages, results_per_page=per_page, variation_children=children,
+                    latency=latency, stall_rate=stall_rate, stall_seconds=stall_seconds,
+                    block_rate=block_rate, error_rate=error_rate, quota=quota,
+                    restore_rate=restore_rate),
+          host, search_port, mws_port)
 
 
 if __name__ == '__main__':
-    run()
+    cli()
@@ -0,0 +1,248 @@
+"""
+Adaptive worker concurrency for the pipeline stages
+
+Each stage keeps a target worker count that is adjusted with AIMD (additive
+increase, multiplicative decrease) from what its workers observed since the
+last adjustment: task latency, error rate and throttling.  Workers report
+through Stage.record and leave through Stage.should_retire when the target
+shrinks; the controller's monitor thread starts new workers when it grows.
+ConcurrencyController.shutdown drops every target to zero and wakes the workers
+blocked on their input so that they all exit.
+"""
+import logging
+import threading
+import time
+from queue import Queue
+from typing import Callable, Dict, List, Tuple
+
+import aws_searcher.config as config
+
+# Put on a stage's input queue at shutdown, the worker taking it marks it done and exits
+STOP = object()
+
+
+def queue_waker(q: Queue) -> Callable[[int], None]:
+    """
+    Wake callback for workers blocked on a queue, see ConcurrencyController.add_stage
+
+    Args:
+        q: Input queue of the stage
+
+    Returns:
+        Function putting one STOP per worker on the queue
+    """
+    def wake(count: int):
+        for _ in range(count):
+            q.put(STOP)
+    return wake
+
+
+class Stage(object):
+    """
+    Worker count and observations for one pipeline stage
+
+    Args:
+        name: Stage name used in logs and thread names
+
+    Keyword Args:
+        min_workers: Lower bound on workers
+        max_workers: Upper bound on workers
+        initial_workers: Starting target
+        latency_target: Task latency (seconds, 90th percentile) above which the stage backs off
+        error_threshold: Error rate above which the stage backs off
+        increase: Workers added per healthy adjustment
+        decrease: Multiplier applied to workers on an unhealthy adjustment
+    """
+
+    def __init__(self, name: str,
+                 min_workers: int = 1,
+                 max_workers: int = 16,
+                 initial_workers: int = 4,
+                 latency_target: float = 10.0,
+                 error_threshold: float = config.AIMD_ERROR_THRESHOLD,
+                 increase: int = config.AIMD_INCREASE,
+                 decrease: float = config.AIMD_DECREASE):
+        self.name = name
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target = max(min_workers, min(max_workers, initial_workers))
+        self.latency_target = latency_target
+        self.error_threshold = error_threshold
+        self.increase = increase
+        self.decrease = decrease
+        self.active = 0
+        self._latencies = []  # type: List[float]
+        self._errors = 0
+        self._throttled = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: bool = False, throttled: bool = False):
+        """
+        Report one finished task
+
+        Args:
+            latency: Seconds the task took
+
+        Keyword Args:
+            error: Task failed
+            throttled: Task failed because the endpoint throttled or blocked us
+
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            self._errors += int(error or throttled)
+            self._throttled += int(throttled)
+
+    def should_retire(self) -> bool:
+        """
+        Called by a worker between tasks, True means the worker should exit
+
+        Returns:
+            True if there are more workers than the current target
+        """
+        with self._lock:
+            if self.active > self.target:
+                self.active -= 1
+                return True
+            return False
+
+    def adjust(self) -> int:
+        """
+        Apply AIMD to the observations gathered since the last call
+
+        Returns:
+            New target worker count
+        """
+        with self._lock:
+            latencies, errors, throttled = sorted(self._latencies), self._errors, self._throttled
+            self._latencies, self._errors, self._throttled = [], 0, 0
+
+        if not latencies:
+            return self.target
+
+        p90 = latencies[int(0.9 * (len(latencies) - 1))]
+        error_rate = errors / len(latencies)
+        previous = self.target
+
+        if throttled or error_rate > self.error_threshold or p90 > self.latency_target:
+            self.target = max(self.min_workers, int(self.target * self.decrease))
+            decision = 'decrease'
+        else:
+            self.target = min(self.max_workers, self.target + self.increase)
+            decision = 'increase'
+
+        logging.info("Concurrency %s: %s %d -> %d workers (tasks %d, p90 latency %.2fs, "
+                     "error rate %.2f, throttled %d)", self.name, decision, previous,
+                     self.target, len(latencies), p90, error_rate, throttled)
+        return self.target
+
+
+class ConcurrencyController(object):
+    """
+    Runs workers for each registered stage and resizes them periodically
+
+    Keyword Args:
+        interval: Seconds between adjustments
+    """
+
+    def __init__(self, interval: float = config.CONCURRENCY_ADJUST_INTERVAL):
+        self.interval = interval
+        self.stages = {}  # type: Dict[str, Tuple[Stage, Callable, tuple]]
+        self._wake = {}  # type: Dict[str, Callable[[int], None]]
+        self._threads = []  # type: List[threading.Thread]
+        self._stop = threading.Event()
+        self._monitor = None
+        self._lock = threading.Lock()
+        self._thread_count = 0
+
+    def add_stage(self, stage: Stage, target: Callable, args: tuple,
+                  wake: Callable[[int], None] = None) -> Stage:
+        """
+        Register a stage and start its initial workers.  The worker function is
+        called as target(*args, stage=stage)
+
+        Args:
+            stage: Stage settings
+            target: Worker function
+            args: Positional arguments for the worker
+
+        Keyword Args:
+            wake: Called by shutdown with the number of running workers to unblock
+                the ones waiting on the stage's input
+
+        Returns:
+            The registered stage
+        """
+        with self._lock:
+            self.stages[stage.name] = (stage, target, args)
+            if wake is not None:
+                self._wake[stage.name] = wake
+        self._scale(stage.name)
+        return stage
+
+    def _scale(self, name: str):
+        with self._lock:
+            stage, target, args = self.stages[name]
+            while stage.active < stage.target:
+                self._thread_count += 1
+                worker = threading.Thread(target=target, args=args, kwargs={'stage': stage},
+                                          name='%s-worker-%d' % (name, self._thread_count))
+                worker.daemon = True
+                stage.active += 1
+                self._threads.append(worker)
+                worker.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for name in list(self.stages):
+                self.stages[name][0].adjust()
+                self._scale(name)
+
+    def start(self):
+        """
+        Start the monitor thread
+
+        """
+        self._monitor = threading.Thread(target=self._run, name='concurrency-controller')
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def stop(self):
+        """
+        Stop adjusting, running workers are left alone
+
+        """
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+
+    def shutdown(self, timeout: float = config.CONCURRENCY_SHUTDOWN_TIMEOUT) -> int:
+        """
+        Stop adjusting and make every worker exit: the stage targets drop to zero so
+        workers retire between tasks, and each stage's wake callback unblocks the
+        workers waiting for input
+
+        Keyword Args:
+            timeout: Seconds to wait for all workers together
+
+        Returns:
+            Number of workers still running after the timeout, 0 if already shut down
+        """
+        if self._stop.is_set() and not self._threads:
+            return 0
+        self.stop()
+        with self._lock:
+            for name, (stage, _, _) in self.stages.items():
+                stage.min_workers = stage.target = 0
+                if name in self._wake:
+                    self._wake[name](stage.active)
+            threads, self._threads = self._threads, []
+
+        deadline = time.monotonic() + timeout
+        for worker in threads:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        running = [worker.name for worker in threads if worker.is_alive()]
+        if running:
+            logging.warning("%d workers still running after shutdown: %s",
+                            len(running), ', '.join(running))
+        return len(running)
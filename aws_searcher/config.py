@@ -1,6 +1,8 @@
 """
 Configuration file for global variables and settings
 """
+import os
+
 REQUEST_HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) '
                                  'AppleWebKit/537.36 (KHTML, like Gecko) '
                                  'Chrome/63.0.3239.132 Safari/537.36'}
@@ -8,10 +10,16 @@ REQUEST_HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6
 AMAZON_INITIAL_REFERENCE = "nb_sb_noss_"
 PAGINATION_BASED_REFERENCE = "src_pg_"
 
-AMAZON_BASE_URL = 'https://www.amazon.com'
-AMAZON_SEARCH_URL_TEMPLATE = "https://www.amazon.com/s/ref=" \
-                             "{reference}{page_number}?url={category}" \
-                             "&page={page_number}&field-keywords={search}"
+# Both endpoints can be pointed at the local simulator (aws_searcher.simulator)
+AMAZON_BASE_URL = os.getenv('AWS_SEARCHER_AMAZON_URL', 'https://www.amazon.com')
+AMAZON_SEARCH_URL_TEMPLATE = AMAZON_BASE_URL + "/s/ref=" \
+                                               "{reference}{page_number}?url={category}" \
+                                               "&page={page_number}&field-keywords={search}"
+MWS_DOMAIN = os.getenv('AWS_SEARCHER_MWS_URL', '')
+
+# Politeness delay between page requests, in seconds ("floor,ceiling")
+REQUEST_DELAY = tuple(int(value) for value in
+                      os.getenv('AWS_SEARCHER_REQUEST_DELAY', '2,6').split(','))
 
 ITEM_ATTRIBUTE_KEY_LIST = ['Product', 'AttributeSets', 'ItemAttributes']
 ASIN_KEY_LIST = ['ASIN', 'value']
@@ -32,6 +40,17 @@ RELATIONSHIP_KEYS = {
 DATA_DIRECTORY = 'mws/data'
 DB_DIRECTORY = 'mws/db'
 JOBS_DIRECTORY = 'mws/jobs'
+CACHE_DIRECTORY = 'mws/cache'
+INDEX_DIRECTORY = 'mws/index'
+
+# Seconds a SQLite write waits for another job's write to finish
+SQLITE_BUSY_TIMEOUT = 60
+
+CACHE_FILE_NAME = 'responses.db'
+CACHE_TTL_SECONDS = 12 * 60 * 60
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Lookups between writes of cache access times and hit/miss counts
+CACHE_FLUSH_LOOKUPS = 100
 
 MARKETPLACE_IDS = {
     'US': 'ATVPDKIKX0DER'
@@ -39,6 +58,144 @@ MARKETPLACE_IDS = {
 
 GROUP_COUNT = 5
 
+# Adaptive worker concurrency, see aws_searcher.concurrency
+CONCURRENCY_ADJUST_INTERVAL = 5.0
+# Seconds a job waits for its workers to exit, requests in flight are bounded by their timeouts
+CONCURRENCY_SHUTDOWN_TIMEOUT = 30.0
+AIMD_INCREASE = 1
+AIMD_DECREASE = 0.5
+AIMD_ERROR_THRESHOLD = 0.1
+STAGE_CONCURRENCY = {
+    'page': {'min_workers': 1, 'max_workers': 16, 'initial_workers': 4, 'latency_target': 10.0},
+    'api': {'min_workers': 1, 'max_workers': 16, 'initial_workers': 4, 'latency_target': 5.0},
+    'detail': {'min_workers': 1, 'max_workers': 8, 'initial_workers': 2, 'latency_target': 10.0},
+    'pricing': {'min_workers': 1, 'max_workers': 4, 'initial_workers': 1, 'latency_target': 5.0},
+}
+
+# Product detail page stage: token bucket burst and requests per second
+DETAIL_PAGE_BURST = 2
+DETAIL_PAGE_RATE = 1.0
+DETAIL_COLUMNS = {'price': 'buy_box_price', 'sellers': 'sellers'}
+
+# Competitive pricing stage: ASINs per request, seconds a partial batch waits for more
+# ASINs, the longest a worker idles while the queued ASINs back off from a failed batch,
+# and the quota of each pricing operation (maximum requests, restored per second)
+MWS_PRODUCTS_NAMESPACE = 'http://mws.amazonservices.com/schema/Products/2011-10-01'
+PRICING_BATCH_SIZE = 20
+PRICING_BATCH_WAIT = 2.0
+PRICING_BACKOFF_POLL = 1.0
+PRICING_QUOTA = 20
+PRICING_RESTORE_RATE = 10.0
+PRICING_COLUMNS = ['competitive_price', 'competitive_currency', 'offer_count',
+                   'lowest_offer_price', 'lowest_offer_currency']
+# Price history sources and the (price, currency) columns of the rows they are read from
+PRICE_SOURCES = {'list': ('price', 'currency'),
+                 'competitive': ('competitive_price', 'competitive_currency'),
+                 'lowest_offer': ('lowest_offer_price', 'lowest_offer_currency')}
+
+# Logging: records queued for the listener thread before new ones are dropped, and
+# per message template rate (per second) and burst for sampled hot-path lines
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_RATE = 1.0
+LOG_SAMPLE_BURST = 5
+
+# Profiling: seconds between stack samples, tracemalloc frames kept per allocation and
+# source lines reported in the finalize memory diff
+PROFILE_SAMPLE_INTERVAL = 0.01
+TRACEMALLOC_FRAMES = 1
+TRACEMALLOC_TOP = 25
+
+# Rows fetched per round trip when streaming query results
+QUERY_BATCH_SIZE = 5000
+
+# Decimal places of currencies whose minor unit is not a hundredth
+CURRENCY_MINOR_UNITS = {'JPY': 0}
+DEFAULT_MINOR_UNITS = 2
+
+# Search pages: pages queued past the furthest page with results, and an upper bound
+PAGINATION_PROBE_AHEAD = 4
+PAGINATION_MAX_PAGES = 400
+
+# Daemon: local job API address, jobs run at once and seconds between client status polls
+DAEMON_URL = os.getenv('AWS_SEARCHER_DAEMON_URL', 'http://127.0.0.1:8765')
+DAEMON_MAX_JOBS = 2
+DAEMON_POLL_INTERVAL = 2.0
+
+# Request timeouts in seconds: to connect, and between bytes of the response
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+
+# Pooled sessions: hosts each thread keeps connections to, connections kept per host
+TRANSPORT_POOL_CONNECTIONS = 4
+TRANSPORT_POOL_MAXSIZE = 4
+
+# Egress routes for search and detail pages: HTTP proxies ('direct' for no proxy, comma
+# separated), header profiles handed to the routes in turn, requests per second and burst
+# of each route, weight of the latest outcome in a route's error and block rates, the
+# least traffic weight a failing route keeps so that its recovery is noticed, and routes
+# tried for one page before giving up on it
+EGRESS_PROXIES = [proxy for proxy in os.getenv('AWS_SEARCHER_PROXIES', '').split(',') if proxy]
+HEADER_PROFILES = [
+    REQUEST_HEADERS,
+    {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:58.0) Gecko/20100101 '
+                   'Firefox/58.0'},
+    {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_3) AppleWebKit/604.5.6 '
+                   '(KHTML, like Gecko) Version/11.0.3 Safari/604.5.6'},
+]
+EGRESS_ROUTE_RATE = 1.0
+EGRESS_ROUTE_BURST = 2
+EGRESS_HEALTH_ALPHA = 0.1
+EGRESS_MIN_WEIGHT = 0.05
+EGRESS_MAX_ATTEMPTS = 3
+# Text of the robot check page Amazon serves (with a 200) instead of the page asked for
+BLOCK_PAGE_MARKERS = ['/errors/validateCaptcha', '<title dir="ltr">Robot Check</title>']
+
+# Job budgets: seconds between checks while waiting for the stages to go idle, and the
+# file in the job directory work deferred by a stopped job is written to
+DEADLINE_POLL_INTERVAL = 0.5
+RESUME_STATE_FILE = 'resume.json'
+
+# Hedged search page requests: percentile of recent latencies after which a duplicate
+# request is sent, latencies needed before hedging starts, latencies kept and the threads
+# running requests (primaries and duplicates)
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+HEDGE_MAX_WORKERS = 48
+
+# MWS request retries: attempts before dead-lettering, backoff ceilings in seconds
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 120.0
+
+# Crawl frontier: relationship hops from a search result ASIN, distinct ASINs per job,
+# queued ASINs held in memory before spilling to disk, queued ASINs before page workers wait
+FRONTIER_MAX_DEPTH = 2
+FRONTIER_ASIN_BUDGET = 50000
+FRONTIER_MEMORY_LIMIT = 100000
+FRONTIER_MAX_PENDING = 1000000
+
+# Estimate mode: search pages and ASINs per relationship hop sampled, and the
+# GetMatchingProduct quota (maximum requests, restored per second) runtimes are based on,
+# which the daemon also paces its jobs' requests with
+ESTIMATE_SAMPLE_PAGES = 3
+ESTIMATE_SAMPLE_ASINS = 10
+MWS_PRODUCT_QUOTA = 20
+MWS_PRODUCT_RESTORE_RATE = 2.0
+
+# Hours a variation family learned by an earlier job is trusted for expanding the frontier
+FAMILY_MAX_AGE_HOURS = 72
+
+# Product keys left out of the incremental change hash because they move every day
+INCREMENTAL_IGNORED_KEYS = ['SalesRankings']
+INCREMENTAL_REFRESH_HOURS = 0
+
+SIMULATOR_RESULTS_PER_PAGE = 16
+SIMULATOR_PAGE_COUNT = 20
+# GetMatchingProduct throttling: maximum request quota and restore rate per second
+SIMULATOR_MWS_QUOTA = 20
+SIMULATOR_MWS_RESTORE_RATE = 2.0
+
 CATEGORIES_DICT = {'Alexa Skills': 'search-alias=alexa-skills',
                    'All Departments': 'search-alias=aps',
                    'Amazon Devices': 'search-alias=amazon-devices',
@@ -0,0 +1,339 @@
+"""
+Long running job daemon with a local HTTP API
+
+The daemon keeps the results db engine, the response cache, the worker
+counts each stage settled on (the throttling it learned from MWS) and the
+MWS quota and detail page rate limiters alive between jobs, and runs
+submitted jobs concurrently on a small thread pool, so that concurrent jobs
+share one budget of requests instead of each spending a full one.
+Jobs are submitted and inspected as JSON over HTTP on the loopback
+interface::
+
+    POST /jobs          {"category": ..., "terms": ..., ...}  -> 202 job status
+    GET  /jobs                                               -> {"jobs": [...]}
+    GET  /jobs/<id>                                          -> job status
+
+Only the standard library is imported at module load so that the client
+functions stay light; the pipeline is imported when a JobManager is created.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from typing import Callable, List
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+import aws_searcher.config as config
+
+try:
+    from http.server import ThreadingHTTPServer
+except ImportError:  # pragma: no cover
+    # Python 3.6
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+        """
+        HTTPServer handling each request on its own thread
+        """
+        daemon_threads = True
+
+# run_job keyword arguments a submission may set
+JOB_PARAMETERS = ['market', 'details', 'pricing', 'incremental', 'refresh_hours', 'max_depth',
+                  'asin_budget', 'max_duration', 'max_pages', 'max_api_calls']
+
+
+class DaemonError(Exception):
+    """
+    Raised by the client functions when the daemon refuses a request
+    """
+    pass
+
+
+class JobManager(object):
+    """
+    Runs submitted jobs on shared warm state and keeps their status
+
+    Keyword Args:
+        max_jobs: Jobs run at the same time, later submissions wait
+        engine: SQLAlchemy engine for the results db (the home directory db if not given)
+        run_job: Job function, pipeline.run_job if not given
+    """
+
+    def __init__(self, max_jobs: int = config.DAEMON_MAX_JOBS, engine=None,
+                 run_job: Callable = None):
+        import aws_searcher.models as models
+        import aws_searcher.pipeline as pipeline
+        from aws_searcher.pricing import PricingScheduler
+        from aws_searcher.ratelimit import TokenBucket
+
+        self.engine = engine or models.results_engine()
+        self.run_job = run_job or pipeline.run_job
+        self._progress = pipeline.JobProgress
+        self.stage_targets = {}
+        self.pricing_scheduler = PricingScheduler()
+        self.detail_limiter = TokenBucket(config.DETAIL_PAGE_BURST, config.DETAIL_PAGE_RATE)
+        self.product_limiter = TokenBucket(config.MWS_PRODUCT_QUOTA,
+                                           config.MWS_PRODUCT_RESTORE_RATE)
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs)
+
+    def submit(self, params: dict) -> dict:
+        """
+        Queue a job
+
+        Args:
+            params: 'category' and 'terms', and optionally any of JOB_PARAMETERS
+
+        Returns:
+            Status of the new submission
+
+        Raises:
+            ValueError: Unknown category, missing terms or unknown parameters
+        """
+        if params.get('category') not in config.CATEGORIES_DICT:
+            raise ValueError('Unknown category %r' % params.get('category'))
+        if not params.get('terms'):
+            raise ValueError('Search terms are required')
+        unknown = set(params) - set(JOB_PARAMETERS) - {'category', 'terms'}
+        if unknown:
+            raise ValueError('Unknown parameters: %s' % ', '.join(sorted(unknown)))
+
+        with self._lock:
+            submission_id = next(self._ids)
+            self.jobs[submission_id] = {'id': submission_id, 'state': 'queued',
+                                        'params': dict(params), 'submitted': time.time(),
+                                        'started': None, 'finished': None, 'error': None,
+                                        'progress': self._progress()}
+        self._executor.submit(self._run, submission_id)
+        return self.status(submission_id)
+
+    def _run(self, submission_id: int):
+        job = self.jobs[submission_id]
+        job['state'] = 'running'
+        job['started'] = time.time()
+        params = dict(job['params'])
+        try:
+            self.run_job(params.pop('category'), params.pop('terms'),
+                         params.pop('market', config.MARKETPLACE_IDS['US']),
+                         engine=self.engine, progress=job['progress'],
+                         stage_targets=self.stage_targets,
+                         pricing_scheduler=self.pricing_scheduler,
+                         detail_limiter=self.detail_limiter,
+                         product_limiter=self.product_limiter, **params)
+            job['state'] = 'complete'
+        except Exception as e:
+            logging.exception("Submission %d failed", submission_id)
+            job['state'] = 'failed'
+            job['error'] = str(e)
+        job['finished'] = time.time()
+
+    def status(self, submission_id: int) -> dict:
+        """
+        Status and progress of one submission
+
+        Args:
+            submission_id: Id returned by submit
+
+        Returns:
+            Status dict, None for an unknown id
+        """
+        job = self.jobs.get(submission_id)
+        if job is None:
+            return None
+        status = {key: value for key, value in job.items() if key != 'progress'}
+        status['progress'] = job['progress'].snapshot()
+        return status
+
+    def statuses(self) -> List[dict]:
+        """
+        Status of every submission, oldest first
+
+        Returns:
+            List of status dicts
+        """
+        return [self.status(submission_id) for submission_id in sorted(self.jobs)]
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop accepting jobs
+
+        Keyword Args:
+            wait: Wait for queued and running jobs to finish
+
+        """
+        self._executor.shutdown(wait=wait)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pragma: no cover
+        pass
+
+    def _respond(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        manager = self.server.manager  # type: JobManager
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if parts == ['jobs']:
+            self._respond(200, {'jobs': manager.statuses()})
+        elif len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit() \
+                and manager.status(int(parts[1])) is not None:
+            self._respond(200, manager.status(int(parts[1])))
+        else:
+            self._respond(404, {'error': 'Not found: %s' % self.path})
+
+    def do_POST(self):
+        manager = self.server.manager  # type: JobManager
+        length = int(self.headers.get('Content-Length') or 0)
+        if urlparse(self.path).path.strip('/') != 'jobs':
+            self._respond(404, {'error': 'Not found: %s' % self.path})
+            return
+        try:
+            params = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            if not isinstance(params, dict):
+                raise ValueError('Expected a JSON object')
+            self._respond(202, manager.submit(params))
+        except ValueError as e:
+            self._respond(400, {'error': str(e)})
+
+
+def start(manager: JobManager, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """
+    Serve the job API on a background thread
+
+    Args:
+        manager: JobManager running the jobs
+
+    Keyword Args:
+        host: Interface to bind
+        port: Port (0 picks a free port)
+
+    Returns:
+        Running server, its url is http://host:port from server.server_address
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.manager = manager
+    threading.Thread(target=server.serve_forever, name='daemon-api', daemon=True).start()
+    return server
+
+
+def serve(manager: JobManager, host: str = '127.0.0.1', port: int = 8765):  # pragma: no cover
+    """
+    Run the job API in the foreground until interrupted, then wait for running jobs
+
+    Args:
+        manager: JobManager running the jobs
+
+    Keyword Args:
+        host: Interface to bind
+        port: Port
+
+    """
+    server = start(manager, host, port)
+    logging.info("Daemon listening on http://%s:%d", *server.server_address[:2])
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        server.server_close()
+        logging.info("Waiting for running jobs to finish")
+        manager.shutdown()
+
+
+def _request(url: str, payload: dict = None) -> dict:
+    """
+    Send a request to the daemon
+
+    Args:
+        url: Full url
+
+    Keyword Args:
+        payload: JSON body, the request is a POST when given
+
+    Returns:
+        Decoded JSON response
+
+    Raises:
+        DaemonError: The daemon answered with an error status
+    """
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request = Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urlopen(request) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except HTTPError as e:
+        raise DaemonError(json.loads(e.read().decode('utf-8')).get('error', str(e)))
+
+
+def submit_job(daemon_url: str, params: dict) -> dict:
+    """
+    Submit a job to a running daemon
+
+    Args:
+        daemon_url: Daemon base url
+        params: Job parameters, see JobManager.submit
+
+    Returns:
+        Status of the new submission
+    """
+    return _request(daemon_url.rstrip('/') + '/jobs', params)
+
+
+def job_status(daemon_url: str, submission_id: int = None):
+    """
+    Status of one submission, or of all of them
+
+    Args:
+        daemon_url: Daemon base url
+
+    Keyword Args:
+        submission_id: Submission id, every submission if not given
+
+    Returns:
+        Status dict, or a list of them
+    """
+    if submission_id is None:
+        return _request(daemon_url.rstrip('/') + '/jobs')['jobs']
+    return _request('%s/jobs/%d' % (daemon_url.rstrip('/'), submission_id))
+
+
+def wait_for_job(daemon_url: str, submission_id: int,
+                 interval: float = config.DAEMON_POLL_INTERVAL,
+                 on_poll: Callable = None) -> dict:
+    """
+    Poll a submission until it completes or fails
+
+    Args:
+        daemon_url: Daemon base url
+        submission_id: Submission id
+
+    Keyword Args:
+        interval: Seconds between polls
+        on_poll: Called with each status while the job is queued or running
+
+    Returns:
+        Final status
+    """
+    while True:
+        status = job_status(daemon_url, submission_id)
+        if status['state'] in ('complete', 'failed'):
+            return status
+        if on_poll is not None:
+            on_poll(status)
+        time.sleep(interval)
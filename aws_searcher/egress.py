@@ -0,0 +1,189 @@
+"""
+Pool of egress routes for search and detail page requests
+
+Sending every page from one address with one User-Agent makes that address's
+block rate the limit on page throughput.  An EgressPool spreads requests over
+routes, each an HTTP proxy (or a direct connection) with its own header
+profile, connection pool and token bucket.  Every response is scored: errors
+and robot check pages raise a route's error and block rates (exponentially
+weighted, so recent outcomes count most).  Health is the product of the two
+success rates and traffic is weighted by its square, so a route blocked half
+the time gets a quarter of a healthy route's share.  A failing route keeps a
+small weight so that it is still probed and its recovery noticed.  A refused
+or failed page is tried again over another route.
+"""
+import random
+import threading
+from typing import Dict, List
+
+import requests
+
+import aws_searcher.config as config
+from aws_searcher.ratelimit import TokenBucket
+from aws_searcher.transport import Transport
+
+DIRECT = 'direct'
+
+
+def is_blocked(response: requests.Response) -> bool:
+    """
+    Whether a response refuses the page, with a throttling status or a robot check page
+
+    Args:
+        response: Page response
+
+    Returns:
+        True for 503 and 429 responses and pages showing a BLOCK_PAGE_MARKERS text
+    """
+    if response.status_code in (429, 503):
+        return True
+    return response.ok and any(marker in response.text for marker in config.BLOCK_PAGE_MARKERS)
+
+
+class Route(object):
+    """
+    One way out: a proxy (or direct connection), header profile and rate limit
+
+    Args:
+        proxy: HTTP proxy url, or DIRECT
+
+    Keyword Args:
+        headers: Header profile sent with every request
+        rate: Requests per second
+        burst: Requests allowed at once
+        alpha: Weight of the latest outcome in the error and block rates
+    """
+
+    def __init__(self, proxy: str, headers: Dict[str, str] = None,
+                 rate: float = config.EGRESS_ROUTE_RATE, burst: int = config.EGRESS_ROUTE_BURST,
+                 alpha: float = config.EGRESS_HEALTH_ALPHA):
+        self.name = proxy
+        self.transport = Transport(headers=headers,
+                                   proxy=None if proxy == DIRECT else proxy)
+        self.bucket = TokenBucket(burst, rate)
+        self.alpha = alpha
+        self.error_rate = 0.0
+        self.block_rate = 0.0
+        self.counts = {'requests': 0, 'errors': 0, 'blocked': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def health(self) -> float:
+        """
+        Share of recent requests that got the page
+
+        Returns:
+            Health between 0 and 1
+        """
+        return (1 - self.error_rate) * (1 - self.block_rate)
+
+    def record(self, error: bool = False, blocked: bool = False):
+        """
+        Score one response
+
+        Keyword Args:
+            error: The request failed or got an error status
+            blocked: The page was refused
+
+        """
+        with self._lock:
+            self.counts['requests'] += 1
+            self.counts['errors'] += error
+            self.counts['blocked'] += blocked
+            self.error_rate += self.alpha * (error - self.error_rate)
+            self.block_rate += self.alpha * (blocked - self.block_rate)
+
+
+class EgressPool(object):
+    """
+    Health weighted choice between egress routes
+
+    Args:
+        routes: Routes to spread requests over
+
+    Keyword Args:
+        min_weight: Weight a route keeps however badly it does
+        max_attempts: Routes tried for one url
+    """
+
+    def __init__(self, routes: List[Route], min_weight: float = config.EGRESS_MIN_WEIGHT,
+                 max_attempts: int = config.EGRESS_MAX_ATTEMPTS):
+        if not routes:
+            raise ValueError('An egress pool needs at least one route')
+        self.routes = routes
+        self.min_weight = min_weight
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_proxies(cls, proxies: List[str],
+                     profiles: List[Dict[str, str]] = None) -> 'EgressPool':
+        """
+        One route per proxy, with the header profiles handed out in turn
+
+        Args:
+            proxies: HTTP proxy urls, DIRECT for a direct connection
+
+        Keyword Args:
+            profiles: Header profiles, config.HEADER_PROFILES if not given
+
+        Returns:
+            EgressPool
+        """
+        profiles = profiles or config.HEADER_PROFILES
+        return cls([Route(proxy, profiles[index % len(profiles)])
+                    for index, proxy in enumerate(proxies)])
+
+    def pick(self, exclude: List[Route] = ()) -> Route:
+        """
+        Choose a route at random, weighted by the square of its health
+
+        Keyword Args:
+            exclude: Routes already tried, ignored when no other route is left
+
+        Returns:
+            Route
+        """
+        candidates = [route for route in self.routes if route not in exclude] or self.routes
+        return random.choices(candidates, [max(self.min_weight, route.health) ** 2
+                                           for route in candidates])[0]
+
+    def get(self, url: str) -> requests.Response:
+        """
+        GET a url over a chosen route, waiting for the route's rate limit, and score it.
+        Refused pages and failed requests are tried over other routes up to max_attempts
+
+        Args:
+            url: Page url
+
+        Returns:
+            Response, the last refused one if every attempt was refused
+
+        Raises:
+            requests.RequestException: The last attempt failed
+        """
+        tried = []
+        for attempt in range(1, self.max_attempts + 1):
+            route = self.pick(tried)
+            tried.append(route)
+            route.bucket.acquire()
+            try:
+                response = route.transport.get(url)
+            except requests.RequestException:
+                route.record(error=True)
+                if attempt == self.max_attempts:
+                    raise
+                continue
+            blocked = is_blocked(response)
+            route.record(error=not response.ok and not blocked, blocked=blocked)
+            if response.ok and not blocked or attempt == self.max_attempts:
+                return response
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Counters and health of every route
+
+        Returns:
+            Dict by route name of the request, error and block counts and 'health'
+        """
+        return {route.name: dict(route.counts, health=round(route.health, 3))
+                for route in self.routes}
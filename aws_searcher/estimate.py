@@ -0,0 +1,228 @@
+"""
+Result size estimation
+
+Before quota is spent on a (category, terms) pair, a few search pages and a
+small ASIN sample tell roughly how big the crawl will be.  Page 1 gives the
+last page number (tasks.get_search_page with searcher.get_pagination), and a
+few pages spread up to it give the ASINs per page.  A sample of those ASINs
+is looked up on MWS and their relationship rows give the new ASINs each
+relationship hop adds per ASIN; the ASINs found are sampled again for the
+next hop, up to max_depth.  Sampled requests run side by side so the whole
+estimate takes a few request latencies.
+
+Sizes are extrapolated level by level and capped by the ASIN budget.
+Runtimes use the sampled latencies, the stages' initial worker counts, the
+politeness delay and the GetMatchingProduct and pricing quotas, so they are
+what a job starting cold can expect.  Relatives shared by ASINs outside the
+sample cannot be seen, so variation heavy searches are overestimated rather
+than under.
+"""
+import logging
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import aws_searcher.config as config
+
+
+def pages_to_sample(last_page: int, count: int = config.ESTIMATE_SAMPLE_PAGES) -> List[int]:
+    """
+    Search pages read besides page 1, spread evenly up to the last one
+
+    Args:
+        last_page: Last page number shown on page 1, None if it shows none
+
+    Keyword Args:
+        count: Pages sampled, page 1 included
+
+    Returns:
+        Page numbers in order, page 2 alone without a last page to tell whether there
+        are more pages
+    """
+    if last_page is None:
+        return [2]
+    if last_page < 2 or count < 2:
+        return []
+    return sorted({1 + round(index * (last_page - 1) / (count - 1))
+                   for index in range(1, count)} - {1})
+
+
+def related_asins(relationships: List[Dict[str, str]]) -> set:
+    """
+    ASINs named by relationship rows, parents and children alike
+
+    Args:
+        relationships: Rows as tasks.extract_relationships_from_json
+
+    Returns:
+        Set of ASINs
+    """
+    return {asin for row in relationships if row['relative']
+            for asin in (row['asin'], row['relative'])}
+
+
+def extrapolate(pages: int, asins_per_page: float, expansion: List[float],
+                page_seconds: float, api_seconds: float,
+                asin_budget: int = config.FRONTIER_ASIN_BUDGET,
+                pricing: bool = False) -> Dict[str, object]:
+    """
+    Full crawl size, MWS requests and runtime from sampled rates
+
+    Args:
+        pages: Search result pages
+        asins_per_page: Mean ASINs on a search page
+        expansion: New ASINs per ASIN added by each relationship hop
+        page_seconds: Mean time a page worker spends on a page, politeness delay included
+        api_seconds: Mean GetMatchingProduct latency
+
+    Keyword Args:
+        asin_budget: Maximum distinct ASINs sent to MWS
+        pricing: Include the pricing stage
+
+    Returns:
+        Dict of 'pages', 'search_asins', 'variation_asins' (parents and children reached
+        through relationships), 'asins_by_depth', 'asins' (within the budget), 'api_calls'
+        (MWS requests, pricing included) and 'runtime_seconds'
+    """
+    levels = [pages * asins_per_page]
+    for ratio in expansion:
+        levels.append(levels[-1] * ratio)
+    asins = int(math.ceil(min(sum(levels), asin_budget)))
+
+    delay = sum(config.REQUEST_DELAY) / 2
+    batches = int(math.ceil(asins / config.GROUP_COUNT))
+    page_time = pages * page_seconds / config.STAGE_CONCURRENCY['page']['initial_workers']
+    api_time = max(batches * (api_seconds + delay)
+                   / config.STAGE_CONCURRENCY['api']['initial_workers'],
+                   max(0, batches - config.MWS_PRODUCT_QUOTA) / config.MWS_PRODUCT_RESTORE_RATE)
+    api_calls = batches
+    pricing_time = 0.0
+    if pricing:
+        # Each batch is one request to each pricing operation, and every operation has its
+        # own quota, so the two run side by side
+        pricing_batches = int(math.ceil(asins / config.PRICING_BATCH_SIZE))
+        api_calls += 2 * pricing_batches
+        pricing_time = max(0, pricing_batches - config.PRICING_QUOTA) \
+            / config.PRICING_RESTORE_RATE
+
+    # The stages overlap, so the slowest one sets the pace
+    return {'pages': pages, 'search_asins': int(round(levels[0])),
+            'variation_asins': int(round(sum(levels[1:]))),
+            'asins_by_depth': [int(round(level)) for level in levels],
+            'asins': asins, 'api_calls': api_calls,
+            'runtime_seconds': round(max(page_time, api_time, pricing_time), 1)}
+
+
+def _timed(fetch, *args) -> tuple:
+    started = time.monotonic()
+    result = fetch(*args)
+    return result, time.monotonic() - started
+
+
+def _sample_pages(category: str, terms: str,
+                  sample_pages: int) -> tuple:  # pragma: no cover
+    """
+    Read page 1 and a few pages spread over the results
+
+    Returns:
+        Tuple of (page count, ASINs per sampled page, page latencies)
+    """
+    import aws_searcher.tasks as tasks
+
+    first, latency = _timed(tasks.get_search_page, category, terms, 1)
+    asins, latencies = [first['asins']], [latency]
+    numbers = pages_to_sample(first['last_page_number'], sample_pages)
+    with ThreadPoolExecutor(max_workers=max(1, len(numbers))) as executor:
+        futures = [executor.submit(_timed, tasks.get_search_page, category, terms, number)
+                   for number in numbers]
+        for number, future in zip(numbers, futures):
+            try:
+                page, latency = future.result()
+            except tasks.PageNotServed as e:
+                logging.warning("Sample page %d skipped: %s", number, e)
+                continue
+            asins.append(page['asins'])
+            latencies.append(latency)
+
+    pages = first['last_page_number']
+    if pages is None:
+        # No pagination bar: more pages than the bar shows, or a single page
+        if len(asins) > 1 and asins[1]:
+            pages = config.PAGINATION_MAX_PAGES
+        else:
+            pages, asins, latencies = 1, asins[:1], latencies[:1]
+    return pages, asins, latencies
+
+
+def _sample_relationships(market: str, asins: List[str]) -> tuple:  # pragma: no cover
+    """
+    Look up ASINs on MWS, all batches at once
+
+    Returns:
+        Tuple of (relationship rows, request latencies)
+    """
+    import aws_searcher.mws_api as mws_api
+    import aws_searcher.tasks as tasks
+
+    batches = tasks.grouper(config.GROUP_COUNT, asins)
+    relationships, latencies = [], []
+    with ThreadPoolExecutor(max_workers=max(1, len(batches))) as executor:
+        for data, latency in executor.map(
+                lambda batch: _timed(mws_api.acquire_mws_product_data, market, batch), batches):
+            for rows in data['relationships']:
+                relationships.extend(rows)
+            latencies.append(latency)
+    return relationships, latencies
+
+
+def estimate(category: str, terms: str, market: str,
+             sample_pages: int = config.ESTIMATE_SAMPLE_PAGES,
+             sample_asins: int = config.ESTIMATE_SAMPLE_ASINS,
+             max_depth: int = config.FRONTIER_MAX_DEPTH,
+             asin_budget: int = config.FRONTIER_ASIN_BUDGET,
+             pricing: bool = False) -> Dict[str, object]:  # pragma: no cover
+    """
+    Estimate the size, MWS requests and runtime of a crawl from a small sample
+
+    Args:
+        category: Amazon search category
+        terms: Search terms
+        market: MWS marketplace id
+
+    Keyword Args:
+        sample_pages: Search pages read, page 1 included
+        sample_asins: ASINs looked up on MWS per relationship hop
+        max_depth: Relationship hops the crawl follows
+        asin_budget: Maximum distinct ASINs the crawl sends to MWS
+        pricing: Include the pricing stage
+
+    Returns:
+        Dict as extrapolate, plus 'sample' with the pages and MWS requests it took and
+        'seconds' it took
+    """
+    started = time.monotonic()
+    pages, page_asins, page_latencies = _sample_pages(category, terms, sample_pages)
+    seen = {asin for asins in page_asins for asin in asins}
+    level = random.sample(sorted(seen), min(sample_asins, len(seen)))
+
+    expansion, api_latencies = [], []
+    for _ in range(max_depth):
+        if not level:
+            expansion.append(0.0)
+            continue
+        relationships, latencies = _sample_relationships(market, level)
+        api_latencies.extend(latencies)
+        found = related_asins(relationships) - seen
+        seen.update(found)
+        expansion.append(len(found) / len(level))
+        level = random.sample(sorted(found), min(sample_asins, len(found)))
+
+    result = extrapolate(pages, sum(map(len, page_asins)) / len(page_asins), expansion,
+                         sum(page_latencies) / len(page_latencies),
+                         sum(api_latencies) / len(api_latencies) if api_latencies else 0.0,
+                         asin_budget, pricing)
+    result['sample'] = {'pages': len(page_asins), 'api_calls': len(api_latencies)}
+    result['seconds'] = round(time.monotonic() - started, 1)
+    return result
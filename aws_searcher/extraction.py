@@ -0,0 +1,224 @@
+"""
+Extraction of GetMatchingProduct responses without the mws DictWrapper
+
+The mws library parses every response into nested dicts (its DictWrapper):
+a regex strips namespaces from the whole document, ElementTree parses it
+and every element goes through another regex and an object_dict.  Target
+values, relationships and flattened item attributes were then each found by
+walking those dicts again.
+
+Here the TARGET_KEYS and RELATIONSHIP_KEYS paths and the item attribute
+subtree are compiled once into an ExtractionPlan.  lxml parses the raw
+response bytes in C and one Python walk over the tree builds the product
+dicts, which are still needed for the JSON output and change detection.  The
+plan then reads target rows and relationships out of those dicts by direct
+path lookups into records.py rows, and flattening the attributes walks the
+item attribute subtree a second time; no output walks the whole product
+again.  The dicts have the same shape the DictWrapper produced: namespaces
+are dropped, element text is kept under 'value', XML attributes become
+{'value': ...} children and repeated elements become lists.
+
+Error results (a status other than Success, with an Error element instead of
+a Product) are not converted; extract_products reports them by ASIN so the
+caller can retry them.
+"""
+from typing import Dict, List, Tuple
+
+from lxml import etree
+
+import aws_searcher.config as config
+from aws_searcher.records import RelationshipRow, TargetRow, record_type
+
+RESULT_TAG = 'GetMatchingProductResult'
+SUCCESS = 'Success'
+
+_PARSER = etree.XMLParser(remove_comments=True, remove_pis=True, resolve_entities=False)
+_LOCAL_NAMES = {}  # type: Dict[str, str]
+
+
+def _local(tag: str) -> str:
+    name = _LOCAL_NAMES.get(tag)
+    if name is None:
+        name = _LOCAL_NAMES[tag] = tag.rsplit('}', 1)[-1]
+    return name
+
+
+def _to_dict(element) -> dict:
+    """
+    Parsed response node of an element, in the shape of the mws DictWrapper
+
+    Args:
+        element: lxml element
+
+    Returns:
+        Dict with 'value' for the text, {'value': ...} for XML attributes and a key per child
+    """
+    node = {}
+    if element.text:
+        node['value'] = element.text
+    for key, value in element.attrib.items():
+        node[_local(key)] = {'value': value}
+    for child in element:
+        tag = _local(child.tag)
+        if tag not in node:
+            node[tag] = _to_dict(child)
+        elif isinstance(node[tag], list):
+            node[tag].append(_to_dict(child))
+        else:
+            node[tag] = [node.pop(tag), _to_dict(child)]
+    return node
+
+
+def flatten_attributes(node) -> Dict[str, str]:
+    """
+    Flatten a parsed attribute subtree into one level of keys joined with '_'
+
+    Args:
+        node: Dict (or list) in the shape of the parsed response
+
+    Returns:
+        Dict of flattened key to value, 'value' keys are left out of the names
+    """
+    out = {}
+
+    def flatten(x, name=''):
+        if isinstance(x, dict):
+            for a in x:
+                flatten(x[a], name + a + '_')
+        elif isinstance(x, list):
+            for i, a in enumerate(x):
+                flatten(a, name + str(i) + '_')
+        else:
+            out[name[:-1].replace('_value', '')] = x
+
+    flatten(node)
+    return out
+
+
+def _lookup(node: dict, keys: Tuple[str, ...], default=''):
+    for key in keys:
+        try:
+            node = node[key]
+        except (KeyError, TypeError):
+            return default
+    return node
+
+
+class ExtractionPlan(object):
+    """
+    Paths below a GetMatchingProductResult element that extraction reads
+
+    Keyword Args:
+        target_keys: Target value paths by column, as config.TARGET_KEYS
+        relationship_keys: Product ASIN and related ASIN paths, as config.RELATIONSHIP_KEYS
+        attributes_keys: Path of the item attribute subtree
+    """
+
+    def __init__(self, target_keys: Dict[str, List[str]] = config.TARGET_KEYS,
+                 relationship_keys: Dict[str, List[str]] = config.RELATIONSHIP_KEYS,
+                 attributes_keys: List[str] = config.ITEM_ATTRIBUTE_KEY_LIST):
+        self.targets = [(column, tuple(keys)) for column, keys in target_keys.items()]
+        columns = tuple(column for column, _ in self.targets)
+        self.row_type = TargetRow if columns == TargetRow.fields \
+            else record_type('TargetRow', columns)
+        self.asin = tuple(relationship_keys['asin'])
+        self.related_asin = tuple(relationship_keys['related_asin'])
+        self.relationships = ('Product', 'Relationships')
+        self.attributes = tuple(attributes_keys)
+
+    def relationship_rows(self, product: dict) -> List[RelationshipRow]:
+        """
+        Relationship rows of one product, as tasks.extract_relationships_from_json
+
+        Args:
+            product: Parsed product
+
+        Returns:
+            List of relationship rows, empty for products without a Relationships element
+        """
+        relationships = _lookup(product, self.relationships, None)
+        if relationships is None:
+            return []
+        asin = _lookup(product, self.asin)
+        if not relationships:
+            return [RelationshipRow(asin, 'stand-alone', '')]
+        kind, related = next(iter(relationships.items()))
+        if kind == 'VariationParent':
+            return [RelationshipRow(asin, 'child', _lookup(related, self.related_asin))]
+        if not isinstance(related, list):
+            related = [related]
+        return [RelationshipRow(_lookup(item, self.related_asin), 'parent', asin)
+                for item in related]
+
+    def extract(self, product: dict) -> Tuple[TargetRow, List[RelationshipRow], Dict[str, str]]:
+        """
+        Target row, relationship rows and flattened attributes of one product
+
+        Args:
+            product: Parsed product
+
+        Returns:
+            Tuple of target row (a record with the target_keys columns), relationship rows
+            and flattened item attributes (None for products without them)
+        """
+        attributes = _lookup(product, self.attributes, None)
+        return (self.row_type(*[_lookup(product, keys) for _, keys in self.targets]),
+                self.relationship_rows(product),
+                flatten_attributes(attributes) if attributes is not None else None)
+
+
+PLAN = ExtractionPlan()
+
+
+def _error_message(status: str, element) -> str:
+    """
+    Status, error code and message of an error result, e.g. for the dead letter table
+
+    Args:
+        status: status attribute of the result
+        element: lxml result element
+
+    Returns:
+        Parts joined by ': '
+    """
+    parts = [status]
+    for child in element:
+        if _local(child.tag) == 'Error':
+            parts.extend(detail.text for detail in child
+                         if detail.text and _local(detail.tag) in ('Code', 'Message'))
+    return ': '.join(parts)
+
+
+def extract_products(xml: bytes, plan: ExtractionPlan = PLAN) -> dict:
+    """
+    Extract every product of a GetMatchingProduct response
+
+    Args:
+        xml: Raw response body
+
+    Keyword Args:
+        plan: Compiled extraction paths
+
+    Returns:
+        Dict of lists with one entry per successful product in document order:
+        "raw_data" (parsed product dicts), "target_values" (rows keyed by TARGET_KEYS),
+        "relationships" (list of relationship rows per product) and "attributes"
+        (flattened item attributes per product), see ExtractionPlan.extract.  "errors"
+        maps the ASIN of each error result to its status, error code and message
+    """
+    results = {'raw_data': [], 'target_values': [], 'relationships': [], 'attributes': [],
+               'errors': {}}
+    for element in etree.fromstring(xml, _PARSER):
+        if _local(element.tag) != RESULT_TAG:
+            continue
+        status = element.get('status', SUCCESS)
+        if status != SUCCESS:
+            results['errors'][element.get('ASIN', '')] = _error_message(status, element)
+            continue
+        product = _to_dict(element)
+        row, relationships, attributes = plan.extract(product)
+        results['raw_data'].append(product)
+        results['target_values'].append(row)
+        results['relationships'].append(relationships)
+        results['attributes'].append(attributes)
+    return results
@@ -0,0 +1,169 @@
+"""
+Variation family graph
+
+MWS only reveals a variation family one lookup at a time: a child's response
+names its parent, and the parent's response lists the children.  Every job
+records the parent to child edges it sees in the variation_edges table
+(primary key parent first, a second index child first), so a whole family
+can be resolved from any member in one query.
+
+The API stage uses known families to queue all of a family's ASINs together,
+so siblings share MWS batches instead of trickling in one relationship row at
+a time.  ASINs an incremental run skips because they were checked recently
+still lead to their siblings through the graph, without fetching the parent
+again just to learn who they are.  In incremental runs, members the ASIN
+index shows an earlier job fetched recently are not queued at all.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import and_, or_, select
+
+import aws_searcher.config as config
+import aws_searcher.models as models
+from aws_searcher.asin_index import AsinIndex
+from aws_searcher.frontier import Frontier
+
+
+class FamilyGraph(object):
+    """
+    Persistent parent and child edges for one marketplace
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+        marketplace: MWS marketplace id
+
+    Keyword Args:
+        job_id: Job recording edges
+        max_age: Hours after which an edge is no longer trusted
+    """
+
+    def __init__(self, engine, marketplace: str, job_id: int = None,
+                 max_age: float = config.FAMILY_MAX_AGE_HOURS):
+        self.engine = engine
+        self.marketplace = marketplace
+        self.job_id = job_id
+        self.max_age = max_age
+        self.table = models.VariationEdges.__table__
+
+    def record(self, relationships: Iterable[Dict[str, str]]) -> int:
+        """
+        Store the edges of relationship rows, refreshing edges seen before
+
+        Args:
+            relationships: Rows as tasks.extract_relationships_from_json, stand-alone rows
+                are ignored
+
+        Returns:
+            Number of edges stored
+        """
+        now = datetime.now()
+        edges = {(row['relative'], row['asin']) for row in relationships
+                 if row['relative'] and row['asin']}
+        if edges:
+            with self.engine.begin() as connection:
+                connection.execute(self.table.insert().prefix_with('OR REPLACE'),
+                                   [{'marketplace': self.marketplace, 'parent': parent,
+                                     'child': child, 'job': self.job_id, 'seen_at': now}
+                                    for parent, child in sorted(edges)])
+        return len(edges)
+
+    def families(self, asins: List[str]) -> Dict[str, Tuple[str, List[str]]]:
+        """
+        Resolve the fresh variation family of each ASIN in one query
+
+        Args:
+            asins: Parent or child ASINs
+
+        Returns:
+            Dict keyed by parent ASIN of (parent, sorted children) for every family one of
+            the ASINs belongs to
+        """
+        if not asins:
+            return {}
+        table = self.table
+        cutoff = datetime.now() - timedelta(hours=self.max_age)
+        fresh = and_(table.c.marketplace == self.marketplace, table.c.seen_at >= cutoff)
+        parents = select([table.c.parent]).where(and_(fresh, table.c.child.in_(asins)))
+        query = select([table.c.parent, table.c.child]) \
+            .where(and_(fresh, or_(table.c.parent.in_(asins), table.c.parent.in_(parents)))) \
+            .order_by(table.c.parent, table.c.child)
+        families = {}
+        with self.engine.begin() as connection:
+            for parent, child in connection.execute(query):
+                families.setdefault(parent, (parent, []))[1].append(child)
+        return families
+
+    def family(self, asin: str) -> List[str]:
+        """
+        Members of one ASIN's variation family
+
+        Args:
+            asin: Parent or child ASIN
+
+        Returns:
+            Parent followed by its children, empty if the family is unknown or stale
+        """
+        for parent, children in self.families([asin]).values():
+            return [parent] + children
+        return []
+
+
+def relationship_families(relationships: Iterable[Dict[str, str]]
+                          ) -> Dict[str, Tuple[str, List[str]]]:
+    """
+    Families described by relationship rows
+
+    Args:
+        relationships: Rows as tasks.extract_relationships_from_json
+
+    Returns:
+        Dict keyed by parent ASIN of (parent, children in row order)
+    """
+    families = {}
+    for row in relationships:
+        if row['relative'] and row['asin']:
+            children = families.setdefault(row['relative'], (row['relative'], []))[1]
+            if row['asin'] not in children:
+                children.append(row['asin'])
+    return families
+
+
+def queue_families(frontier: Frontier, families: Dict[str, Tuple[str, List[str]]],
+                   index: AsinIndex = None,
+                   max_age: float = config.FAMILY_MAX_AGE_HOURS) -> int:
+    """
+    Admit the members of families that have a member in the frontier, each family's
+    children in one put so that they are handed out in the same MWS batches.  As when
+    the relationships come from MWS, the parent is one hop from a child and the
+    children one hop from the parent
+
+    Args:
+        frontier: Crawl frontier
+        families: Families keyed by parent ASIN as FamilyGraph.families, whose edges
+            are fresh
+
+    Keyword Args:
+        index: ASIN index of earlier jobs, members it holds a fresh fetch of are skipped.
+            Only for incremental runs, which need not write unchanged members
+        max_age: Hours after which an indexed fetch is stale
+
+    Returns:
+        Number of ASINs admitted
+    """
+    admitted = 0
+    for parent, children in families.values():
+        members = [parent] + children
+        fresh = set(index.fresh(members, max_age * 3600)) if index is not None else set()
+        if parent in frontier:
+            parent_depth = frontier.depth(parent)
+        else:
+            depths = [frontier.depth(child) for child in children if child in frontier]
+            if not depths:
+                continue
+            parent_depth = min(depths) + 1
+            if parent not in fresh:
+                admitted += frontier.put([parent], depth=parent_depth)
+        admitted += frontier.put([child for child in children if child not in fresh],
+                                 depth=parent_depth + 1)
+    return admitted
@@ -0,0 +1,296 @@
+"""
+Bounded, prioritized crawl frontier for ASINs
+
+Replaces the plain Queue the API workers consumed.  ASINs are handed out in
+priority order: seeds from search result pages (depth 0) first, then ASINs
+found through relationships by increasing depth.  Every ASIN is admitted at
+most once per job, expansion stops at a maximum depth and a per-job budget,
+and queued ASINs beyond an in-memory limit spill to a SQLite file.
+
+Only seed producers (page workers) are held back when too much work is
+pending; API workers both produce and consume, so blocking them could stall
+the whole stage.
+"""
+import heapq
+import itertools
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List
+
+import aws_searcher.config as config
+
+
+class Frontier(object):
+    """
+    Priority frontier with dedupe, depth and budget limits and spill-to-disk
+
+    Keyword Args:
+        max_depth: Relationship hops allowed from a seed ASIN
+        budget: Maximum distinct ASINs admitted for the job
+        memory_limit: Queued ASINs kept in memory before spilling to disk
+        max_pending: Queued ASINs above which seed producers block
+        spill_path: SQLite file for spilled ASINs (a temporary file if not given)
+    """
+
+    def __init__(self, max_depth: int = config.FRONTIER_MAX_DEPTH,
+                 budget: int = config.FRONTIER_ASIN_BUDGET,
+                 memory_limit: int = config.FRONTIER_MEMORY_LIMIT,
+                 max_pending: int = config.FRONTIER_MAX_PENDING,
+                 spill_path: Path = None):
+        self.max_depth = max_depth
+        self.budget = budget
+        self.memory_limit = memory_limit
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+
+        self._heap = []
+        self._delayed = []
+        self._depths = {}
+        self._counter = itertools.count()
+        self._spill = None
+        self._spilled = 0
+        self._spill_min = None
+        self._cancelled = False
+        self._stopped = False
+        self.unfinished_tasks = 0
+        self.stats = {'admitted': 0, 'duplicates': 0, 'over_depth': 0, 'over_budget': 0,
+                      'spilled': 0}
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+
+    def __contains__(self, asin: str) -> bool:
+        return asin in self._depths
+
+    def __len__(self) -> int:
+        return len(self._heap) + self._spilled
+
+    def depth(self, asin: str) -> int:
+        """
+        Relationship depth an ASIN was admitted at
+
+        Args:
+            asin: Admitted ASIN
+
+        Returns:
+            Depth (0 for seeds)
+        """
+        return self._depths.get(asin, 0)
+
+    def _spill_connection(self) -> sqlite3.Connection:
+        if self._spill is None:
+            if self.spill_path is None:
+                self.spill_path = Path(tempfile.mkstemp(suffix='.frontier')[1])
+            self._spill = sqlite3.connect(self.spill_path.as_posix(), check_same_thread=False,
+                                          isolation_level=None)
+            self._spill.execute('CREATE TABLE IF NOT EXISTS frontier '
+                                '(depth INTEGER, seq INTEGER, asin TEXT)')
+            self._spill.execute('CREATE INDEX IF NOT EXISTS ix_frontier_priority '
+                                'ON frontier (depth, seq)')
+        return self._spill
+
+    def _push(self, item: tuple):
+        if len(self._heap) < self.memory_limit:
+            heapq.heappush(self._heap, item)
+            return
+        self._spill_connection().execute('INSERT INTO frontier VALUES (?, ?, ?)', item)
+        self._spilled += 1
+        self.stats['spilled'] += 1
+        if self._spill_min is None or item[:2] < self._spill_min:
+            self._spill_min = item[:2]
+
+    def _pop(self) -> tuple:
+        if self._spilled and (not self._heap or self._spill_min < self._heap[0][:2]):
+            connection = self._spill_connection()
+            rows = connection.execute('SELECT rowid, depth, seq, asin FROM frontier '
+                                      'ORDER BY depth, seq LIMIT ?',
+                                      (max(1, self.memory_limit - len(self._heap)),)).fetchall()
+            connection.executemany('DELETE FROM frontier WHERE rowid = ?',
+                                   [(row[0],) for row in rows])
+            self._spilled -= len(rows)
+            for row in rows:
+                heapq.heappush(self._heap, tuple(row[1:]))
+            following = connection.execute('SELECT depth, seq FROM frontier '
+                                           'ORDER BY depth, seq LIMIT 1').fetchone()
+            self._spill_min = tuple(following) if following else None
+        return heapq.heappop(self._heap)
+
+    def put(self, asins: Iterable[str], depth: int = 0, block: bool = False,
+            timeout: float = None) -> int:
+        """
+        Admit new ASINs at a relationship depth.  Duplicates, ASINs past the maximum
+        depth and ASINs over the job budget are dropped, as is everything once cancelled
+        or stopped
+
+        Args:
+            asins: ASINs to admit
+
+        Keyword Args:
+            depth: Relationship hops from a seed (0 for search result ASINs)
+            block: Wait while the frontier holds max_pending ASINs (for seed producers)
+            timeout: Seconds to wait when blocking
+
+        Returns:
+            Number of ASINs admitted
+        """
+        admitted = 0
+        with self._not_full:
+            if block:
+                self._not_full.wait_for(lambda: len(self) < self.max_pending or self._stopped,
+                                        timeout)
+            if self._cancelled or self._stopped:
+                return 0
+            for asin in asins:
+                if asin in self._depths:
+                    self.stats['duplicates'] += 1
+                elif depth > self.max_depth:
+                    self.stats['over_depth'] += 1
+                elif self.stats['admitted'] >= self.budget:
+                    self.stats['over_budget'] += 1
+                else:
+                    self._depths[asin] = depth
+                    self._push((depth, next(self._counter), asin))
+                    self.stats['admitted'] += 1
+                    admitted += 1
+            self.unfinished_tasks += admitted
+            if admitted:
+                self._not_empty.notify_all()
+        return admitted
+
+    def requeue(self, asins: Iterable[str], delay: float = 0):
+        """
+        Put already admitted ASINs back, e.g. after a failed request.  Each one counts
+        as a new task
+
+        Args:
+            asins: Previously admitted ASINs
+
+        Keyword Args:
+            delay: Seconds before the ASINs are handed out again
+
+        """
+        ready_at = time.monotonic() + delay
+        with self._lock:
+            if self._cancelled:
+                return
+            asins = list(asins)
+            for asin in asins:
+                item = (self.depth(asin), next(self._counter), asin)
+                if delay > 0:
+                    heapq.heappush(self._delayed, (ready_at,) + item)
+                else:
+                    self._push(item)
+            self.unfinished_tasks += len(asins)
+            self._not_empty.notify_all()
+
+    def _promote(self) -> float:
+        """
+        Move delayed ASINs whose backoff has passed into the queue
+
+        Returns:
+            Seconds until the next delayed ASIN is ready, None if none are delayed
+        """
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._push(heapq.heappop(self._delayed)[1:])
+        return self._delayed[0][0] - now if self._delayed else None
+
+    def get_batch(self, size: int = config.GROUP_COUNT, block: bool = True,
+                  timeout: float = None) -> List[str]:
+        """
+        Take up to size ASINs in priority order
+
+        Keyword Args:
+            size: Maximum ASINs to return
+            block: Wait until at least one ASIN is queued
+            timeout: Seconds to wait when blocking
+
+        Returns:
+            List of ASINs, empty only if not blocking, the wait timed out or the frontier
+            is stopped
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._not_empty:
+            next_ready = self._promote()
+            while block and not len(self) and not self._stopped:
+                wait = next_ready
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._not_empty.wait(wait)
+                next_ready = self._promote()
+            batch = [self._pop()[2] for _ in range(min(size, len(self)))]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def task_done(self, count: int = 1):
+        """
+        Mark ASINs handed out by get_batch as finished
+
+        Keyword Args:
+            count: Number of ASINs finished
+
+        """
+        with self._all_done:
+            self.unfinished_tasks -= count
+            if self.unfinished_tasks < 0:
+                raise ValueError('task_done() called too many times')
+            if not self.unfinished_tasks:
+                self._all_done.notify_all()
+
+    def join(self):
+        """
+        Block until every admitted and requeued ASIN is finished
+
+        """
+        with self._all_done:
+            self._all_done.wait_for(lambda: not self.unfinished_tasks)
+
+    def cancel(self) -> List[str]:
+        """
+        Stop admitting ASINs and remove every queued and delayed one, e.g. when the job
+        deadline passes.  Batches already handed out still need their task_done
+
+        Returns:
+            ASINs removed
+        """
+        with self._lock:
+            self._cancelled = True
+            removed = [item[-1] for item in self._delayed]
+            self._delayed = []
+            while len(self):
+                removed.append(self._pop()[2])
+            self.unfinished_tasks -= len(removed)
+            self._not_full.notify_all()
+            if not self.unfinished_tasks:
+                self._all_done.notify_all()
+        return removed
+
+    def stop(self):
+        """
+        Wake every worker blocked in get_batch or put when the job ends; get_batch
+        then returns an empty list and put admits nothing
+
+        """
+        with self._lock:
+            self._stopped = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def close(self):
+        """
+        Drop the spill file
+
+        """
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+            self.spill_path.unlink()
@@ -0,0 +1,142 @@
+"""
+Change detection for incremental re-crawls
+
+Each ASIN's MWS payload is hashed and compared to the hash stored by earlier
+jobs in the asin_snapshots table.  Only new or changed ASINs are written out,
+and ASINs checked recently can be skipped entirely for a refresh interval,
+looked up in the ASIN index (see aws_searcher.asin_index) when one is given.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import and_
+
+import aws_searcher.config as config
+import aws_searcher.models as models
+from aws_searcher.asin_index import AsinIndex
+from aws_searcher.extraction import SUCCESS
+
+
+def payload_hash(product: dict) -> str:
+    """
+    Stable hash of an MWS product payload, ignoring volatile keys
+
+    Args:
+        product: Parsed product dict from MWS
+
+    Returns:
+        Hex digest
+    """
+    stable = dict(product)
+    stable['Product'] = {key: value for key, value in product.get('Product', {}).items()
+                         if key not in config.INCREMENTAL_IGNORED_KEYS}
+    return _digest(stable)
+
+
+def _digest(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ChangeDetector(object):
+    """
+    Compares fresh payloads to stored snapshots and records the new state
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+        marketplace: MWS marketplace id
+        job_id: Current job id
+
+    Keyword Args:
+        refresh_interval: Seconds during which an ASIN checked by an earlier job is skipped
+        index: ASIN index of the marketplace to look fetch times up in instead of the db
+    """
+
+    def __init__(self, engine, marketplace: str, job_id: int, refresh_interval: float = 0,
+                 index: AsinIndex = None):
+        self.engine = engine
+        self.marketplace = marketplace
+        self.job_id = job_id
+        self.refresh_interval = refresh_interval
+        self.index = index
+        self.table = models.AsinSnapshots.__table__
+
+    def _snapshots(self, asins: List[str]) -> Dict[str, dict]:
+        query = self.table.select().where(and_(self.table.c.marketplace == self.marketplace,
+                                               self.table.c.asin.in_(asins)))
+        with self.engine.begin() as connection:
+            result = connection.execute(query)
+            columns = list(result.keys())
+            rows = [dict(zip(columns, row)) for row in result]
+        return {row['asin']: row for row in rows}
+
+    def skip_fresh(self, asins: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Split ASINs into those to fetch and those checked within the refresh interval
+
+        Args:
+            asins: Candidate ASINs
+
+        Returns:
+            Tuple of (ASINs to fetch, ASINs skipped)
+        """
+        if not self.refresh_interval or not asins:
+            return list(asins), []
+        if self.index is not None:
+            # The index only holds earlier jobs' fetches until this job merges its own
+            skipped = set(self.index.fresh(asins, self.refresh_interval))
+            return [asin for asin in asins if asin not in skipped], \
+                [asin for asin in asins if asin in skipped]
+        cutoff = datetime.now() - timedelta(seconds=self.refresh_interval)
+        snapshots = self._snapshots(asins)
+        skipped = [asin for asin in asins
+                   if asin in snapshots and snapshots[asin]['job'] != self.job_id
+                   and snapshots[asin]['checked_at'] >= cutoff]
+        return [asin for asin in asins if asin not in skipped], skipped
+
+    def detect(self, products: List[dict], target_rows: List[dict]) -> Dict[str, dict]:
+        """
+        Classify fresh payloads and store their snapshots
+
+        Args:
+            products: Raw product dicts from MWS
+            target_rows: Rows from mws_api._extract_target_data in the same order
+
+        Returns:
+            Change rows for new and changed ASINs keyed by ASIN, each with 'asin', 'change'
+            ('new' or 'changed') and 'fields' (changed target keys and 'relationships'
+            joined by '|').  Error results (status other than Success) are neither
+            compared nor stored
+        """
+        now = datetime.now()
+        fetched = [(product, row) for product, row in zip(products, target_rows)
+                   if product.get('status', {}).get('value', SUCCESS) == SUCCESS]
+        snapshots = self._snapshots([row['asin'] for _, row in fetched])
+        changes = {}
+        upserts = []
+
+        for product, row in fetched:
+            asin = row['asin']
+            digest = payload_hash(product)
+            values = dict(row, relationships=_digest(
+                product.get('Product', {}).get('Relationships')))
+            previous = snapshots.get(asin)
+            changed_at = previous['changed_at'] if previous else now
+
+            if previous is None:
+                changes[asin] = {'asin': asin, 'change': 'new', 'fields': ''}
+            elif previous['payload_hash'] != digest:
+                old_values = json.loads(previous['target_values'] or '{}')
+                fields = [key for key in values if old_values.get(key) != values[key]]
+                changes[asin] = {'asin': asin, 'change': 'changed', 'fields': '|'.join(fields)}
+                changed_at = now
+
+            upserts.append({'marketplace': self.marketplace, 'asin': asin,
+                            'payload_hash': digest, 'target_values': json.dumps(values),
+                            'job': self.job_id, 'checked_at': now, 'changed_at': changed_at})
+
+        if upserts:
+            with self.engine.begin() as connection:
+                connection.execute(self.table.insert().prefix_with('OR REPLACE'), upserts)
+        return changes
@@ -1,35 +1,158 @@
 """
 A quick and easy logger for all your needs
-"""
 
+configure_logging routes every record through a bounded in-memory queue to a
+background listener thread, so worker threads never wait on a stream lock or
+terminal I/O.  Hot-path lines (marked with extra=HOT_PATH) are rate sampled
+per message template, and output can be plain text or one JSON object per line.
+"""
+import json
 import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from typing import Dict
+
+import aws_searcher.config as config
+from aws_searcher.ratelimit import TokenBucket
+
+TEXT_FORMAT = '%(asctime)s | %(threadName)s | %(levelname)s | %(message)s'
 
+# Pass as extra= on per-batch lines that may be sampled
+HOT_PATH = {'sampled': True}
 
-def logger(logger_name: str, threading: bool = False) -> logging.Logger:  # pragma: no cover
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line
     """
-    Creates new instance of default logger
 
-    Args:
-        logger_name: Name for your logger
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': self.formatTime(record), 'level': record.levelname,
+                 'logger': record.name, 'thread': record.threadName,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        return json.dumps(entry)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The pipe separated text format, noting how many similar lines were sampled away
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super(TextFormatter, self).format(record)
+        if getattr(record, 'suppressed', 0):
+            line += ' (%d similar suppressed)' % record.suppressed
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Rate limits hot-path records per message template
+
+    Records without the HOT_PATH marker, and anything above INFO, always pass.  The
+    next record of a type to pass carries the number dropped since as 'suppressed'.
+
+    Keyword Args:
+        rate: Records per second allowed for each message template
+        burst: Records of one template allowed back to back
+    """
+
+    def __init__(self, rate: float = config.LOG_SAMPLE_RATE,
+                 burst: int = config.LOG_SAMPLE_BURST):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # type: Dict[str, TokenBucket]
+        self._suppressed = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sampled', False) or record.levelno > logging.INFO:
+            return True
+        key = str(record.msg)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.burst, self.rate)
+            if not bucket.try_acquire():
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            record.suppressed = self._suppressed.pop(key, 0)
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that drops records instead of blocking when the queue is full
+
+    Records are queued unformatted, message formatting happens on the listener thread.
+    """
+
+    def __init__(self, record_queue: queue.Queue):
+        super(DroppingQueueHandler, self).__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue never leaves the process, so args need not be merged or pickled here
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(json_output: bool = False, sample_rate: float = config.LOG_SAMPLE_RATE,
+                      level: int = logging.INFO,
+                      stream=None) -> logging.handlers.QueueListener:
+    """
+    Send all logging through a background listener thread
 
     Keyword Args:
-        threading: Indicate whether logger will be used across threads
+        json_output: Write one JSON object per line instead of pipe separated text
+        sample_rate: Hot-path records per second allowed for each message template
+        level: Root logger level
+        stream: Output stream (stderr if not given)
 
     Returns:
-        Logger object configured to default
+        Started QueueListener, stop it to flush the remaining records
     """
-    new_logger = logging.getLogger(logger_name)
-    new_logger.setLevel(logging.INFO)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if json_output else TextFormatter(TEXT_FORMAT))
+
+    handler = DroppingQueueHandler(queue.Queue(config.LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(rate=sample_rate))
 
-    streamhandler = logging.StreamHandler()
-    streamhandler.setLevel(logging.INFO)
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
 
-    if not threading:
-        formatter = logging.Formatter('%(asctime)s | %(name)s | %(levelname)s | %(message)s')
-    else:
-        formatter = logging.Formatter('%(asctime)s | %(threadName)s | %(levelname)s | %(message)s')
-    streamhandler.setFormatter(formatter)
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    return listener
 
-    new_logger.addHandler(streamhandler)
 
-    return new_logger
\ No newline at end of file
+def logger(logger_name: str) -> logging.Logger:  # pragma: no cover
+    """
+    Creates new instance of default logger
+
+    Records propagate to the root logger, see configure_logging for output.
+
+    Args:
+        logger_name: Name for your logger
+
+    Returns:
+        Logger object configured to default
+    """
+    new_logger = logging.getLogger(logger_name)
+    new_logger.setLevel(logging.INFO)
+    return new_logger
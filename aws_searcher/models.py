@@ -4,9 +4,11 @@ SQLAlchemy models for MWS results and jobs
 from datetime import datetime
 from pathlib import Path
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import event, text, create_engine, Column, Integer, String, DateTime, Text, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 
+import aws_searcher.config as config
+
 
 BASE = declarative_base()
 
@@ -18,6 +20,116 @@ class Jobs(BASE):
     category = Column(String, nullable=False)
     terms = Column(String, nullable=False)
     run_date = Column(DateTime, default=datetime.now())
+    # Why the job stopped, 'complete' or the budget it ran out of, see aws_searcher.budget
+    stop_reason = Column(String)
+
+
+class AsinSnapshots(BASE):
+    """
+    Last seen state of each ASIN, used by incremental runs to detect changes
+    """
+    __tablename__ = 'asin_snapshots'
+    marketplace = Column(String, primary_key=True)
+    asin = Column(String, primary_key=True)
+    payload_hash = Column(String, nullable=False)
+    target_values = Column(Text)
+    job = Column(Integer)
+    checked_at = Column(DateTime, index=True)
+    changed_at = Column(DateTime)
+
+
+class Changes(BASE):
+    """
+    Change log written by incremental runs, one row per new or changed ASIN
+    """
+    __tablename__ = 'changes'
+    id = Column(Integer, primary_key=True)
+    job = Column(Integer, index=True)
+    asin = Column(String, index=True)
+    change = Column(String)
+    fields = Column(String)
+
+
+class DeadLetters(BASE):
+    """
+    ASINs that failed on every attempt, kept for the retry command
+    """
+    __tablename__ = 'dead_letters'
+    id = Column(Integer, primary_key=True)
+    job = Column(Integer, index=True)
+    marketplace = Column(String)
+    asin = Column(String, nullable=False)
+    attempts = Column(Integer)
+    last_error = Column(Text)
+    created_at = Column(DateTime)
+    retried_job = Column(Integer)
+
+
+class Relationships(BASE):
+    """
+    Parent and child ASIN pairs appended by every job
+    """
+    __tablename__ = 'relationships'
+    id = Column(Integer, primary_key=True)
+    job = Column(Integer, index=True)
+    asin = Column(String, index=True)
+    relationship = Column(String)
+    relative = Column(String, index=True)
+
+
+class VariationEdges(BASE):
+    """
+    Parent to child variation edges from every job, see aws_searcher.family
+    """
+    __tablename__ = 'variation_edges'
+    __table_args__ = (Index('ix_variation_edges_child', 'marketplace', 'child', 'parent'),)
+    marketplace = Column(String, primary_key=True)
+    parent = Column(String, primary_key=True)
+    child = Column(String, primary_key=True)
+    job = Column(Integer)
+    seen_at = Column(DateTime, index=True)
+
+
+class ProductResults(BASE):
+    """
+    Target values from every job in one indexed table, see aws_searcher.query
+    """
+    __tablename__ = 'product_results'
+    __table_args__ = (Index('ix_product_results_asin_job', 'asin', 'job'),
+                      Index('ix_product_results_brand_job', 'brand', 'job'),
+                      Index('ix_product_results_price', 'price'))
+    id = Column(Integer, primary_key=True)
+    job = Column(Integer, index=True)
+    asin = Column(String, nullable=False)
+    brand = Column(String)
+    product = Column(String)
+    price = Column(Float)
+    currency = Column(String)
+
+
+class PriceHistory(BASE):
+    """
+    Price changes per ASIN and price source in integer minor units, see aws_searcher.prices
+    """
+    __tablename__ = 'price_history'
+    __table_args__ = (Index('ix_price_history_source_covering', 'marketplace', 'asin', 'source',
+                            'observed_at', 'price', 'currency', unique=True),)
+    id = Column(Integer, primary_key=True)
+    marketplace = Column(String, nullable=False)
+    asin = Column(String, nullable=False)
+    source = Column(String, nullable=False, server_default='list')
+    observed_at = Column(DateTime, nullable=False)
+    price = Column(Integer)
+    currency = Column(String(3))
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer, and the busy timeout makes
+    # writers from concurrent jobs wait their turn instead of failing
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA busy_timeout=%d' % (config.SQLITE_BUSY_TIMEOUT * 1000))
+    cursor.close()
 
 
 def get_engine(sqlite_path: Path):
@@ -30,4 +142,65 @@ def get_engine(sqlite_path: Path):
     Returns:
         SQLAlchemy engine for SQLite db
     """
-    return create_engine('sqlite:///' + sqlite_path.as_posix())
+    engine = create_engine('sqlite:///' + sqlite_path.as_posix(),
+                           connect_args={'timeout': config.SQLITE_BUSY_TIMEOUT})
+    event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
+
+
+# Indexes replaced since a db may have been created
+_DROPPED_INDEXES = ['ix_price_history_covering']
+
+
+def _add_missing_columns(connection):
+    """
+    Add columns and indexes introduced since a db was created, create_all only creates
+    missing tables
+
+    Args:
+        connection: Connection holding the db write lock
+
+    """
+    for table in BASE.metadata.sorted_tables:
+        existing = {row[1] for row in connection.execute(text('PRAGMA table_info(%s)'
+                                                              % table.name))}
+        for column in table.columns:
+            if column.name not in existing:
+                default = " DEFAULT '%s'" % column.server_default.arg \
+                    if column.server_default is not None else ''
+                connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s%s' % (
+                    table.name, column.name, column.type.compile(dialect=connection.dialect),
+                    default)))
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+    for name in _DROPPED_INDEXES:
+        connection.execute(text('DROP INDEX IF EXISTS %s' % name))
+
+
+def create_tables(engine):
+    """
+    Create missing tables and columns while holding the db write lock, so jobs starting
+    at the same time do not both try to create the same table
+
+    Args:
+        engine: SQLAlchemy engine
+
+    """
+    with engine.begin() as connection:
+        connection.execute(text('BEGIN IMMEDIATE'))
+        BASE.metadata.create_all(bind=connection)
+        _add_missing_columns(connection)
+
+
+def results_engine():
+    """
+    Open the results db in the home directory, creating it and its tables if needed
+
+    Returns:
+        SQLAlchemy engine for the results db
+    """
+    db_dir = Path.home() / config.DB_DIRECTORY
+    db_dir.mkdir(parents=True, exist_ok=True)
+    engine = get_engine(db_dir / 'amazon.db')
+    create_tables(engine)
+    return engine
@@ -4,11 +4,18 @@ Functions for accessing MWS API and handling responses
 import os
 from operator import getitem
 from functools import reduce
-from typing import List
+from typing import Dict, List
+from urllib.parse import quote
 
-from mws import Products
+import requests
+from mws import MWSError, Products
 
 import aws_searcher.config as config
+import aws_searcher.extraction as extraction
+from aws_searcher.records import TargetRow
+from aws_searcher.transport import Transport
+
+TRANSPORT = Transport(headers={'User-Agent': 'python-amazon-mws/0.0.1 (Language=Python)'})
 
 
 class TooManyASINS(Exception):  # pragma: no cover
@@ -18,6 +25,29 @@ class TooManyASINS(Exception):  # pragma: no cover
     pass
 
 
+class ProductError(Exception):
+    """
+    GetMatchingProduct gave an error result, or no result, for an ASIN
+    """
+    pass
+
+
+def is_throttled(error: Exception) -> bool:
+    """
+    Whether an exception raised by the mws library is a throttling response
+
+    Args:
+        error: Exception raised from a Products call
+
+    Returns:
+        True for RequestThrottled / HTTP 503 responses
+    """
+    response = getattr(error, 'response', None)
+    if response is not None and response.status_code == 503:
+        return True
+    return 'RequestThrottled' in str(error)
+
+
 def _get_product_object() -> Products:  # pragma: no cover
     """
     Creates a MWS Product object from mws library
@@ -27,7 +57,8 @@ def _get_product_object() -> Products:  # pragma: no cover
     """
     return Products(access_key=os.getenv('MWS_ACCESS_KEY'),
                     secret_key=os.getenv('MWS_SECRET_KEY'),
-                    account_id=os.getenv('SELLER_ID'))
+                    account_id=os.getenv('SELLER_ID'),
+                    domain=config.MWS_DOMAIN)
 
 
 def _extract_values_by_target_keys(keys: List[str], json_response: dict) -> str:
@@ -47,18 +78,18 @@ def _extract_values_by_target_keys(keys: List[str], json_response: dict) -> str:
         return ''
 
 
-def _extract_target_data(data: dict) -> dict:
+def _extract_target_data(data: dict) -> TargetRow:
     """
-    Extract desired data as dict
+    Extract desired data as a row
 
     Args:
         data: Product data from MWS, parsed JSON as python dict
 
     Returns:
-        Dictionary for serialization
+        Row with the config.TARGET_KEYS columns for serialization
     """
-    return {key: _extract_values_by_target_keys(config.TARGET_KEYS[key], data)
-            for key in config.TARGET_KEYS}
+    return TargetRow(*[_extract_values_by_target_keys(config.TARGET_KEYS[key], data)
+                       for key in config.TARGET_KEYS])
 
 
 def _extract_asin_from_relationshp(relationship_dict: dict, key: str) -> List[str]:
@@ -78,6 +109,55 @@ def _extract_asin_from_relationshp(relationship_dict: dict, key: str) -> List[st
             for item in relationship_dict[key]]
 
 
+def _request_xml(products_obj: Products, action: str, marketplace: str, asins: List[str],
+                 extra: Dict[str, str] = None) -> bytes:
+    """
+    Signed Products API request for a list of ASINs returning the raw response body.  The mws
+    library's make_request always parses the body into a DictWrapper, so the request is signed
+    and sent here with the library's own signing helpers instead
+
+    Args:
+        products_obj: Products object holding the credentials and endpoint
+        action: Operation name, e.g. GetMatchingProduct
+        marketplace: MWS Marketplace ID
+        asins: ASINs to query
+
+    Keyword Args:
+        extra: Further request parameters
+
+    Returns:
+        Response body
+
+    Raises:
+        MWSError: Error response, with the requests response as .response
+    """
+    params = {'AWSAccessKeyId': products_obj.access_key,
+              products_obj.ACCOUNT_TYPE: products_obj.account_id,
+              'SignatureVersion': '2',
+              'Timestamp': products_obj.get_timestamp(),
+              'Version': products_obj.version,
+              'SignatureMethod': 'HmacSHA256',
+              'Action': action,
+              'MarketplaceId': marketplace}
+    if products_obj.auth_token:
+        params['MWSAuthToken'] = products_obj.auth_token
+    params.update(extra or {})
+    params.update(products_obj.enumerate_param('ASINList.ASIN.', asins))
+    request_description = '&'.join('%s=%s' % (key, quote(params[key], safe='-_.~'))
+                                   for key in sorted(params))
+    signature = products_obj.calc_signature('GET', request_description)
+    url = '%s%s?%s&Signature=%s' % (products_obj.domain, products_obj.uri, request_description,
+                                    quote(signature))
+    response = TRANSPORT.get(url)
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        error = MWSError(response.text)
+        error.response = response
+        raise error
+    return response.content
+
+
 def acquire_mws_product_data(marketplace: str, asins: List[str]) -> dict:  # pragma: no cover
     """
     Get the details as set by the config file's TARGET_KEYS to extract and label from
@@ -88,20 +168,34 @@ def acquire_mws_product_data(marketplace: str, asins: List[str]) -> dict:  # pra
         asins: Single or list of asins to query (Max length of 5)
 
     Returns:
-        Dictionary of with three parent keys, "target_values", "raw_data" and "related_asins".  The
-        "target_values" key will house a list of dictionaries as rows.  The related asins will
-        be a list of asin strings to possibly add to Queue
+        Dictionary with one list entry per product under "target_values" (rows), "raw_data"
+        (parsed product dicts), "relationships" (relationship rows) and "attributes"
+        (flattened item attributes), and the error results by ASIN under "errors", see
+        extraction.extract_products
     """
     if len(asins) > config.GROUP_COUNT:
         raise TooManyASINS("Maximum %d ASINs in any one request" % config.GROUP_COUNT)
 
-    products_obj = _get_product_object()
-    product_data = products_obj.get_matching_product(marketplace, asins).parsed
+    return extraction.extract_products(_request_xml(_get_product_object(), 'GetMatchingProduct',
+                                                    marketplace, asins))
+
+
+def acquire_pricing_xml(action: str, marketplace: str, asins: List[str],
+                        extra: Dict[str, str] = None) -> bytes:
+    """
+    Raw response of a Products pricing operation, see aws_searcher.pricing
 
-    if isinstance(product_data, dict):
-        product_data = [product_data]
+    Args:
+        action: GetCompetitivePricingForASIN or GetLowestOfferListingsForASIN
+        marketplace: MWS Marketplace ID
+        asins: ASINs to query (Max length of config.PRICING_BATCH_SIZE)
 
-    rows = [_extract_target_data(data) for data in product_data]
+    Keyword Args:
+        extra: Further request parameters
 
-    return {'target_values': rows,
-            'raw_data': product_data}
+    Returns:
+        Response body
+    """
+    if len(asins) > config.PRICING_BATCH_SIZE:
+        raise TooManyASINS("Maximum %d ASINs in any one request" % config.PRICING_BATCH_SIZE)
+    return _request_xml(_get_product_object(), action, marketplace, asins, extra)
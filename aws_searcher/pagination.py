@@ -0,0 +1,106 @@
+"""
+Speculative pagination of search results
+
+Pages 1..k are queued as soon as a job starts instead of waiting for page 1
+to learn the last page number.  Every page with results extends the probe to
+k pages past itself, and as soon as any page shows the real last page number
+the remaining pages up to it are queued and nothing past it is fetched.
+Probing stops on its own once pages come back empty, so single page results
+and pages without a pagination bar need no special handling.
+"""
+import threading
+from queue import Queue
+
+import aws_searcher.config as config
+
+
+class Paginator(object):
+    """
+    Decides which search result pages to queue for the page workers
+
+    Args:
+        page_q: Queue of arg dicts for tasks.get_search_page
+        category: Amazon search category
+        search_terms: Search terms
+
+    Keyword Args:
+        probe_ahead: Pages queued past the furthest page with results
+        max_pages: Pages never queued past this number
+        first_page: Page to start from, e.g. where a stopped job left off
+        last_page: Last page number, if already known
+    """
+
+    def __init__(self, page_q: Queue, category: str, search_terms: str,
+                 probe_ahead: int = config.PAGINATION_PROBE_AHEAD,
+                 max_pages: int = config.PAGINATION_MAX_PAGES, first_page: int = 1,
+                 last_page: int = None):
+        self.page_q = page_q
+        self.category = category
+        self.search_terms = search_terms
+        self.probe_ahead = probe_ahead
+        self.max_pages = max_pages
+        self.last_page = last_page
+        self.queued = first_page - 1
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def _queue_through(self, page: int):
+        limit = min(page, self.max_pages)
+        if self.last_page is not None:
+            limit = min(limit, self.last_page)
+        while self.queued < limit:
+            self.queued += 1
+            self.page_q.put({'category': self.category, 'search_terms': self.search_terms,
+                             'page_number': self.queued})
+
+    def start(self):
+        """
+        Queue the first probe_ahead pages, or every page if the last one is known
+
+        """
+        with self._lock:
+            self._queue_through(self.last_page or self.queued + self.probe_ahead)
+
+    def stop(self):
+        """
+        Queue no further pages
+
+        """
+        with self._lock:
+            self.max_pages = self.queued
+
+    def wanted(self, page: int) -> bool:
+        """
+        Whether a queued page is still worth fetching
+
+        Args:
+            page: Page number
+
+        Returns:
+            False once the last page is known to come before it
+        """
+        wanted = self.last_page is None or page <= self.last_page
+        if not wanted:
+            with self._lock:
+                self.skipped += 1
+        return wanted
+
+    def seen(self, page: int, asin_count: int, last_page: int = None):
+        """
+        Queue further pages based on a fetched page.  Call before marking the page done
+        so that the page queue never looks finished while pages are still to come
+
+        Args:
+            page: Page number fetched
+            asin_count: ASINs found on the page
+
+        Keyword Args:
+            last_page: Last page number shown on the page, if any
+
+        """
+        with self._lock:
+            if last_page is not None and self.last_page is None:
+                self.last_page = last_page
+                self._queue_through(last_page)
+            elif asin_count:
+                self._queue_through(page + self.probe_ahead)
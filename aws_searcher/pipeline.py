@@ -0,0 +1,561 @@
+"""
+End to end crawl job: search pages, MWS lookups, optional detail pages and output
+"""
+import logging
+import shutil
+import time
+from pathlib import Path
+from queue import Queue
+from typing import Dict, List
+
+import pandas as pd
+
+import aws_searcher.config as config
+import aws_searcher.tasks as tasks
+import aws_searcher.models as models
+import aws_searcher.concurrency as concurrency
+import aws_searcher.searcher as searcher
+import aws_searcher.mws_api as mws_api
+import aws_searcher.profiling as profiling
+from aws_searcher.ratelimit import TokenBucket
+from aws_searcher.incremental import ChangeDetector
+from aws_searcher.frontier import Frontier
+from aws_searcher.family import FamilyGraph
+from aws_searcher.pagination import Paginator
+from aws_searcher.retry import RetryTracker
+from aws_searcher.prices import PriceStore
+from aws_searcher.pricing import PricingScheduler
+from aws_searcher.asin_index import AsinIndex, index_path
+from aws_searcher.budget import COMPLETE, JobBudget, first_pending_page, save_state
+
+
+class JobProgress(object):
+    """
+    Live view of a running job for status reporting, filled in by run_job
+    """
+
+    def __init__(self):
+        self.job_id = None
+        self.phase = 'queued'
+        self.frontier = None  # type: Frontier
+        self.paginator = None  # type: Paginator
+        self.processed = None  # type: Queue
+        self.budget = None  # type: JobBudget
+
+    def snapshot(self) -> dict:
+        """
+        Current counters of the job
+
+        Returns:
+            Dict with the job id, phase, search page and frontier counters, ASINs processed
+            and budget spent
+        """
+        snapshot = {'job_id': self.job_id, 'phase': self.phase}
+        if self.paginator is not None:
+            snapshot['pages_queued'] = self.paginator.queued
+            snapshot['last_page'] = self.paginator.last_page
+        if self.frontier is not None:
+            snapshot['frontier'] = dict(self.frontier.stats)
+            snapshot['pending'] = len(self.frontier)
+        if self.processed is not None:
+            snapshot['asins_processed'] = self.processed.qsize()
+        if self.budget is not None:
+            snapshot['budget'] = dict(self.budget.usage(), stop_reason=self.budget.reason)
+        return snapshot
+
+
+def _stage(name: str, stage_targets: Dict[str, int] = None) -> concurrency.Stage:
+    """
+    Concurrency stage from config, starting from a worker count learned by earlier jobs
+
+    Args:
+        name: Stage name in config.STAGE_CONCURRENCY
+
+    Keyword Args:
+        stage_targets: Worker targets by stage name from earlier jobs
+
+    Returns:
+        Stage object
+    """
+    settings = dict(config.STAGE_CONCURRENCY[name])
+    if stage_targets and name in stage_targets:
+        settings['initial_workers'] = stage_targets[name]
+    return concurrency.Stage(name, **settings)
+
+
+def _join(q, budget: JobBudget) -> bool:
+    """
+    Wait until every task of a queue (or the frontier) is done, or the job runs out of
+    time or API calls
+
+    Args:
+        q: Queue or Frontier
+        budget: Job budget
+
+    Returns:
+        False if the job stopped first
+    """
+    if not budget.limited:
+        q.join()
+        return True
+    while q.unfinished_tasks:
+        if budget.stopped():
+            return False
+        time.sleep(min(config.DEADLINE_POLL_INTERVAL, budget.deadline.remaining()))
+    return True
+
+
+def _wait_for_stages(page_queue: Queue, frontier: Frontier, detail_queue: Queue,
+                     pricing_queue: Queue, budget: JobBudget) -> bool:
+    """
+    Wait until every stage is idle
+
+    Args:
+        page_queue: Search page queue
+        frontier: ASIN frontier of the API stage
+        detail_queue: Detail page queue, None without the detail stage
+        pricing_queue: Pricing queue, None without the pricing stage
+        budget: Job budget
+
+    Returns:
+        False if the job ran out of time or API calls first
+    """
+    # The API stage consumes while pages are still being read so that page workers
+    # waiting on a full frontier can always make progress
+    if not _join(page_queue, budget) or not _join(frontier, budget):
+        return False
+
+    # Detail pages feed newly found ASINs back to the API stage, so wait until both are idle
+    while detail_queue is not None:
+        if not _join(detail_queue, budget) or not _join(frontier, budget):
+            return False
+        if not detail_queue.unfinished_tasks:
+            break
+    # Pricing only consumes what the API stage produced, so it finishes last
+    return pricing_queue is None or _join(pricing_queue, budget)
+
+
+def _drain(q: Queue) -> list:
+    """
+    Take every item still queued, marking each one done
+
+    Args:
+        q: Queue, None for a disabled stage
+
+    Returns:
+        Items taken
+    """
+    items = []
+    while q is not None and not q.empty():
+        items.append(q.get_nowait())
+        q.task_done()
+    return items
+
+
+def _defer_queued(paginator: Paginator, frontier: Frontier, page_queue: Queue,
+                  detail_queue: Queue, pricing_queue: Queue, budget: JobBudget):
+    """
+    Move all queued work to the budget's deferred work and wait for the tasks in flight,
+    which are bounded by the request timeouts
+
+    Args:
+        paginator: Search page paginator
+        frontier: ASIN frontier of the API stage
+        page_queue: Search page queue
+        detail_queue: Detail page queue, None without the detail stage
+        pricing_queue: Pricing queue, None without the pricing stage
+        budget: Job budget keeping the deferred work
+
+    """
+    paginator.stop()
+    queues = [q for q in (page_queue, detail_queue, pricing_queue) if q is not None]
+    while True:
+        budget.defer('asins', [(asin, frontier.depth(asin)) for asin in frontier.cancel()])
+        budget.defer('pages', [page['page_number'] for page in _drain(page_queue)])
+        budget.defer('details', _drain(detail_queue))
+        budget.defer('pricing', _drain(pricing_queue))
+        if not frontier.unfinished_tasks and not any(q.unfinished_tasks for q in queues):
+            return
+        time.sleep(config.DEADLINE_POLL_INTERVAL)
+
+
+def _resume_state(job_id: int, category: str, terms: str, market: str, search: bool,
+                  paginator: Paginator, budget: JobBudget, options: dict) -> dict:
+    """
+    Everything a later job needs to carry on where a stopped job left off
+
+    Args:
+        job_id: Stopped job
+        category: Amazon search category
+        terms: Search terms
+        market: MWS marketplace id
+        search: Whether the job read search pages
+        paginator: Search page paginator
+        budget: Job budget holding the deferred work
+        options: run_job keyword arguments to resume with
+
+    Returns:
+        JSON serializable state
+    """
+    pending = budget.pending
+    first_page = first_pending_page(pending['pages'], paginator.queued,
+                                    paginator.last_page) if search else None
+    return {'job': job_id, 'category': category, 'terms': terms, 'market': market,
+            'stop_reason': budget.reason, 'asins': [list(item) for item in pending['asins']],
+            'details': pending['details'], 'pricing': pending['pricing'],
+            'first_page': first_page, 'last_page': paginator.last_page, 'options': options}
+
+
+def _collect(data_dir: Path, extension: str, job_id: int = None):
+    """
+    Concatenate the scratch files workers wrote for one output
+
+    Args:
+        data_dir: Directory the workers wrote to
+        extension: Extension identifying the output
+
+    Keyword Args:
+        job_id: Added as a 'job' column when given
+
+    Returns:
+        DataFrame, or None if no worker wrote that output
+    """
+    files = list(data_dir.glob('*.' + extension))
+    if not files:
+        return None
+    frame = pd.concat(pd.read_csv(f.as_posix()) for f in files)
+    if job_id is not None:
+        frame['job'] = job_id
+    return frame
+
+
+def _save(frame, csv_path: Path, table_name: str, engine):
+    """
+    Write one output to the job directory and append it to the database
+
+    Args:
+        frame: DataFrame to save, nothing is written if None
+        csv_path: Output csv in the job directory
+        table_name: Database table to append to
+        engine: SQLAlchemy engine
+
+    """
+    if frame is None:
+        logging.info("Nothing to save for %s" % csv_path.name)
+        return
+    logging.info("Saving %s" % csv_path)
+    frame.to_csv(csv_path.as_posix(), index=False)
+    logging.info("Inserting %s into database" % table_name)
+    frame.to_sql(table_name, con=engine, if_exists='append', index=False)
+
+
+def _index_results(frame, engine):
+    """
+    Append a job's target values to the indexed product_results table
+
+    Args:
+        frame: Annotated data with a 'job' column, nothing is written if None
+        engine: SQLAlchemy engine
+
+    """
+    if frame is None:
+        return
+    columns = [column.name for column in models.ProductResults.__table__.columns
+               if column.name != 'id']
+    rows = frame.reindex(columns=columns)
+    rows['price'] = pd.to_numeric(rows['price'], errors='coerce')
+    logging.info("Indexing %d rows into product_results" % len(rows))
+    rows.to_sql(models.ProductResults.__tablename__, con=engine, if_exists='append',
+                index=False, chunksize=config.QUERY_BATCH_SIZE)
+
+
+def _finalize(job_id: int, output_name: str, scratch_dir: Path, this_job_dir: Path, engine,
+              retries: RetryTracker, incremental: bool):  # pragma: no cover
+    """
+    Combine the workers' scratch files into the job outputs and load them into the db
+
+    Args:
+        job_id: Job id
+        output_name: Prefix for the output files
+        scratch_dir: Job scratch directory the workers wrote to, removed afterwards
+        this_job_dir: Job output directory
+        engine: SQLAlchemy engine
+        retries: Retry tracker holding the job's dead-lettered ASINs
+        incremental: Save the change log
+
+    """
+    logging.info("Collecting JSON data into one file")
+    tasks.combine_json_files(output_name, scratch_dir, this_job_dir)
+
+    logging.info("Collecting output data for db load and final output")
+    all_data_files = _collect(scratch_dir, 'csv', job_id)
+    all_relationship_files = _collect(scratch_dir, 'dat', job_id)
+    all_attribute_files = _collect(scratch_dir, 'txt', job_id)
+    all_change_files = _collect(scratch_dir, 'chg', job_id)
+
+    all_detail_files = _collect(scratch_dir, 'det')
+    if all_detail_files is not None and all_data_files is not None:
+        logging.info("Merging detail page data into annotated data")
+        all_data_files = all_data_files.merge(all_detail_files.drop_duplicates('asin'),
+                                              on='asin', how='left')
+
+    all_pricing_files = _collect(scratch_dir, 'prc')
+    if all_pricing_files is not None and all_data_files is not None:
+        logging.info("Joining competitive prices onto annotated data")
+        all_data_files = all_data_files.merge(all_pricing_files.drop_duplicates('asin'),
+                                              on='asin', how='left')
+
+    shutil.rmtree(scratch_dir.as_posix())
+
+    out_data_csv = this_job_dir / (output_name + '.csv')
+    out_relationship_csv = this_job_dir / (output_name + '_relationships.csv')
+    out_attributes_csv = this_job_dir / (output_name + '_attributes.csv')
+    out_changes_csv = this_job_dir / (output_name + '_changes.csv')
+    dead_letters_csv = this_job_dir / (output_name + '_dead_letters.csv')
+
+    _save(all_data_files, out_data_csv, 'annotated_data_' + str(job_id), engine)
+    _index_results(all_data_files, engine)
+    _save(all_relationship_files, out_relationship_csv, 'relationships', engine)
+    _save(all_attribute_files, out_attributes_csv, 'attributes_' + str(job_id), engine)
+    if incremental:
+        _save(all_change_files, out_changes_csv, 'changes', engine)
+
+    if retries.dead:
+        logging.warning("%d ASINs dead-lettered, retry them with: retry %d"
+                        % (len(retries.dead), job_id))
+        pd.DataFrame(retries.dead).to_csv(dead_letters_csv.as_posix(), index=False)
+
+
+def run_job(category: str, terms: str, market: str, seeds: List[str] = None,
+            search: bool = True, details: bool = False, incremental: bool = False,
+            refresh_hours: float = config.INCREMENTAL_REFRESH_HOURS,
+            max_depth: int = config.FRONTIER_MAX_DEPTH,
+            asin_budget: int = config.FRONTIER_ASIN_BUDGET,
+            pricing: bool = False, max_duration: float = None, max_pages: int = None,
+            max_api_calls: int = None, resume: dict = None, pause: bool = True,
+            profile: bool = False, trace_memory: bool = False, engine=None,
+            progress: JobProgress = None,
+            stage_targets: Dict[str, int] = None,
+            pricing_scheduler: PricingScheduler = None,
+            detail_limiter: TokenBucket = None,
+            product_limiter: TokenBucket = None) -> int:  # pragma: no cover
+    """
+    Run one crawl job and save its outputs to the job directory and the db
+
+    Args:
+        category: Amazon search category
+        terms: Search terms
+        market: MWS marketplace id
+
+    Keyword Args:
+        seeds: ASINs to queue at depth 0 in addition to (or instead of) search results
+        search: Read the search result pages
+        details: Also crawl product detail pages
+        incremental: Only write ASINs that are new or changed since earlier jobs
+        refresh_hours: With incremental, skip ASINs checked within this many hours
+        pricing: Also fetch competitive and lowest offer prices for every ASIN
+        max_depth: Relationship hops to follow from seed ASINs
+        asin_budget: Maximum distinct ASINs sent to MWS
+        max_duration: Seconds the crawl may take
+        max_pages: Search result pages read
+        max_api_calls: MWS requests sent.  A job out of time or API calls stops, a job
+            out of pages stops reading pages; the work left is written to resume.json in
+            the job directory and what was gathered is saved
+        resume: State written by a stopped job, its pending ASINs, detail pages, pricing
+            batches and search pages are queued
+        pause: Sleep between MWS requests
+        profile: Sample all threads and write profile.pstats and profile.collapsed
+        trace_memory: Write a tracemalloc allocation diff of the finalize step
+        engine: SQLAlchemy engine for the results db (opened for the job if not given)
+        progress: Filled in with the job's live counters
+        stage_targets: Worker targets by stage name to start from, updated with the
+            targets the stages settled on
+        pricing_scheduler: Pricing quotas and attempt counts (the job's own if not given)
+        detail_limiter: Detail page token bucket (the job's own if not given)
+        product_limiter: GetMatchingProduct quota token bucket, the job only backs off
+            on throttling if not given.  The daemon shares all three between its jobs
+
+    Returns:
+        New job id
+    """
+    jobs_dir = Path.home() / config.JOBS_DIRECTORY
+    budget = JobBudget(max_duration, max_pages, max_api_calls)
+
+    jobs_dir.mkdir(parents=True, exist_ok=True)
+
+    logging.info('Confirming db exists and creating job entry')
+    engine = engine or models.results_engine()
+    progress = progress or JobProgress()
+
+    job_record = engine.execute(models.Jobs.__table__.insert().values(category=category,
+                                                                      terms=terms))
+    job_id = job_record.inserted_primary_key[0]
+    progress.job_id = job_id
+    progress.phase = 'crawling'
+
+    this_job_dir = jobs_dir / str(job_id)
+
+    this_job_dir.mkdir(parents=True, exist_ok=True)
+
+    # Workers write only to this job's scratch directory so jobs can run side by side
+    scratch_dir = Path.home() / config.DATA_DIRECTORY / ('job-%d' % job_id)
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+
+    output_name = '_'.join([category.lower(), terms.lower()])
+
+    frontier = Frontier(max_depth=max_depth, budget=asin_budget,
+                        spill_path=scratch_dir / 'frontier.db')
+    processed_queue = Queue()
+    progress.frontier = frontier
+    progress.processed = processed_queue
+    progress.budget = budget
+    retries = RetryTracker(engine, job_id, market)
+
+    if seeds:
+        logging.info("Adding %d seed ASINs to queue" % len(seeds))
+        frontier.put(seeds, depth=0)
+    resume = resume or {'asins': [], 'details': [], 'pricing': [], 'first_page': 1,
+                        'last_page': None}
+    if resume['asins']:
+        logging.info("Resuming %d pending ASINs" % len(resume['asins']))
+        for asin, depth in resume['asins']:
+            frontier.put([asin], depth=depth)
+
+    asin_index = AsinIndex(index_path(market))
+
+    page_queue = Queue()
+    paginator = Paginator(page_queue, category, terms, first_page=resume['first_page'] or 1,
+                          last_page=resume['last_page'])
+    if search:
+        progress.paginator = paginator
+        paginator.start()
+
+    profiler = profiling.SamplingProfiler() if profile else None
+    if profiler is not None:
+        profiler.start()
+
+    controller = concurrency.ConcurrencyController()
+    try:
+        controller.start()
+
+        if search:
+            controller.add_stage(_stage('page', stage_targets),
+                                 tasks.page_worker, (page_queue, frontier, processed_queue,
+                                                     paginator, budget, asin_index,),
+                                 wake=concurrency.queue_waker(page_queue))
+
+        detail_queue = Queue() if details else None
+        detail_seen = set()
+        if details and resume['details']:
+            tasks.queue_for_details(resume['details'], detail_queue, detail_seen)
+
+        detector = ChangeDetector(engine, market, job_id, refresh_interval=refresh_hours * 3600,
+                                  index=asin_index) if incremental else None
+
+        pricing_queue = Queue() if pricing else None
+        for asin in resume['pricing'] if pricing else []:
+            pricing_queue.put(asin)
+
+        price_store = PriceStore(engine, market)
+        controller.add_stage(_stage('api', stage_targets),
+                             tasks.api_worker, (frontier, processed_queue, retries, market,
+                                                scratch_dir, detail_queue, detail_seen, detector,
+                                                pause, price_store, pricing_queue,
+                                                FamilyGraph(engine, market, job_id), budget,
+                                                asin_index, product_limiter,),
+                             wake=lambda count: frontier.stop())
+
+        if details:
+            detail_limiter = detail_limiter or TokenBucket(config.DETAIL_PAGE_BURST,
+                                                           config.DETAIL_PAGE_RATE)
+            controller.add_stage(_stage('detail', stage_targets),
+                                 tasks.detail_worker, (detail_queue, frontier, processed_queue,
+                                                       detail_limiter, scratch_dir,),
+                                 wake=concurrency.queue_waker(detail_queue))
+
+        if pricing:
+            controller.add_stage(_stage('pricing', stage_targets),
+                                 tasks.pricing_worker, (pricing_queue,
+                                                        pricing_scheduler or PricingScheduler(),
+                                                        market, scratch_dir, budget, price_store,),
+                                 wake=concurrency.queue_waker(pricing_queue))
+
+        if not _wait_for_stages(page_queue, frontier, detail_queue, pricing_queue, budget):
+            logging.warning("Job reached its %s budget, deferring queued work" % budget.reason)
+            _defer_queued(paginator, frontier, page_queue, detail_queue, pricing_queue, budget)
+        if stage_targets is not None:
+            stage_targets.update((name, stage.target)
+                                 for name, (stage, _, _) in controller.stages.items())
+        controller.shutdown()
+        if search:
+            logging.info("Search pages: %d queued, %d skipped past last page %s"
+                         % (paginator.queued, paginator.skipped, paginator.last_page))
+        frontier.close()
+        logging.info("Frontier: %s" % ', '.join('%s %d' % item for item in frontier.stats.items()))
+        logging.info("Budget spent: %d search pages, %d MWS requests"
+                     % (budget.pages, budget.api_calls))
+
+        if budget.reason is not None:
+            # The resumed job admits the pending ASINs again, so they stay in its ASIN budget
+            spent = frontier.stats['admitted'] - len(budget.pending['asins'])
+            options = {'details': details, 'pricing': pricing, 'incremental': incremental,
+                       'refresh_hours': refresh_hours, 'max_depth': max_depth,
+                       'asin_budget': max(0, asin_budget - spent)}
+            state_path = save_state(this_job_dir, _resume_state(job_id, category, terms, market,
+                                                                search, paginator, budget, options))
+            logging.warning("Job stopped at its %s budget with %d ASINs and pages deferred to %s, "
+                            "resume with: resume %d"
+                            % (budget.reason, budget.deferred(), state_path, job_id))
+
+        progress.phase = 'finalizing'
+        if trace_memory:
+            with profiling.trace_memory(this_job_dir / 'finalize_memory.txt'):
+                _finalize(job_id, output_name, scratch_dir, this_job_dir, engine, retries,
+                          incremental)
+        else:
+            _finalize(job_id, output_name, scratch_dir, this_job_dir, engine, retries, incremental)
+
+        merged = asin_index.merge()
+        logging.info("Merged %d fetched ASINs into the ASIN index, %d known"
+                     % (merged, len(asin_index)))
+        asin_index.close()
+
+        if searcher.RESPONSE_CACHE is not None:
+            stats = searcher.RESPONSE_CACHE.stats()
+            logging.info("Response cache hits %d, misses %d" % (stats['hits'], stats['misses']))
+
+        for name, transport in (('Search', searcher.TRANSPORT), ('MWS', mws_api.TRANSPORT)):
+            stats = transport.stats()
+            logging.info("%s requests %d over %d connections, %.0f%% reused"
+                         % (name, stats['requests'], stats['connections'], 100 * stats['reuse']))
+
+        if searcher.EGRESS is not None:
+            for name, stats in searcher.EGRESS.stats().items():
+                logging.info("Egress %s: %d requests, %d errors, %d blocked, health %.2f"
+                             % (name, stats['requests'], stats['errors'], stats['blocked'],
+                                stats['health']))
+
+        if searcher.HEDGER is not None:
+            stats = searcher.HEDGER.stats
+            logging.info("Search page requests %d, hedged %d, won by the hedge %d"
+                         % (stats['requests'], stats['hedged'], stats['hedge_wins']))
+
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(this_job_dir)
+
+        jobs = models.Jobs.__table__
+        engine.execute(jobs.update().where(jobs.c.id == job_id)
+                       .values(stop_reason=budget.reason or COMPLETE))
+
+        progress.phase = 'complete'
+        logging.info("Run complete")
+        return job_id
+    finally:
+        # A failed job must not leave workers running in the daemon, nor its files behind
+        controller.shutdown()
+        frontier.close()
+        asin_index.close()
+        if profiler is not None:
+            profiler.stop()
+        shutil.rmtree(scratch_dir.as_posix(), ignore_errors=True)
@@ -0,0 +1,172 @@
+"""
+Price history store
+
+Prices are kept per marketplace, ASIN and source as integer minor units
+(cents, or yen for JPY) with the time they were observed.  The sources are
+config.PRICE_SOURCES: the ListPrice of the product lookup, and the
+competitive (buy box) and lowest offer prices of the pricing stage.  A row is
+only appended when the price or currency differs from the latest stored one
+of its source, so the table grows with price changes rather than with jobs.
+
+The comparison with the latest row and the insert are one INSERT ... SELECT
+... WHERE NOT EXISTS statement, which SQLite runs under its write lock, so
+concurrent jobs and processes cannot both append the same change.  A unique
+covering index on (marketplace, asin, source, observed_at, price, currency)
+drops repeats of one observation and serves both history and latest-price
+lookups without touching the table.
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Mapping
+
+from sqlalchemy import and_, bindparam, exists, func, select
+
+import aws_searcher.config as config
+import aws_searcher.models as models
+
+
+def to_minor_units(amount, currency: str) -> int:
+    """
+    Convert a decimal amount to integer minor units
+
+    Args:
+        amount: Amount as a string or number, e.g. '129.99'
+        currency: ISO currency code
+
+    Returns:
+        Amount in minor units, None if the amount is missing or not a number
+    """
+    if amount is None or amount == '':
+        return None
+    try:
+        value = Decimal(str(amount))
+    except InvalidOperation:
+        return None
+    if not value.is_finite():
+        return None
+    places = config.CURRENCY_MINOR_UNITS.get(currency, config.DEFAULT_MINOR_UNITS)
+    return int((value * 10 ** places).to_integral_value())
+
+
+class PriceStore(object):
+    """
+    Appends price changes and looks up price history for one marketplace
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+        marketplace: MWS marketplace id
+    """
+
+    def __init__(self, engine, marketplace: str):
+        self.engine = engine
+        self.marketplace = marketplace
+        self.table = models.PriceHistory.__table__
+        self._insert = self._insert_query()
+
+    def _latest_query(self, asins: List[str], source: str):
+        table = self.table
+        latest = table.alias('latest')
+        newest = select([func.max(table.c.observed_at)]) \
+            .where(and_(table.c.marketplace == latest.c.marketplace,
+                        table.c.asin == latest.c.asin,
+                        table.c.source == latest.c.source))
+        return select([latest.c.asin, latest.c.observed_at, latest.c.price, latest.c.currency]) \
+            .where(and_(latest.c.marketplace == self.marketplace,
+                        latest.c.asin.in_(asins),
+                        latest.c.source == source,
+                        latest.c.observed_at == newest.scalar_subquery()))
+
+    def _insert_query(self):
+        """
+        Insert of one observation unless it repeats the latest stored price of its source
+
+        Returns:
+            INSERT OR IGNORE ... SELECT statement taking the row's columns as parameters
+        """
+        table = self.table
+        columns = ['marketplace', 'asin', 'source', 'observed_at', 'price', 'currency']
+        values = {name: bindparam(name, type_=table.c[name].type) for name in columns}
+        key = and_(table.c.marketplace == values['marketplace'], table.c.asin == values['asin'],
+                   table.c.source == values['source'])
+        newest = select([func.max(table.c.observed_at)]).where(key).scalar_subquery()
+        unchanged = exists().where(and_(key, table.c.observed_at == newest,
+                                        table.c.price == values['price'],
+                                        table.c.currency.is_(values['currency'])))
+        return table.insert().prefix_with('OR IGNORE').from_select(
+            columns, select([values[name] for name in columns]).where(~unchanged))
+
+    def latest(self, asins: List[str], source: str = 'list') -> Dict[str, dict]:
+        """
+        Latest stored price of each ASIN, in one query
+
+        Args:
+            asins: ASINs to look up
+
+        Keyword Args:
+            source: Price source, one of config.PRICE_SOURCES
+
+        Returns:
+            Dict keyed by ASIN of {'observed_at', 'price', 'currency'}, ASINs without
+            history are left out
+        """
+        if not asins:
+            return {}
+        with self.engine.begin() as connection:
+            rows = connection.execute(self._latest_query(list(asins), source)).fetchall()
+        return {row[0]: {'observed_at': row[1], 'price': row[2], 'currency': row[3]}
+                for row in rows}
+
+    def history(self, asin: str, source: str = 'list') -> List[dict]:
+        """
+        Every stored price change of an ASIN, oldest first
+
+        Args:
+            asin: ASIN to look up
+
+        Keyword Args:
+            source: Price source, one of config.PRICE_SOURCES
+
+        Returns:
+            List of {'observed_at', 'price', 'currency'}
+        """
+        table = self.table
+        query = select([table.c.observed_at, table.c.price, table.c.currency]) \
+            .where(and_(table.c.marketplace == self.marketplace, table.c.asin == asin,
+                        table.c.source == source)) \
+            .order_by(table.c.observed_at)
+        with self.engine.begin() as connection:
+            return [{'observed_at': row[0], 'price': row[1], 'currency': row[2]}
+                    for row in connection.execute(query)]
+
+    def record(self, rows: List[Mapping], observed_at: datetime = None) -> int:
+        """
+        Append prices that differ from the latest stored ones of their source
+
+        Args:
+            rows: Rows with 'asin' and the price and currency columns of any of
+                config.PRICE_SOURCES, e.g. target value or pricing rows
+
+        Keyword Args:
+            observed_at: Observation time (now if not given)
+
+        Returns:
+            Number of rows appended
+        """
+        observed_at = observed_at or datetime.now()
+        prices = {}
+        for row in rows:
+            for source, (price_column, currency_column) in config.PRICE_SOURCES.items():
+                if price_column not in row:
+                    continue
+                price = to_minor_units(row.get(price_column), row.get(currency_column))
+                if price is not None:
+                    prices[row['asin'], source] = (price, row.get(currency_column) or None)
+        if not prices:
+            return 0
+
+        observations = [{'marketplace': self.marketplace, 'asin': asin, 'source': source,
+                         'observed_at': observed_at, 'price': price, 'currency': currency}
+                        for (asin, source), (price, currency) in prices.items()]
+        with self.engine.begin() as connection:
+            return sum(connection.execute(self._insert, observation).rowcount
+                       for observation in observations)
@@ -0,0 +1,235 @@
+"""
+Competitive pricing enrichment
+
+GetMatchingProduct only carries ItemAttributes.ListPrice, which is often
+empty and never the live price.  The pricing stage batches discovered ASINs
+20 at a time and asks MWS for the competitive (buy box) price and offer
+count (GetCompetitivePricingForASIN) and the lowest new offer
+(GetLowestOfferListingsForASIN).  Each operation has its own MWS quota, so
+the scheduler keeps a token bucket per operation.  ASINs of a failed batch go
+straight back on the queue with a not-before time kept by the scheduler, so
+no worker sleeps through their backoff.  The resulting rows are joined onto
+the job's target rows by ASIN when the job finishes.
+"""
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from queue import Empty, Queue
+from typing import Dict, List, Tuple
+
+from lxml import etree
+
+import aws_searcher.config as config
+import aws_searcher.mws_api as mws_api
+from aws_searcher.concurrency import STOP
+from aws_searcher.ratelimit import TokenBucket
+from aws_searcher.records import PricingRow
+from aws_searcher.retry import RetryPolicy
+
+COMPETITIVE_PRICING = 'GetCompetitivePricingForASIN'
+LOWEST_OFFERS = 'GetLowestOfferListingsForASIN'
+NAMESPACES = {'p': config.MWS_PRODUCTS_NAMESPACE}
+
+# CompetitivePriceId of the new condition buy box price
+BUY_BOX_NEW = '1'
+
+
+def take_batch(q: Queue, size: int = config.PRICING_BATCH_SIZE,
+               wait: float = config.PRICING_BATCH_WAIT) -> List[str]:
+    """
+    Block for one item, then gather more until the batch is full or wait seconds pass
+
+    Args:
+        q: Queue of ASINs
+
+    Keyword Args:
+        size: Maximum batch size
+        wait: Seconds to wait for a partial batch to fill
+
+    Returns:
+        List of at least one ASIN, each needs a task_done, or an empty list when the
+        worker should stop
+    """
+    first = q.get()
+    if first is STOP:
+        q.task_done()
+        return []
+    batch = [first]
+    deadline = time.monotonic() + wait
+    while len(batch) < size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            asin = q.get(timeout=remaining)
+        except Empty:
+            break
+        if asin is STOP:
+            # Leave it for the next worker, this batch still gets priced
+            q.put(STOP)
+            q.task_done()
+            break
+        batch.append(asin)
+    return batch
+
+
+def _landed_price(element) -> Tuple[str, str]:
+    landed = element.find('p:Price/p:LandedPrice', NAMESPACES)
+    if landed is None:
+        return '', ''
+    return (landed.findtext('p:Amount', '', NAMESPACES),
+            landed.findtext('p:CurrencyCode', '', NAMESPACES))
+
+
+def _results(xml: bytes, action: str):
+    for result in etree.fromstring(xml).iterfind('p:%sResult' % action, NAMESPACES):
+        if result.get('status') == 'Success':
+            yield result.get('ASIN'), result
+
+
+def parse_competitive_pricing(xml: bytes) -> Dict[str, dict]:
+    """
+    Buy box price and offer count of each ASIN in a GetCompetitivePricingForASIN response
+
+    Args:
+        xml: Raw response body
+
+    Returns:
+        Dict keyed by ASIN of {'competitive_price', 'competitive_currency', 'offer_count'},
+        ASINs the response reported an error for are left out
+    """
+    pricing = {}
+    for asin, result in _results(xml, COMPETITIVE_PRICING):
+        prices = result.findall('.//p:CompetitivePrice', NAMESPACES)
+        buy_box = [price for price in prices
+                   if price.findtext('p:CompetitivePriceId', '', NAMESPACES) == BUY_BOX_NEW]
+        amount, currency = _landed_price((buy_box or prices)[0]) if prices else ('', '')
+        counts = {count.get('condition'): count.text
+                  for count in result.iterfind('.//p:OfferListingCount', NAMESPACES)}
+        pricing[asin] = {'competitive_price': amount, 'competitive_currency': currency,
+                         'offer_count': counts.get('Any', counts.get('New', ''))}
+    return pricing
+
+
+def parse_lowest_offers(xml: bytes) -> Dict[str, dict]:
+    """
+    Lowest landed offer price of each ASIN in a GetLowestOfferListingsForASIN response
+
+    Args:
+        xml: Raw response body
+
+    Returns:
+        Dict keyed by ASIN of {'lowest_offer_price', 'lowest_offer_currency'}, ASINs the
+        response reported an error for are left out
+    """
+    pricing = {}
+    for asin, result in _results(xml, LOWEST_OFFERS):
+        offers = []
+        for listing in result.iterfind('.//p:LowestOfferListing', NAMESPACES):
+            amount, currency = _landed_price(listing)
+            try:
+                offers.append((Decimal(amount), amount, currency))
+            except InvalidOperation:
+                continue
+        _, amount, currency = min(offers) if offers else (None, '', '')
+        pricing[asin] = {'lowest_offer_price': amount, 'lowest_offer_currency': currency}
+    return pricing
+
+
+class PricingScheduler(object):
+    """
+    Quota aware client for the pricing operations shared by all pricing workers
+
+    Keyword Args:
+        quota: Maximum request quota of each operation
+        restore_rate: Requests restored per second for each operation
+        policy: Backoff and attempt cap for failed batches
+    """
+
+    def __init__(self, quota: float = config.PRICING_QUOTA,
+                 restore_rate: float = config.PRICING_RESTORE_RATE,
+                 policy: RetryPolicy = None):
+        self.buckets = {action: TokenBucket(quota, restore_rate)
+                        for action in (COMPETITIVE_PRICING, LOWEST_OFFERS)}
+        self.policy = policy or RetryPolicy()
+        self.attempts = {}  # type: Dict[str, int]
+        self.not_before = {}  # type: Dict[str, float]
+        self._lock = threading.Lock()
+
+    def _call(self, action: str, marketplace: str, asins: List[str],
+              extra: Dict[str, str] = None) -> bytes:
+        self.buckets[action].acquire()
+        return mws_api.acquire_pricing_xml(action, marketplace, asins, extra)
+
+    def price(self, marketplace: str, asins: List[str]) -> List[PricingRow]:
+        """
+        Competitive and lowest offer prices of a batch of ASINs
+
+        Args:
+            marketplace: MWS marketplace id
+            asins: Up to config.PRICING_BATCH_SIZE ASINs
+
+        Returns:
+            One row per ASIN with 'asin' and config.PRICING_COLUMNS, '' where MWS had no price
+        """
+        competitive = parse_competitive_pricing(self._call(COMPETITIVE_PRICING, marketplace,
+                                                           asins))
+        lowest = parse_lowest_offers(self._call(LOWEST_OFFERS, marketplace, asins,
+                                                {'ItemCondition': 'New'}))
+        # The daemon keeps one scheduler for all its jobs, so only failing ASINs are counted
+        with self._lock:
+            for asin in asins:
+                self.attempts.pop(asin, None)
+                self.not_before.pop(asin, None)
+        return [PricingRow(asin, **dict(competitive.get(asin, {}), **lowest.get(asin, {})))
+                for asin in asins]
+
+    def failed(self, asins: List[str]) -> Tuple[List[str], float]:
+        """
+        Record a failed attempt for each ASIN of a batch, the ones to retry are not ready
+        until their backoff delay has passed
+
+        Args:
+            asins: ASINs in the failed batch
+
+        Returns:
+            Tuple of ASINs still under the attempt cap and the backoff delay before retrying them
+        """
+        with self._lock:
+            retry = []
+            for asin in asins:
+                self.attempts[asin] = self.attempts.get(asin, 0) + 1
+                if self.attempts[asin] < self.policy.max_attempts:
+                    retry.append(asin)
+                else:
+                    self.not_before.pop(asin, None)
+            attempt = max(self.attempts[asin] for asin in asins)
+            delay = self.policy.delay(attempt)
+            ready_at = time.monotonic() + delay
+            for asin in retry:
+                self.not_before[asin] = ready_at
+        return retry, delay
+
+    def ready(self, asins: List[str]) -> Tuple[List[str], List[str], float]:
+        """
+        Split a batch into ASINs that may be priced now and ones still backing off
+
+        Args:
+            asins: ASINs taken from the pricing queue
+
+        Returns:
+            Tuple of ready ASINs, waiting ASINs and seconds until the first waiting one
+            is ready (0 when none wait)
+        """
+        now = time.monotonic()
+        ready, waiting, wait = [], [], None
+        with self._lock:
+            for asin in asins:
+                remaining = self.not_before.get(asin, now) - now
+                if remaining > 0:
+                    waiting.append(asin)
+                    wait = remaining if wait is None else min(wait, remaining)
+                else:
+                    self.not_before.pop(asin, None)
+                    ready.append(asin)
+        return ready, waiting, wait or 0.0
@@ -0,0 +1,189 @@
+"""
+Whole-job profiling across worker threads
+
+SamplingProfiler walks the stack of every thread at a fixed interval, so the
+cost does not grow with the number of calls the workers make.  Stacks are
+grouped by stage (the thread name without its worker number) and written as
+a pstats file, readable with `python -m pstats` or snakeviz, and as collapsed
+stacks for flamegraph.pl or speedscope.  Times are wall clock, so threads
+waiting on a queue or the network show up where they wait.
+
+trace_memory diffs tracemalloc snapshots taken around a block of code.
+"""
+import collections
+import contextlib
+import logging
+import marshal
+import re
+import sys
+import threading
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Tuple
+
+import aws_searcher.config as config
+
+# (filename, first line, function name), the key pstats uses for a function
+Function = Tuple[str, int, str]
+
+
+def thread_group(thread_name: str) -> str:
+    """
+    Stage a thread belongs to, e.g. 'api-worker' for 'api-worker-3'
+
+    Args:
+        thread_name: Thread name
+
+    Returns:
+        Thread name without a trailing worker number
+    """
+    return re.sub(r'-\d+$', '', thread_name)
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of all other threads on a background thread
+
+    Keyword Args:
+        interval: Seconds between samples
+    """
+
+    def __init__(self, interval: float = config.PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start sampling
+
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling and wait for the sampler thread
+
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(skip=own)
+
+    def sample(self, skip: int = None):
+        """
+        Record the current stack of every thread once
+
+        Keyword Args:
+            skip: Thread ident to leave out (the sampler itself)
+
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[(thread_group(names.get(ident, str(ident))), tuple(stack))] += 1
+        self.sample_count += 1
+
+    def collapsed(self) -> str:
+        """
+        Samples in the collapsed stack format flame graph tools read
+
+        Returns:
+            One 'stage;frame;...;frame count' line per distinct stack
+        """
+        lines = []
+        for (group, stack), count in sorted(self.samples.items()):
+            frames = [group] + ['%s (%s:%d)' % (name, Path(filename).name, line)
+                                for filename, line, name in stack]
+            lines.append('%s %d' % (';'.join(frame.replace(';', ':') for frame in frames), count))
+        return '\n'.join(lines) + '\n'
+
+    def pstats(self) -> Dict[Function, tuple]:
+        """
+        Samples converted to the dict pstats.Stats loads, with sample counts as call
+        counts and sample time as own and cumulative time
+
+        Returns:
+            Dict keyed by function of (calls, calls, own time, cumulative time, callers)
+        """
+        stats = {}
+        for (_, stack), count in self.samples.items():
+            seen = set()
+            seconds = count * self.interval
+            for index, function in enumerate(stack):
+                entry = stats.setdefault(function, [0, 0.0, 0.0, {}])
+                if index == len(stack) - 1:
+                    entry[1] += seconds
+                if function in seen:
+                    continue
+                seen.add(function)
+                entry[0] += count
+                entry[2] += seconds
+                if index:
+                    caller = stack[index - 1]
+                    calls, _, own, cumulative = entry[3].get(caller, (0, 0, 0.0, 0.0))
+                    entry[3][caller] = (calls + count, calls + count, own, cumulative + seconds)
+        return {function: (calls, calls, own, cumulative, callers)
+                for function, (calls, own, cumulative, callers) in stats.items()}
+
+    def write(self, directory: Path):
+        """
+        Write profile.pstats and profile.collapsed
+
+        Args:
+            directory: Output directory
+
+        """
+        with (directory / 'profile.pstats').open('wb') as outfile:
+            marshal.dump(self.pstats(), outfile)
+        with (directory / 'profile.collapsed').open('w') as outfile:
+            outfile.write(self.collapsed())
+        logging.info("Profile of %d samples written to %s", self.sample_count, directory)
+
+
+@contextlib.contextmanager
+def trace_memory(report_path: Path, limit: int = config.TRACEMALLOC_TOP):
+    """
+    Trace allocations made inside the block and write the largest differences
+
+    Args:
+        report_path: Text report to write
+
+    Keyword Args:
+        limit: Number of source lines to report
+
+    """
+    tracemalloc.start(config.TRACEMALLOC_FRAMES)
+    before = tracemalloc.take_snapshot()
+    try:
+        yield
+    finally:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, __file__),
+                  tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')]
+        differences = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+        with report_path.open('w') as outfile:
+            outfile.write('Peak traced memory: %.1f MiB\n\n' % (peak / 2 ** 20))
+            for difference in differences[:limit]:
+                outfile.write('%s\n' % difference)
+        logging.info("Peak traced memory %.1f MiB, allocation diff written to %s",
+                     peak / 2 ** 20, report_path)
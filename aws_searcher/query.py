@@ -0,0 +1,170 @@
+"""
+Indexed lookups over the results of every job
+
+Each job appends its target values to the product_results table, indexed by
+(asin, job), (brand, job), job and price.  Queries are built with SQLAlchemy
+Core and rows are streamed in batches, so large result sets are written out
+without being loaded into memory.
+"""
+import csv
+import json
+import re
+from typing import IO, Iterator, List
+
+from sqlalchemy import and_, func, inspect, select, text
+
+import aws_searcher.config as config
+import aws_searcher.models as models
+
+COLUMNS = ['job', 'run_date', 'asin', 'brand', 'product', 'price', 'currency']
+
+
+def select_results(asins: List[str] = None, brands: List[str] = None, job_from: int = None,
+                   job_to: int = None, min_price: float = None, max_price: float = None,
+                   limit: int = None):
+    """
+    Build a query over product_results joined to the job run date
+
+    Keyword Args:
+        asins: Only these ASINs
+        brands: Only these brands
+        job_from: Lowest job id
+        job_to: Highest job id
+        min_price: Lowest price
+        max_price: Highest price
+        limit: Maximum rows
+
+    Returns:
+        SQLAlchemy select ordered by job and ASIN
+    """
+    results = models.ProductResults.__table__
+    jobs = models.Jobs.__table__
+    conditions = []
+    if asins:
+        conditions.append(results.c.asin.in_(asins))
+    if brands:
+        conditions.append(results.c.brand.in_(brands))
+    if job_from is not None:
+        conditions.append(results.c.job >= job_from)
+    if job_to is not None:
+        conditions.append(results.c.job <= job_to)
+    if min_price is not None:
+        conditions.append(results.c.price >= min_price)
+    if max_price is not None:
+        conditions.append(results.c.price <= max_price)
+
+    query = select([results.c.job, jobs.c.run_date, results.c.asin, results.c.brand,
+                    results.c.product, results.c.price, results.c.currency]) \
+        .select_from(results.outerjoin(jobs, jobs.c.id == results.c.job)) \
+        .order_by(results.c.job, results.c.asin)
+    if conditions:
+        query = query.where(and_(*conditions))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def last_jobs_start(engine, count: int) -> int:
+    """
+    Lowest job id among the most recent jobs
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+        count: Number of recent jobs
+
+    Returns:
+        Job id, None if there are no jobs
+    """
+    jobs = models.Jobs.__table__
+    recent = select([jobs.c.id]).order_by(jobs.c.id.desc()).limit(count).alias('recent')
+    with engine.begin() as connection:
+        return connection.execute(select([func.min(recent.c.id)])).scalar()
+
+
+def iter_results(engine, batch_size: int = config.QUERY_BATCH_SIZE, **filters) -> Iterator[dict]:
+    """
+    Stream matching rows
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+
+    Keyword Args:
+        batch_size: Rows fetched per round trip
+        filters: Passed to select_results
+
+    Returns:
+        Iterator of row dicts keyed by COLUMNS
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True) \
+            .execute(select_results(**filters))
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(COLUMNS, row))
+
+
+def write_csv(rows: Iterator[dict], stream: IO) -> int:
+    """
+    Write rows as CSV with a header
+
+    Args:
+        rows: Row dicts keyed by COLUMNS
+        stream: Text stream to write to
+
+    Returns:
+        Number of rows written
+    """
+    writer = csv.DictWriter(stream, fieldnames=COLUMNS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_json(rows: Iterator[dict], stream: IO) -> int:
+    """
+    Write rows as JSON lines, one object per row
+
+    Args:
+        rows: Row dicts keyed by COLUMNS
+        stream: Text stream to write to
+
+    Returns:
+        Number of rows written
+    """
+    count = 0
+    for row in rows:
+        stream.write(json.dumps(row, default=str) + '\n')
+        count += 1
+    return count
+
+
+def backfill(engine) -> int:
+    """
+    Copy rows from per-job annotated_data_<id> tables for jobs missing from product_results
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+
+    Returns:
+        Number of rows copied
+    """
+    results = models.ProductResults.__table__
+    with engine.begin() as connection:
+        indexed = {row[0] for row in connection.execute(select([results.c.job]).distinct())}
+    copied = 0
+    for table_name in inspect(engine).get_table_names():
+        match = re.match(r'^annotated_data_(\d+)$', table_name)
+        if match is None or int(match.group(1)) in indexed:
+            continue
+        with engine.begin() as connection:
+            copied += connection.execute(text(
+                'INSERT INTO product_results (job, asin, brand, product, price, currency) '
+                'SELECT %d, asin, brand, product, CAST(price AS REAL), currency FROM "%s"'
+                % (int(match.group(1)), table_name))).rowcount
+    return copied
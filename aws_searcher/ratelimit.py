@@ -0,0 +1,87 @@
+"""
+Token bucket rate limiting shared by workers, stages and the local simulator
+"""
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket.  Matches how MWS describes quotas: a maximum
+    request quota (capacity) that is restored at a fixed rate
+
+    Args:
+        capacity: Maximum number of tokens the bucket holds
+        refill_rate: Tokens restored per second
+
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Take tokens without waiting
+
+        Keyword Args:
+            tokens: Number of tokens to take
+
+        Returns:
+            True if the tokens were available and taken
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """
+        Seconds until the requested tokens would be available
+
+        Keyword Args:
+            tokens: Number of tokens wanted
+
+        Returns:
+            Seconds to wait, 0 if available now
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                return 0.0
+            if not self.refill_rate:
+                return float('inf')
+            return (tokens - self._tokens) / self.refill_rate
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        """
+        Block until tokens are available
+
+        Keyword Args:
+            tokens: Number of tokens to take
+            timeout: Give up after this many seconds (wait forever if None)
+
+        Returns:
+            True if tokens were taken, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(tokens):
+                return True
+            wait = self.wait_time(tokens)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(min(wait, 1.0))
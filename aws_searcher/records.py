@@ -0,0 +1,154 @@
+"""
+Fixed schema row records
+
+Target values, relationship rows, product page details, detail page rows and
+pricing rows each have a fixed set of columns, yet every row used to be a
+dict of its own: a hash table of a couple of hundred bytes around a handful
+of short strings.  searcher.serialize_to_csv then rebuilt the union of every
+row's keys for the header before a DictWriter looked each value up again.
+
+Here each schema is a Record subclass with __slots__ for its columns, so a
+row is an object header and one pointer per column.  Records are read-only
+Mappings over their columns, so code reading row['asin'] or row.get(...),
+building dicts from rows or comparing them with dicts keeps working, and
+write_csv writes them out in column order with one attrgetter call per row.
+"""
+import csv
+from collections.abc import Mapping
+from operator import attrgetter
+from pathlib import Path
+from typing import Iterable, Sequence, Tuple
+
+import aws_searcher.config as config
+
+
+class Record(Mapping):
+    """
+    Row with a fixed set of columns, see record_type
+
+    Args:
+        values: Column values in column order
+
+    Keyword Args:
+        columns: Column values by name, '' for columns given neither way
+
+    Raises:
+        TypeError: More values than columns, or a name that is not a column
+    """
+    __slots__ = ()
+    fields = ()  # type: Tuple[str, ...]
+    _columns = frozenset()
+
+    def __init__(self, *values, **columns):
+        if len(values) > len(self.fields):
+            raise TypeError('%s has %d columns, got %d values'
+                            % (type(self).__name__, len(self.fields), len(values)))
+        for field, value in zip(self.fields, values):
+            setattr(self, field, value)
+        for field in self.fields[len(values):]:
+            setattr(self, field, columns.pop(field, ''))
+        if columns:
+            raise TypeError('%s got unexpected columns %s'
+                            % (type(self).__name__, ', '.join(sorted(columns))))
+
+    @staticmethod
+    def _row(record) -> tuple:
+        return ()
+
+    def __getitem__(self, key: str):
+        if key not in self._columns:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __contains__(self, key) -> bool:
+        return key in self._columns
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self._columns else default
+
+    def row(self) -> tuple:
+        """
+        Column values in column order
+
+        Returns:
+            Tuple of values
+        """
+        return self._row(self)
+
+    def as_dict(self) -> dict:
+        """
+        Dict of the columns, e.g. for JSON
+
+        Returns:
+            Dict of values by column
+        """
+        return dict(zip(self.fields, self._row(self)))
+
+    def __repr__(self) -> str:
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % pair for pair in zip(self.fields, self._row(self))))
+
+
+def _row_getter(fields: Tuple[str, ...]):
+    if len(fields) == 1:
+        value = attrgetter(fields[0])
+        return lambda record: (value(record),)
+    return attrgetter(*fields)
+
+
+def record_type(name: str, fields: Iterable[str]) -> type:
+    """
+    Record subclass with a slot per column
+
+    Args:
+        name: Class name
+        fields: Column names in order, identifiers
+
+    Returns:
+        Record subclass
+
+    Raises:
+        ValueError: A column name is not an identifier, or repeats
+    """
+    fields = tuple(fields)
+    if not all(field.isidentifier() for field in fields) or len(set(fields)) != len(fields):
+        raise ValueError('Record columns must be distinct identifiers, got %r' % (fields,))
+    return type(name, (Record,), {'__slots__': fields, 'fields': fields,
+                                  '_columns': frozenset(fields),
+                                  '_row': staticmethod(_row_getter(fields))})
+
+
+TargetRow = record_type('TargetRow', config.TARGET_KEYS)
+RelationshipRow = record_type('RelationshipRow', ['asin', 'relationship', 'relative'])
+ProductDetails = record_type('ProductDetails',
+                             ['asin', 'brand', 'price', 'sellers', 'product_name'])
+DetailRow = record_type('DetailRow', ['asin'] + list(config.DETAIL_COLUMNS.values()))
+PricingRow = record_type('PricingRow', ['asin'] + config.PRICING_COLUMNS)
+
+
+def write_csv(records: Sequence[Record], file_path: Path, write_mode: str = 'w'):
+    """
+    Write records of one type to csv, columns in record order
+
+    Args:
+        records: Rows, all of the same Record subclass
+        file_path: Path reference to file write location
+
+    Keyword Args:
+        write_mode: 'w' to write the header and rows, 'a' to append rows
+
+    """
+    if not records:
+        return
+    row_type = type(records[0])
+    with file_path.open(write_mode) as outfile:
+        writer = csv.writer(outfile)
+        if write_mode == 'w':
+            writer.writerow(row_type.fields)
+        writer.writerows(map(row_type._row, records))
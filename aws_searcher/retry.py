@@ -0,0 +1,146 @@
+"""
+Retry bookkeeping for failed MWS requests
+
+Every ASIN in a failed request gets its attempt count bumped and is requeued
+after an exponential backoff with full jitter.  Once an ASIN reaches the
+attempt cap it is written to the persistent dead_letters table, where the
+retry command picks it up later.
+"""
+import random
+import threading
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import aws_searcher.config as config
+import aws_searcher.models as models
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter and an attempt cap
+
+    Keyword Args:
+        max_attempts: Attempts before an ASIN is dead-lettered
+        base_delay: Backoff ceiling in seconds after the first failure
+        max_delay: Upper bound on the backoff ceiling
+    """
+
+    def __init__(self, max_attempts: int = config.RETRY_MAX_ATTEMPTS,
+                 base_delay: float = config.RETRY_BASE_DELAY,
+                 max_delay: float = config.RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        """
+        Seconds to wait before the next attempt
+
+        Args:
+            attempt: Number of attempts made so far (1 after the first failure)
+
+        Returns:
+            Random delay between 0 and min(max_delay, base_delay * 2 ** (attempt - 1))
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class RetryTracker(object):
+    """
+    Per-ASIN attempt counts for one job and the dead-letter sink
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+        job_id: Current job id
+        marketplace: MWS marketplace id
+
+    Keyword Args:
+        policy: Backoff and attempt cap
+    """
+
+    def __init__(self, engine, job_id: int, marketplace: str, policy: RetryPolicy = None):
+        self.engine = engine
+        self.job_id = job_id
+        self.marketplace = marketplace
+        self.policy = policy or RetryPolicy()
+        self.attempts = {}  # type: Dict[str, int]
+        self.dead = []  # type: List[dict]
+        self._lock = threading.Lock()
+
+    def failed(self, asins: List[str], error: Exception) -> Tuple[List[Tuple[str, float]], List[str]]:
+        """
+        Record a failed attempt for each ASIN
+
+        Args:
+            asins: ASINs in the failed request
+            error: The exception raised
+
+        Returns:
+            Tuple of ([(ASIN, backoff delay)] to requeue, [ASINs dead-lettered])
+        """
+        retry, dead_rows = [], []
+        with self._lock:
+            for asin in asins:
+                attempts = self.attempts.get(asin, 0) + 1
+                self.attempts[asin] = attempts
+                if attempts >= self.policy.max_attempts:
+                    dead_rows.append({'job': self.job_id, 'marketplace': self.marketplace,
+                                      'asin': asin, 'attempts': attempts,
+                                      'last_error': str(error)[:500],
+                                      'created_at': datetime.now()})
+                else:
+                    retry.append((asin, self.policy.delay(attempts)))
+            self.dead.extend(dead_rows)
+
+        if dead_rows:
+            with self.engine.begin() as connection:
+                connection.execute(models.DeadLetters.__table__.insert(), dead_rows)
+        return retry, [row['asin'] for row in dead_rows]
+
+    def succeeded(self, asins: List[str]):
+        """
+        Forget attempt counts for ASINs that went through
+
+        Args:
+            asins: ASINs in the successful request
+
+        """
+        with self._lock:
+            for asin in asins:
+                self.attempts.pop(asin, None)
+
+
+def dead_lettered_asins(engine, job_id: int) -> List[str]:
+    """
+    ASINs a job dead-lettered that have not been retried yet
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+        job_id: Job that dead-lettered them
+
+    Returns:
+        List of ASINs
+    """
+    table = models.DeadLetters.__table__
+    query = table.select().where(table.c.job == job_id).where(table.c.retried_job.is_(None))
+    with engine.begin() as connection:
+        result = connection.execute(query)
+        columns = list(result.keys())
+        return list(dict.fromkeys(dict(zip(columns, row))['asin'] for row in result))
+
+
+def mark_retried(engine, job_id: int, retry_job_id: int):
+    """
+    Point a job's dead letters at the job that retried them
+
+    Args:
+        engine: SQLAlchemy engine for the results db
+        job_id: Job that dead-lettered the ASINs
+        retry_job_id: Job that retried them
+
+    """
+    table = models.DeadLetters.__table__
+    with engine.begin() as connection:
+        connection.execute(table.update().where(table.c.job == job_id)
+                           .where(table.c.retried_job.is_(None))
+                           .values(retried_job=retry_job_id))
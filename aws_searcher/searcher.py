@@ -7,18 +7,131 @@ from pathlib import Path
 import csv
 import re
 from urllib.parse import urljoin, unquote
-from typing import Union, NoReturn, List
+from typing import Union, NoReturn, List, Optional
 import time
+import threading
 from itertools import chain
 
 import requests
 from bs4 import BeautifulSoup
 
 from aws_searcher.logger import logger
+from aws_searcher.cache import ResponseCache
+from aws_searcher.egress import EgressPool, is_blocked
+from aws_searcher.records import ProductDetails, Record, write_csv
+from aws_searcher.timeouts import Hedger
+from aws_searcher.transport import Transport
 import aws_searcher.config as config
 
 LOGGER = logger('aws_scanner')
 
+RESPONSE_CACHE = None  # type: Optional[ResponseCache]
+
+HEDGER = None  # type: Optional[Hedger]
+
+TRANSPORT = Transport(headers=config.REQUEST_HEADERS)
+
+EGRESS = None  # type: Optional[EgressPool]
+
+_FETCH_STATE = threading.local()
+
+
+def configure_cache(cache: Optional[ResponseCache]) -> NoReturn:
+    """
+    Install (or remove with None) the response cache used by the page fetcher
+
+    Args:
+        cache: ResponseCache instance shared by all worker threads
+
+    """
+    global RESPONSE_CACHE
+    RESPONSE_CACHE = cache
+
+
+def configure_transport(transport: Transport) -> NoReturn:
+    """
+    Replace the transport page requests are sent through, e.g. to send them to a
+    local stand-in with a different base url
+
+    Args:
+        transport: Transport instance shared by all worker threads
+
+    """
+    global TRANSPORT
+    TRANSPORT = transport
+
+
+def configure_egress(pool: Optional[EgressPool]) -> NoReturn:
+    """
+    Spread page requests over a pool of egress routes (or send them through
+    TRANSPORT again with None)
+
+    Args:
+        pool: EgressPool instance shared by all worker threads
+
+    """
+    global EGRESS
+    EGRESS = pool
+
+
+def configure_hedging(hedger: Optional[Hedger]) -> NoReturn:
+    """
+    Install (or remove with None) the hedger used for search result page requests
+
+    Args:
+        hedger: Hedger instance shared by all worker threads
+
+    """
+    global HEDGER
+    HEDGER = hedger
+
+
+def last_response_cached() -> bool:
+    """
+    Whether the last page fetched on this thread was served from the cache, used
+    to skip the politeness delay when no request went out
+
+    Returns:
+        True if the last fetch on the calling thread was a cache hit
+    """
+    return getattr(_FETCH_STATE, 'from_cache', False)
+
+
+def _get(url: str) -> requests.Response:
+    return EGRESS.get(url) if EGRESS is not None else TRANSPORT.get(url)
+
+
+def _fetch_page(url: str, hedge: bool = False) -> Optional[str]:
+    """
+    GET a page, going through the response cache when one is configured
+
+    Args:
+        url: Page url
+
+    Keyword Args:
+        hedge: Send a duplicate request if this one is slow, when a hedger is configured
+
+    Returns:
+        Response text or None if the response was not ok or a robot check page
+
+    Raises:
+        requests.Timeout: Connecting or reading took longer than the configured timeouts
+    """
+    _FETCH_STATE.from_cache = False
+    if RESPONSE_CACHE is not None:
+        body = RESPONSE_CACHE.get(url)
+        if body is not None:
+            _FETCH_STATE.from_cache = True
+            return body
+
+    r = HEDGER.call(_get, url) if hedge and HEDGER is not None else _get(url)
+    if not r.ok or is_blocked(r):
+        return
+
+    if RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.set(url, r.text)
+    return r.text
+
 
 def get_amazon_search_result(category: str,
                              search_terms: str,
@@ -46,10 +159,10 @@ def get_amazon_search_result(category: str,
                                                    search=search_terms,
                                                    page_number=page)
 
-    r = requests.get(url, headers=config.REQUEST_HEADERS)
-    if not r.ok:
+    text = _fetch_page(url, hedge=True)
+    if text is None:
         return
-    return BeautifulSoup(r.text, 'lxml')
+    return BeautifulSoup(text, 'lxml')
 
 
 def _parse_asin_link(url: str) -> str:
@@ -143,7 +256,7 @@ def _extract_sellers(soup: BeautifulSoup) -> List[str]:  # pragma: no cover
 
 
 def parse_product_page_details(asin_dictionary: dict, page: BeautifulSoup,
-                               stringify: bool = False) -> dict:  # pragma: no cover
+                               stringify: bool = False) -> ProductDetails:  # pragma: no cover
     """
     Parse the desired details from a given page
 
@@ -155,17 +268,17 @@ def parse_product_page_details(asin_dictionary: dict, page: BeautifulSoup,
         stringify: Convert all values to string if true
 
     Returns:
-        Dictionary with Product Name, Brand, ASIN, Price, Seller Name
+        Row with Product Name, Brand, ASIN, Price, Seller Name
     """
     sellers = _extract_sellers(page)
-    return {'asin': list(asin_dictionary.keys())[0],
-            'brand': _extract_brand(page),
-            'price': _extract_price(page),
-            'sellers': '|'.join(sellers) if stringify else sellers,
-            'product_name': _extract_product_name(page)}
+    return ProductDetails(asin=list(asin_dictionary.keys())[0],
+                          brand=_extract_brand(page),
+                          price=_extract_price(page),
+                          sellers='|'.join(sellers) if stringify else sellers,
+                          product_name=_extract_product_name(page))
 
 
-def get_product_page(url: str) -> BeautifulSoup:
+def get_product_page(url: str) -> Union[BeautifulSoup, NoReturn]:
     """
     Request product page using get request and return as BeautifulSoup object
 
@@ -173,9 +286,12 @@ def get_product_page(url: str) -> BeautifulSoup:
         url: String representation of product url
 
     Returns:
-        BeautifulSoup object
+        BeautifulSoup object, None if the page was not served
     """
-    return BeautifulSoup(requests.get(url, headers=config.REQUEST_HEADERS).text, 'lxml')
+    text = _fetch_page(url)
+    if text is None:
+        return
+    return BeautifulSoup(text, 'lxml')
 
 
 def scan_detail_page_for_asin(soup: BeautifulSoup) -> dict:
@@ -192,15 +308,17 @@ def scan_detail_page_for_asin(soup: BeautifulSoup) -> dict:
     return {asin: urljoin(config.AMAZON_BASE_URL, 'dp/' + asin) for asin in all_asins}
 
 
-def timeout(floor: int = 2, ceiling: int = 6) -> NoReturn:  # pragma: no cover
+def timeout(floor: int = None, ceiling: int = None) -> NoReturn:  # pragma: no cover
     """
     Invoke time.sleep at randomly timed intervals
 
     Keyword Args:
-        floor: Minimum time to wait
-        ceiling: Maximum time to wait
+        floor: Minimum time to wait (config.REQUEST_DELAY if not given)
+        ceiling: Maximum time to wait (config.REQUEST_DELAY if not given)
 
     """
+    floor = config.REQUEST_DELAY[0] if floor is None else floor
+    ceiling = config.REQUEST_DELAY[1] if ceiling is None else ceiling
     time.sleep(random.randint(floor, ceiling))
 
 
@@ -210,8 +328,12 @@ def serialize_to_csv(data: List[dict], file_path: Path,
     """
     Dump list of dicts to csv
 
+    Rows that are all records of one type are written straight from their
+    columns with records.write_csv; the header of dict rows is the union of
+    their keys.
+
     Args:
-        data: List of dictionaries as rows
+        data: List of dictionaries or records as rows
         file_path: Path reference to file write location
 
     Keyword Args:
@@ -219,6 +341,10 @@ def serialize_to_csv(data: List[dict], file_path: Path,
         write_mode: Indicate whether this should be a single write or append
 
     """
+    if data and not declared_headers and isinstance(data[0], Record) \
+            and all(type(row) is type(data[0]) for row in data):
+        write_csv(data, file_path, write_mode)
+        return
     headers = list(set(chain(*[list(row.keys()) for row in data])))
     with file_path.open(write_mode) as outfile:
         headers = headers if not declared_headers else declared_headers
@@ -228,17 +354,29 @@ def serialize_to_csv(data: List[dict], file_path: Path,
         writer.writerows(data)
 
 
-def get_pagination(soup: BeautifulSoup) -> int:
+def get_pagination(soup: BeautifulSoup) -> Optional[int]:
     """
     Parse Amazon search result page and find last page number of results so
     that we know what to feed into the Queue
 
+    Long result lists show the last page as pagnDisabled, short ones link every
+    page.  Results without a pagination bar (a single page) give None.
+
     Args:
         soup: BeautifulSoup object
 
     Returns:
-        Integer representation of the last page number of result
+        Integer representation of the last page number of result, None if the page
+        does not show it
 
     """
-    return int(soup.find('span', {'class': 'pagnDisabled'}).text)
+    disabled = soup.find('span', {'class': 'pagnDisabled'})
+    if disabled is not None and disabled.get_text(strip=True).isdigit():
+        return int(disabled.get_text(strip=True))
+    if soup.find('span', {'class': 'pagnMore'}) is not None:
+        return None
+    numbers = [int(span.get_text(strip=True))
+               for span in soup.find_all('span', {'class': ['pagnCur', 'pagnLink']})
+               if span.get_text(strip=True).isdigit()]
+    return max(numbers) if numbers else None
 
@@ -0,0 +1,639 @@
+"""
+Local stand-in servers for Amazon search result pages and the MWS Products
+GetMatchingProduct and pricing operations, for offline end-to-end load testing
+
+Search and detail pages are synthetic but use the same markup the searcher
+parses (s-access-detail-page links, the pagnDisabled last page marker and the
+buy box elements).  MWS
+responses are rendered from the product fixture in tests/resources with the
+ASIN, title, price and relationships swapped per product.  The MWS endpoint
+enforces a token bucket quota and answers with RequestThrottled errors the
+same way MWS does.  The pricing operations derive offer prices from each
+product's list price and have their own quotas.  The search server accepts
+absolute urls in the request line, so it can also stand in for an HTTP proxy.
+
+Point the crawler at a running simulator with::
+
+    AWS_SEARCHER_AMAZON_URL=http://127.0.0.1:8080
+    AWS_SEARCHER_MWS_URL=http://127.0.0.1:8081
+    AWS_SEARCHER_REQUEST_DELAY=0,0
+
+MWS_ACCESS_KEY, MWS_SECRET_KEY and SELLER_ID must be set to any value since
+requests are still signed, the simulator does not check signatures.
+"""
+import copy
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from decimal import Decimal
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape, quoteattr
+
+import aws_searcher.config as config
+from aws_searcher.ratelimit import TokenBucket
+
+FIXTURE_DIRECTORY = Path(__file__).parents[1] / 'tests' / 'resources'
+
+PRODUCTS_NAMESPACE = config.MWS_PRODUCTS_NAMESPACE
+ITEM_ATTRIBUTES_NAMESPACE = PRODUCTS_NAMESPACE + '/default.xsd'
+
+PRICING_ACTIONS = ['GetCompetitivePricingForASIN', 'GetLowestOfferListingsForASIN']
+
+# Offer prices of every product as fractions of its list price, the first one holds the buy box
+OFFER_PRICE_FACTORS = ['0.95', '0.90', '1.00']
+
+# Keys in the parsed response that are XML attributes rather than child elements
+XML_ATTRIBUTE_KEYS = {'lang': 'xml:lang', 'Units': 'Units'}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTPServer handling each request on its own thread
+    """
+    daemon_threads = True
+
+
+def search_asin(page: int, index: int) -> str:
+    """
+    Deterministic ASIN for a search result position
+
+    Args:
+        page: Search result page number
+        index: Position on the page
+
+    Returns:
+        Ten character ASIN
+    """
+    return 'B%09d' % (page * 1000 + index)
+
+
+def child_asin(parent_asin: str, number: int) -> str:
+    """
+    Deterministic ASIN for a variation child of a search result ASIN
+
+    Args:
+        parent_asin: ASIN produced by search_asin
+        number: Child number
+
+    Returns:
+        Ten character ASIN
+    """
+    return 'C%07d%02d' % (int(parent_asin[1:]), number)
+
+
+def parent_asin(child: str) -> str:
+    """
+    Reverse of child_asin
+
+    Args:
+        child: ASIN produced by child_asin
+
+    Returns:
+        Parent ASIN
+    """
+    return 'B%09d' % int(child[1:8])
+
+
+def render_block_page() -> str:
+    """
+    Render the robot check page Amazon serves instead of a blocked page
+
+    Returns:
+        HTML string
+    """
+    return '<html><head><title dir="ltr">Robot Check</title></head><body>' \
+           '<form method="get" action="/errors/validateCaptcha">' \
+           '<input type="text" id="captchacharacters" name="field-keywords"></form>' \
+           '</body></html>'
+
+
+def render_search_page(asins: List[str], last_page: int, page: int = 1) -> str:
+    """
+    Render a search result page with the markup the searcher parses.  Like Amazon,
+    a single page has no pagination bar, up to three pages are all linked and
+    longer results show the last page as pagnDisabled
+
+    Args:
+        asins: ASINs to list on the page
+        last_page: Last page number shown in the pagination bar
+
+    Keyword Args:
+        page: Current page number
+
+    Returns:
+        HTML string
+    """
+    links = ['<li><a class="a-link-normal s-access-detail-page a-text-normal" '
+             'title="Synthetic Product %s" href="/Synthetic-Product/dp/%s/ref=sr_1_%d">'
+             'Synthetic Product %s</a></li>' % (asin, asin, count, asin)
+             for count, asin in enumerate(asins, 1)]
+    if last_page <= 1:
+        pagination = ''
+    elif last_page <= 3:
+        pagination = ''.join('<span class="pagnCur">%d</span>' % number if number == page
+                             else '<span class="pagnLink"><a href="#">%d</a></span>' % number
+                             for number in range(1, last_page + 1))
+    else:
+        pagination = '<span class="pagnCur">%d</span><span class="pagnMore">...</span>' \
+                     '<span class="pagnDisabled">%d</span>' % (page, last_page)
+    return '<html><body><ul id="s-results-list-atf">%s</ul>' \
+           '<div id="pagn">%s</div>' \
+           '</body></html>' % (''.join(links), pagination)
+
+
+def render_detail_page(asin: str, price: str, related_asins: List[str]) -> str:
+    """
+    Render a product detail page with the markup the detail extractors parse
+
+    Args:
+        asin: Product ASIN
+        price: Buy box price text
+        related_asins: ASINs linked from the page (data-dp-url)
+
+    Returns:
+        HTML string
+    """
+    related = ''.join('<li data-dp-url="/dp/%s/ref=twister"></li>' % related_asin
+                      for related_asin in related_asins)
+    return '<html><body><span id="productTitle">Synthetic Product %s</span>' \
+           '<a id="bylineInfo" href="/Oakley/b">Oakley</a>' \
+           '<span id="priceblock_ourprice">%s</span>' \
+           '<div id="merchant-info">Ships from and sold by ' \
+           '<a href="/gp/help/seller/at-a-glance.html?seller=SIMSELLER1">Simulated</a>' \
+           '</div><ul id="variation">%s</ul></body></html>' % (asin, price, related)
+
+
+def _render_node(tag: str, node) -> str:
+    """
+    Render a parsed response node back into XML
+
+    Args:
+        tag: Element name
+        node: Dict (or list of dicts) in the shape produced by the mws DictWrapper
+
+    Returns:
+        XML string
+    """
+    if isinstance(node, list):
+        return ''.join(_render_node(tag, item) for item in node)
+
+    attributes = ''.join(' %s=%s' % (XML_ATTRIBUTE_KEYS[key], quoteattr(node[key]['value']))
+                         for key in node if key in XML_ATTRIBUTE_KEYS)
+    children = ''.join(_render_node(key, value) for key, value in node.items()
+                       if key != 'value' and key not in XML_ATTRIBUTE_KEYS)
+    text = escape(node.get('value', ''))
+    if tag == 'ItemAttributes':
+        return '<ns2:ItemAttributes xmlns:ns2="%s"%s>%s%s</ns2:ItemAttributes>' % (
+            ITEM_ATTRIBUTES_NAMESPACE, attributes, text, children)
+    return '<%s%s>%s%s</%s>' % (tag, attributes, text, children, tag)
+
+
+def render_product_xml(product: dict) -> str:
+    """
+    Render one GetMatchingProductResult element from a parsed product dict
+
+    Args:
+        product: Product in the shape of tests/resources/product_api_response.json
+
+    Returns:
+        XML string
+    """
+    return '<GetMatchingProductResult ASIN=%s status=%s>%s</GetMatchingProductResult>' % (
+        quoteattr(product['ASIN']['value']), quoteattr(product['status']['value']),
+        _render_node('Product', product['Product']))
+
+
+def _render_response(action: str, results: str) -> str:
+    return '<?xml version="1.0"?>' \
+           '<%sResponse xmlns="%s">%s' \
+           '<ResponseMetadata><RequestId>%s</RequestId></ResponseMetadata>' \
+           '</%sResponse>' % (action, PRODUCTS_NAMESPACE, results, uuid.uuid4(), action)
+
+
+def render_matching_product_response(products: List[dict]) -> str:
+    """
+    Render a full GetMatchingProductResponse document
+
+    Args:
+        products: Parsed product dicts
+
+    Returns:
+        XML string
+    """
+    return _render_response('GetMatchingProduct',
+                            ''.join(render_product_xml(product) for product in products))
+
+
+def _render_price(amount: str, currency: str = 'USD') -> str:
+    return '<Price><LandedPrice><CurrencyCode>%s</CurrencyCode><Amount>%s</Amount></LandedPrice>' \
+           '<ListingPrice><CurrencyCode>%s</CurrencyCode><Amount>%s</Amount></ListingPrice>' \
+           '<Shipping><CurrencyCode>%s</CurrencyCode><Amount>0.00</Amount></Shipping>' \
+           '</Price>' % (currency, amount, currency, amount, currency)
+
+
+def render_competitive_pricing_response(offers: Dict[str, List[str]]) -> str:
+    """
+    Render a GetCompetitivePricingForASINResponse document
+
+    Args:
+        offers: Offer prices by ASIN, the first one holds the buy box
+
+    Returns:
+        XML string
+    """
+    return _render_response('GetCompetitivePricingForASIN', ''.join(
+        '<GetCompetitivePricingForASINResult ASIN=%s status="Success"><Product>%s'
+        '<CompetitivePricing><CompetitivePrices>'
+        '<CompetitivePrice belongsToRequester="false" condition="New" subcondition="New">'
+        '<CompetitivePriceId>1</CompetitivePriceId>%s</CompetitivePrice></CompetitivePrices>'
+        '<NumberOfOfferListings><OfferListingCount condition="New">%d</OfferListingCount>'
+        '<OfferListingCount condition="Any">%d</OfferListingCount></NumberOfOfferListings>'
+        '</CompetitivePricing></Product></GetCompetitivePricingForASINResult>' % (
+            quoteattr(asin), _render_node('Identifiers', _identifier(asin)['Identifiers']),
+            _render_price(prices[0]), len(prices), len(prices))
+        for asin, prices in offers.items()))
+
+
+def render_lowest_offers_response(offers: Dict[str, List[str]]) -> str:
+    """
+    Render a GetLowestOfferListingsForASINResponse document
+
+    Args:
+        offers: Offer prices by ASIN
+
+    Returns:
+        XML string
+    """
+    return _render_response('GetLowestOfferListingsForASIN', ''.join(
+        '<GetLowestOfferListingsForASINResult ASIN=%s status="Success" '
+        'AllOfferListingsConsidered="true"><Product>%s<LowestOfferListings>%s'
+        '</LowestOfferListings></Product></GetLowestOfferListingsForASINResult>' % (
+            quoteattr(asin), _render_node('Identifiers', _identifier(asin)['Identifiers']),
+            ''.join('<LowestOfferListing><Qualifiers><ItemCondition>New</ItemCondition>'
+                    '<ItemSubcondition>New</ItemSubcondition></Qualifiers>'
+                    '<NumberOfOfferListingsConsidered>1</NumberOfOfferListingsConsidered>'
+                    '%s<MultipleOffersAtLowestPrice>False</MultipleOffersAtLowestPrice>'
+                    '</LowestOfferListing>' % _render_price(price) for price in prices))
+        for asin, prices in offers.items()))
+
+
+def render_error_response(code: str, message: str, error_type: str = 'Sender') -> str:
+    """
+    Render an MWS ErrorResponse document
+
+    Args:
+        code: MWS error code (e.g. RequestThrottled)
+        message: Error message
+
+    Keyword Args:
+        error_type: Sender or Receiver
+
+    Returns:
+        XML string
+    """
+    return '<?xml version="1.0"?>' \
+           '<ErrorResponse xmlns="%s"><Error><Type>%s</Type><Code>%s</Code>' \
+           '<Message>%s</Message></Error><RequestID>%s</RequestID></ErrorResponse>' % (
+               PRODUCTS_NAMESPACE, error_type, code, escape(message), uuid.uuid4())
+
+
+def _identifier(asin: str) -> dict:
+    return {'Identifiers': {'MarketplaceASIN': {
+        'MarketplaceId': {'value': config.MARKETPLACE_IDS['US']},
+        'ASIN': {'value': asin}}}}
+
+
+class Simulator(object):
+    """
+    Synthetic search results and MWS products served over HTTP
+
+    Keyword Args:
+        page_count: Number of search result pages for any search
+        results_per_page: ASINs listed on each page
+        variation_children: Variation children for every search result ASIN
+        latency: Mean added latency in seconds for every response
+        stall_rate: Fraction of responses that stall for stall_seconds on top of the latency
+        stall_seconds: Seconds a stalled response waits
+        block_rate: Fraction of search and detail pages answered with a robot check page
+        error_rate: Fraction of MWS requests answered with an InternalError
+        quota: MWS maximum request quota
+        restore_rate: MWS quota restored per second
+        pricing_quota: Maximum request quota of each pricing operation
+        pricing_restore_rate: Pricing operation quota restored per second
+        fixture_dir: Directory holding product_api_response.json
+    """
+
+    def __init__(self,
+                 page_count: int = config.SIMULATOR_PAGE_COUNT,
+                 results_per_page: int = config.SIMULATOR_RESULTS_PER_PAGE,
+                 variation_children: int = 0,
+                 latency: float = 0.0,
+                 stall_rate: float = 0.0,
+                 stall_seconds: float = 10.0,
+                 block_rate: float = 0.0,
+                 error_rate: float = 0.0,
+                 quota: float = config.SIMULATOR_MWS_QUOTA,
+                 restore_rate: float = config.SIMULATOR_MWS_RESTORE_RATE,
+                 pricing_quota: float = config.PRICING_QUOTA,
+                 pricing_restore_rate: float = config.PRICING_RESTORE_RATE,
+                 fixture_dir: Path = FIXTURE_DIRECTORY):
+        self.page_count = page_count
+        self.results_per_page = results_per_page
+        self.variation_children = variation_children
+        self.latency = latency
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.block_rate = block_rate
+        self.error_rate = error_rate
+        self.quota = TokenBucket(quota, restore_rate)
+        self.pricing_quotas = {action: TokenBucket(pricing_quota, pricing_restore_rate)
+                               for action in PRICING_ACTIONS}
+
+        with (fixture_dir / 'product_api_response.json').open() as infile:
+            self._template = json.load(infile)
+
+        self._lock = threading.Lock()
+        self.counts = {'search_requests': 0, 'detail_requests': 0, 'mws_requests': 0,
+                       'pricing_requests': 0, 'throttled': 0, 'errors': 0, 'blocked': 0}
+        self._servers = []  # type: List[ThreadingHTTPServer]
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def delay(self):
+        """
+        Sleep for the configured latency with some jitter, and stall some responses
+
+        """
+        if self.latency:
+            time.sleep(max(0.0, random.gauss(self.latency, self.latency / 4)))
+        if self.stall_rate and random.random() < self.stall_rate:
+            time.sleep(self.stall_seconds)
+
+    def blocked(self) -> bool:
+        """
+        Whether to answer the current page request with a robot check page
+
+        Returns:
+            True for about block_rate of the calls
+        """
+        if self.block_rate and random.random() < self.block_rate:
+            self._count('blocked')
+            return True
+        return False
+
+    def search_page(self, page: int) -> str:
+        """
+        Search result page for any search, pages past the last one are empty
+
+        Args:
+            page: Page number
+
+        Returns:
+            HTML string
+        """
+        self._count('search_requests')
+        asins = [search_asin(page, index) for index in range(self.results_per_page)] \
+            if 1 <= page <= self.page_count else []
+        return render_search_page(asins, self.page_count, page)
+
+    def detail_page(self, asin: str) -> str:
+        """
+        Product detail page linking to the product's variation family
+
+        Args:
+            asin: Product ASIN
+
+        Returns:
+            HTML string
+        """
+        self._count('detail_requests')
+        relationships = self.product(asin)['Product']['Relationships']
+        related = [item['Identifiers']['MarketplaceASIN']['ASIN']['value']
+                   for key in relationships
+                   for item in (relationships[key] if isinstance(relationships[key], list)
+                                else [relationships[key]])]
+        return render_detail_page(asin, '$%s' % self._price(asin), related)
+
+    @staticmethod
+    def _price(asin: str) -> str:
+        return '%d.%02d' % (10 + sum(map(ord, asin)) % 190, sum(map(ord, asin)) % 100)
+
+    def product(self, asin: str) -> dict:
+        """
+        Synthetic parsed product for an ASIN built from the fixture
+
+        Args:
+            asin: ASIN to describe
+
+        Returns:
+            Product dict in the shape of the mws parsed response
+        """
+        product = copy.deepcopy(self._template)
+        product['ASIN']['value'] = asin
+        product['Product']['Identifiers']['MarketplaceASIN']['ASIN']['value'] = asin
+
+        attributes = product['Product']['AttributeSets']['ItemAttributes']
+        attributes['Title']['value'] = 'Synthetic Product %s' % asin
+        attributes['ListPrice']['Amount']['value'] = self._price(asin)
+
+        relationships = {}
+        if asin.startswith('C'):
+            relationships = {'VariationParent': _identifier(parent_asin(asin))}
+        elif self.variation_children:
+            relationships = {'VariationChildren': [_identifier(child_asin(asin, number))
+                                                   for number in range(self.variation_children)]}
+        product['Product']['Relationships'] = relationships
+        return product
+
+    def matching_product(self, asins: List[str]) -> Tuple[int, str]:
+        """
+        Answer a GetMatchingProduct request
+
+        Args:
+            asins: Requested ASINs
+
+        Returns:
+            HTTP status code and XML body
+        """
+        self._count('mws_requests')
+        if not self.quota.try_acquire():
+            self._count('throttled')
+            return 503, render_error_response('RequestThrottled', 'Request is throttled')
+        if random.random() < self.error_rate:
+            self._count('errors')
+            return 500, render_error_response('InternalError', 'Simulated failure', 'Receiver')
+        if len(asins) > 10:
+            return 400, render_error_response('InvalidParameterValue',
+                                              'Maximum of 10 ASINs per request')
+        return 200, render_matching_product_response([self.product(asin) for asin in asins])
+
+    def offers(self, asin: str) -> List[str]:
+        """
+        Offer prices of a product, derived from its list price
+
+        Args:
+            asin: ASIN to price
+
+        Returns:
+            Prices as strings, the first one holds the buy box
+        """
+        list_price = Decimal(self._price(asin))
+        return ['%.2f' % (list_price * Decimal(factor)) for factor in OFFER_PRICE_FACTORS]
+
+    def pricing(self, action: str, asins: List[str]) -> Tuple[int, str]:
+        """
+        Answer a GetCompetitivePricingForASIN or GetLowestOfferListingsForASIN request
+
+        Args:
+            action: One of PRICING_ACTIONS
+            asins: Requested ASINs
+
+        Returns:
+            HTTP status code and XML body
+        """
+        self._count('pricing_requests')
+        if not self.pricing_quotas[action].try_acquire():
+            self._count('throttled')
+            return 503, render_error_response('RequestThrottled', 'Request is throttled')
+        if random.random() < self.error_rate:
+            self._count('errors')
+            return 500, render_error_response('InternalError', 'Simulated failure', 'Receiver')
+        if len(asins) > 20:
+            return 400, render_error_response('InvalidParameterValue',
+                                              'Maximum of 20 ASINs per request')
+        offers = {asin: self.offers(asin) for asin in asins}
+        if action == 'GetCompetitivePricingForASIN':
+            return 200, render_competitive_pricing_response(offers)
+        return 200, render_lowest_offers_response(offers)
+
+    def start(self, host: str = '127.0.0.1', search_port: int = 0,
+              mws_port: int = 0) -> Tuple[str, str]:
+        """
+        Start both servers on background threads
+
+        Keyword Args:
+            host: Interface to bind
+            search_port: Port for search pages (0 picks a free port)
+            mws_port: Port for MWS (0 picks a free port)
+
+        Returns:
+            Base urls for the search server and the MWS server
+        """
+        urls = []
+        for port, handler in ((search_port, _SearchHandler), (mws_port, _MWSHandler)):
+            server = ThreadingHTTPServer((host, port), handler)
+            server.simulator = self
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers.append(server)
+            urls.append('http://%s:%d' % server.server_address[:2])
+        return urls[0], urls[1]
+
+    def stop(self):
+        """
+        Shut down all running servers
+
+        """
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, which Nagle holds back on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pragma: no cover
+        pass
+
+    def _query(self) -> Dict[str, List[str]]:
+        return parse_qs(urlparse(self.path).query)
+
+    def _respond(self, status: int, body: str, content_type: str):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _SearchHandler(_Handler):
+
+    def do_GET(self):
+        simulator = self.server.simulator  # type: Simulator
+        simulator.delay()
+        # The path may be in absolute form, so the server also works as an HTTP proxy
+        path = urlparse(self.path).path
+        if simulator.blocked():
+            self._respond(200, render_block_page(), 'text/html;charset=UTF-8')
+        elif path.startswith('/s/'):
+            page = int(self._query().get('page', ['1'])[0])
+            self._respond(200, simulator.search_page(page), 'text/html;charset=UTF-8')
+        elif path.startswith('/dp/'):
+            asin = path.split('/')[2]
+            self._respond(200, simulator.detail_page(asin), 'text/html;charset=UTF-8')
+        else:
+            self._respond(404, '<html><body>Not Found</body></html>', 'text/html')
+
+
+class _MWSHandler(_Handler):
+
+    def _handle(self, query: Dict[str, List[str]]):
+        simulator = self.server.simulator  # type: Simulator
+        simulator.delay()
+        action = query.get('Action', [''])[0]
+        asin_keys = sorted((key for key in query if key.startswith('ASINList.ASIN.')),
+                           key=lambda key: int(key.rsplit('.', 1)[1]))
+        asins = [query[key][0] for key in asin_keys]
+        if action == 'GetMatchingProduct':
+            status, body = simulator.matching_product(asins)
+        elif action in PRICING_ACTIONS:
+            status, body = simulator.pricing(action, asins)
+        else:
+            status, body = 400, render_error_response('InvalidParameterValue',
+                                                      'Unsupported action')
+        self._respond(status, body, 'text/xml')
+
+    def do_GET(self):
+        self._handle(self._query())
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        query = self._query()
+        query.update(parse_qs(self.rfile.read(length).decode('utf-8')))
+        self._handle(query)
+
+
+def serve(simulator: Simulator, host: str = '127.0.0.1', search_port: int = 8080,
+          mws_port: int = 8081):  # pragma: no cover
+    """
+    Run the simulator in the foreground until interrupted
+
+    Args:
+        simulator: Configured Simulator
+
+    Keyword Args:
+        host: Interface to bind
+        search_port: Port for search pages
+        mws_port: Port for MWS
+
+    """
+    search_url, mws_url = simulator.start(host, search_port, mws_port)
+    print('AWS_SEARCHER_AMAZON_URL=%s' % search_url)
+    print('AWS_SEARCHER_MWS_URL=%s' % mws_url)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+        print(json.dumps(simulator.counts))
@@ -1,5 +1,13 @@
 """
-Celery tasks
+Pipeline stage workers and the fetch, parse and serialize steps they run
+
+pipeline.run_job starts threads running page_worker (search result pages to
+ASINs), api_worker (GetMatchingProduct batches from the frontier),
+detail_worker (product detail pages) and pricing_worker (competitive and
+lowest offer prices), and a ConcurrencyController grows and shrinks each
+stage's thread count.  Each worker writes its rows to its own csv and JSON
+files in the job's scratch directory, which the pipeline combines and loads
+into the database when the job finishes.
 """
 from typing import List, Dict, NoReturn
 import uuid
@@ -8,10 +16,35 @@ from queue import Queue
 import json
 import logging
 import itertools
+import threading
+import time
 
 import aws_searcher.searcher as searcher
 import aws_searcher.config as config
 import aws_searcher.mws_api as mws_api
+import aws_searcher.extraction as extraction
+from aws_searcher.asin_index import AsinIndex
+from aws_searcher.budget import JobBudget
+from aws_searcher.concurrency import STOP, Stage
+from aws_searcher.ratelimit import TokenBucket
+from aws_searcher.incremental import ChangeDetector
+from aws_searcher.frontier import Frontier
+from aws_searcher.family import FamilyGraph, queue_families, relationship_families
+from aws_searcher.pagination import Paginator
+from aws_searcher.retry import RetryTracker
+from aws_searcher.prices import PriceStore
+from aws_searcher.pricing import PricingScheduler, take_batch
+from aws_searcher.records import DetailRow, RelationshipRow
+from aws_searcher.logger import HOT_PATH
+
+_DETAIL_LOCK = threading.Lock()
+
+
+class PageNotServed(Exception):
+    """
+    Raised when a search result page request is refused (blocked or throttled)
+    """
+    pass
 
 
 def get_asin_data(asin_list: List[str], marketplace_id: str) -> Dict[str, list]:  # pragma: no cover
@@ -48,9 +81,30 @@ def get_asins_from_amazon_search_page(category: str,
     Returns:
         List of ASINs or empty list if page_number is not in range
     """
+    return get_search_page(category, search_terms, page_number)['asins']
+
+
+def get_search_page(category: str, search_terms: str, page_number: int) -> dict:  # pragma: no cover
+    """
+    Get one search result page and return its ASINs and the pagination limit
+
+    Args:
+        category: The Amazon Search category (e.g. Sports & Outdoors)
+        search_terms: Search terms to use
+        page_number: Page number of search result pagination
+
+    Returns:
+        A dict with 'asins' & 'last_page_number' as keys where
+        'asins' value is a list of ASINs and 'last_page_number' value
+        is an integer representing the last page, None if the page does not show it
+    """
     soup = searcher.get_amazon_search_result(category, search_terms, page_number)
-    searcher.timeout()
-    return searcher.collect_target_pages_from_search_response(soup)
+    if soup is None:
+        raise PageNotServed("Search page %d was not served" % page_number)
+    if not searcher.last_response_cached():
+        searcher.timeout()
+    return {'asins': searcher.collect_target_pages_from_search_response(soup),
+            'last_page_number': searcher.get_pagination(soup)}
 
 
 def serialize_data_to_csv(data: List[Dict[str, str]],
@@ -90,17 +144,18 @@ def serialize_data_to_json(data: List[Dict[str, str]], directory: Path) -> NoRet
         json.dump(data, outfile)
 
 
-def combine_json_files(name: str):  # pragma: no cover
+def combine_json_files(name: str, scratch_dir: Path, output_dir: Path):
     """
     Collect all output json files, combine into one list, re-serialize to single file
 
     Args:
         name: String representation of JSON file name
+        scratch_dir: Job scratch directory the workers wrote to
+        output_dir: Directory for the combined file
 
     """
-    json_files_path = Path.home() / config.DATA_DIRECTORY
-    output_json_file = json_files_path / (name + '.json')
-    json_files = json_files_path.glob('*.json')
+    output_json_file = output_dir / (name + '.json')
+    json_files = scratch_dir.glob('*.json')
     all_json_data = []
     for file in json_files:
         with file.open() as infile:
@@ -121,208 +176,478 @@ def flatten_item_attributes(json_dict) -> Dict[str, str]:
     Returns:
         Dictionary with flattened json
     """
-    out = {}
-
-    def flatten(x, name=''):
-        if isinstance(x, dict):
-            for a in x:
-                flatten(x[a], name + a + '_')
-        elif isinstance(x, list):
-            i = 0
-            for a in x:
-                flatten(a, name + str(i) + '_')
-                i += 1
-        else:
-            out[name[:-1].replace('_value', '')] = x
+    return extraction.flatten_attributes(json_dict)
 
-    flatten(json_dict)
-    return out
 
-
-def extract_relationships_from_json(asin: str, relationship_dict: dict) -> List[Dict[str, str]]:
+def extract_relationships_from_json(asin: str, relationship_dict: dict) -> List[RelationshipRow]:
     """
-    Extract group of dicts as rows with asin and it's parent (if applicable)
+    Extract group of rows with asin and it's parent (if applicable)
 
     Args:
         relationship_dict: Dictionary with relatinships as parent or list of children
 
     Returns:
-        List of dictionary with asin,  child or parent, and parent (empty string if asin is parent
+        List of rows with asin,  child or parent, and parent (empty string if asin is parent
         or orphan)
 
     """
     if not relationship_dict:
-        return [{'asin': asin, 'relationship': 'stand-alone', 'relative': ''}]
+        return [RelationshipRow(asin, 'stand-alone', '')]
     relationship = list(relationship_dict.keys())[0]
     related_asins_list = mws_api._extract_asin_from_relationshp(relationship_dict, relationship)
     if relationship == 'VariationParent':
-        return [{'asin': asin, 'relationship': 'child', 'relative': related_asins_list[0]}]
+        return [RelationshipRow(asin, 'child', related_asins_list[0])]
     else:
-        return [{'asin': related_asins, 'relationship': 'parent', 'relative': asin}
+        return [RelationshipRow(related_asins, 'parent', asin)
                 for related_asins in related_asins_list]
 
 
-def get_first_page(category: str, search_terms: str) -> dict:  # pragma: no cover
+def grouper(n, iterable) -> List[List[str]]:
     """
-    Get the first search result page and return initial ASINs and
-    the pagination limit
+    Break a list into sublists of n values
 
     Args:
-        category: The Amazon Search category (e.g. Sports & Outdoors)
-        search_terms: Search terms to use
+        n: Number of values per sublist (will make shorter list if n not possible)
+        iterable: iterable of values
 
     Returns:
-        A dict with 'asins' & 'last_page_number' as keys where
-        'asins' value is a list of ASINs and 'last_page_number' value
-        is an integer representing the last page
+        List of sublists divided into n groupings
     """
-    soup = searcher.get_amazon_search_result(category, search_terms, 1)
-    last_page = searcher.get_pagination(soup)
-    asins = searcher.collect_target_pages_from_search_response(soup)
-    return {'asins': asins, 'last_page_number': last_page}
+    args = [iter(iterable)] * n
+    return list(([e for e in t if e is not None] for t in itertools.zip_longest(*args)))
 
 
-def remove_files(data_dir: Path, extension: str) -> NoReturn:  # pragma: no cover
+def page_worker(page_q: Queue, frontier: Frontier, processed_q: Queue,
+                paginator: Paginator = None, budget: JobBudget = None,
+                index: AsinIndex = None, stage: Stage = None):  # pragma: no cover
     """
-    Remove iterative files used to combine into final result
+    Worker function for threading out asins from website pages
 
     Args:
-        data_dir: Data directory where output was written
-        extension: extension to target for removal
+        page_q: Queue with arg dicts for get_search_page
+        frontier: Frontier of ASINs to be processed on MWS API
+        processed_q: ASINs that have already been processed
+
+    Keyword Args:
+        paginator: Told about every fetched page so it can queue further pages
+        budget: Job budget every page is taken from, pages past it are deferred
+        index: ASIN index of earlier jobs, a page's new ASINs are queued before known ones
+        stage: Concurrency stage to report to and retire from
 
     """
-    for file in data_dir.glob('*.' + extension):
-        file.unlink()
+    while True:
+        if stage is not None and stage.should_retire():
+            return
 
+        arg_dict = page_q.get()
+        if arg_dict is STOP:
+            page_q.task_done()
+            return
 
-def grouper(n, iterable) -> List[List[str]]:
+        if paginator is not None and not paginator.wanted(arg_dict['page_number']):
+            page_q.task_done()
+            continue
+
+        if budget is not None and not budget.take_page():
+            if paginator is not None:
+                paginator.stop()
+            budget.defer('pages', [arg_dict['page_number']])
+            page_q.task_done()
+            continue
+
+        logging.info("Processing page: %d", arg_dict['page_number'], extra=HOT_PATH)
+
+        started = time.monotonic()
+        try:
+            page = get_search_page(**arg_dict)
+        except Exception as e:
+            logging.error("Page %d failed: %s", arg_dict['page_number'], e)
+            if stage is not None:
+                stage.record(time.monotonic() - started, error=True,
+                             throttled=isinstance(e, PageNotServed))
+            page_q.task_done()
+            continue
+
+        if stage is not None:
+            stage.record(time.monotonic() - started)
+
+        asins = page['asins']
+        if index is not None:
+            # New products are admitted ahead of ones earlier jobs fetched, so they take
+            # the ASIN budget and the earlier MWS batches first
+            asins, new = index.new_first(asins)
+            logging.info("Page %d: %d ASINs, %d not fetched by earlier jobs",
+                         arg_dict['page_number'], len(asins), new, extra=HOT_PATH)
+        logging.info("Page processed, adding ASINs to queue", extra=HOT_PATH)
+
+        if paginator is not None:
+            paginator.seen(arg_dict['page_number'], len(asins), page['last_page_number'])
+        frontier.put(asins, depth=0, block=True)
+        page_q.task_done()
+
+
+def queue_for_details(asins: List[str], detail_q: Queue, detail_seen: set) -> int:
     """
-    Break a list into sublists of n values
+    Queue ASINs for the detail page stage, skipping any already queued
 
     Args:
-        n: Number of values per sublist (will make shorter list if n not possible)
-        iterable: iterable of values
+        asins: ASINs discovered by another stage
+        detail_q: Queue feeding detail_worker
+        detail_seen: ASINs queued for details so far in this job
 
     Returns:
-        List of sublists divided into n groupings
+        Number of ASINs queued
     """
-    args = [iter(iterable)] * n
-    return list(([e for e in t if e is not None] for t in itertools.zip_longest(*args)))
+    with _DETAIL_LOCK:
+        new_asins = [asin for asin in dict.fromkeys(asins) if asin not in detail_seen]
+        detail_seen.update(new_asins)
+    for asin in new_asins:
+        detail_q.put(asin)
+    return len(new_asins)
 
 
-def page_worker(page_q: Queue, asin_q: Queue, processed_q: Queue):  # pragma: no cover
+def get_product_details(asin: str) -> Dict[str, object]:  # pragma: no cover
     """
-    Worker function for threading out asins from website pages
+    Fetch a product detail page and parse it with the searcher extractors
+
+    Args:
+        asin: ASIN of the product
+
+    Returns:
+        Dict with 'details' as a row of buy box values and 'related_asins' as ASINs
+        linked from the page
+    """
+    url = searcher.urljoin(config.AMAZON_BASE_URL, 'dp/' + asin)
+    soup = searcher.get_product_page(url)
+    if soup is None:
+        raise PageNotServed("Detail page for %s was not served" % asin)
+    details = searcher.parse_product_page_details({asin: url}, soup, stringify=True)
+    return {'details': DetailRow(**{'asin': asin,
+                                    config.DETAIL_COLUMNS['price']: details['price'],
+                                    config.DETAIL_COLUMNS['sellers']: details['sellers']}),
+            'related_asins': list(searcher.scan_detail_page_for_asin(soup).keys())}
+
+
+def detail_worker(detail_q: Queue, frontier: Frontier, processed_q: Queue,
+                  limiter: TokenBucket, scratch_dir: Path,
+                  stage: Stage = None):  # pragma: no cover
+    """
+    Worker function for fetching product detail pages
 
     Args:
-        page_q: Queue with arg dicts for get_asins_from_amazon_search_page
-        asin_q: Queue with ASINs to be processed on MWS API
+        detail_q: Queue with ASINs to fetch detail pages for
+        frontier: Frontier of ASINs to be processed on MWS API, newly found ASINs go here
         processed_q: ASINs that have already been processed
+        limiter: Token bucket shared by all detail workers
+        scratch_dir: Job scratch directory to write detail data to
+
+    Keyword Args:
+        stage: Concurrency stage to report to and retire from
 
     """
     while True:
-        arg_dict = page_q.get()
+        if stage is not None and stage.should_retire():
+            return
 
-        logging.info("Processing page: %d" % arg_dict['page_number'])
+        asin = detail_q.get()
+        if asin is STOP:
+            detail_q.task_done()
+            return
+        limiter.acquire()
 
-        asin_list = get_asins_from_amazon_search_page(**arg_dict)
+        started = time.monotonic()
+        try:
+            page_data = get_product_details(asin)
+        except Exception as e:
+            logging.error("Detail page for %s failed: %s", asin, e)
+            if stage is not None:
+                stage.record(time.monotonic() - started, error=True,
+                             throttled=isinstance(e, PageNotServed))
+            detail_q.task_done()
+            continue
 
-        logging.info("Page processed, adding ASINs to queue")
+        if stage is not None:
+            stage.record(time.monotonic() - started)
 
-        sub_groups = grouper(5, asin_list)
+        serialize_data_to_csv([page_data['details']], scratch_dir, extension='det')
 
-        for group in sub_groups:
-            for asin in group:
-                if asin not in processed_q.queue:
-                    group.remove(asin)
-            if group:
-                asin_q.put(group)
-        page_q.task_done()
+        frontier.put(page_data['related_asins'], depth=frontier.depth(asin) + 1)
 
+        detail_q.task_done()
 
-def api_worker(asin_q: Queue,
-               processed_q: Queue,
-               blocker_q: Queue,
-               marketplace_id: str):  # pragma: no cover
+
+def pricing_worker(pricing_q: Queue, scheduler: PricingScheduler, marketplace_id: str,
+                   scratch_dir: Path, budget: JobBudget = None, prices: PriceStore = None,
+                   stage: Stage = None):  # pragma: no cover
     """
-    Worker function for threading out api calls
+    Worker function for batched competitive pricing requests
 
     Args:
-        asin_q: Queue with ASINs to be processed on MWS API
-        processed_q: ASINs that have already been processed
-        blocker_q: ASINs that keep being tried but fail
-        marketplace_id: String represeentation
+        pricing_q: Queue with ASINs to price
+        scheduler: Pricing client holding the per-operation quotas, attempt counts and
+            backoff times
+        marketplace_id: MWS marketplace id
+        scratch_dir: Job scratch directory to write pricing rows to
+
+    Keyword Args:
+        budget: Job budget the pricing requests are taken from, batches past it are deferred
+        prices: Price history store to append competitive and lowest offer price changes to
+        stage: Concurrency stage to report to and retire from
 
     """
     while True:
-        queue_asin = asin_q.get()
-
-        log_asins = ', '.join(queue_asin)
+        if stage is not None and stage.should_retire():
+            return
+
+        asins = take_batch(pricing_q)
+        if not asins:
+            return
+
+        # ASINs still backing off from a failed batch go back on the queue, and the worker
+        # only idles briefly so that shutdown and the job budget are not held up
+        asins, waiting, wait = scheduler.ready(asins)
+        for asin in waiting:
+            pricing_q.put(asin)
+            pricing_q.task_done()
+        if not asins:
+            time.sleep(min(wait, config.PRICING_BACKOFF_POLL))
+            continue
 
-        logging.info("Processing ASINs: %s" % log_asins)
+        # One request per pricing operation
+        if budget is not None and not budget.take_api_calls(len(scheduler.buckets)):
+            budget.defer('pricing', asins)
+            for _ in asins:
+                pricing_q.task_done()
+            continue
 
+        started = time.monotonic()
         try:
-            asin_data_dict = mws_api.acquire_mws_product_data(marketplace_id, queue_asin)
+            rows = scheduler.price(marketplace_id, asins)
         except Exception as e:
-            logging.error(e)
-            logging.warning("API is throttling")
-            logging.warning("Pausing for a minute")
-            asin_q.task_done()
-            for asin in queue_asin:
-                if asin in blocker_q:
-                    continue
-            asin_q.put(queue_asin)
-            for item in queue_asin:
-                blocker_q.put(item)
-            searcher.time.sleep(60)
+            logging.error("Pricing for %d ASINs failed: %s", len(asins), e)
+            if stage is not None:
+                stage.record(time.monotonic() - started, error=True,
+                             throttled=mws_api.is_throttled(e))
+            retry, delay = scheduler.failed(asins)
+            if len(retry) < len(asins):
+                logging.warning("Gave up pricing %d ASINs", len(asins) - len(retry))
+            if retry:
+                logging.info("Retrying pricing for %d ASINs in %.1fs", len(retry), delay,
+                             extra=HOT_PATH)
+            for asin in retry:
+                pricing_q.put(asin)
+            for _ in asins:
+                pricing_q.task_done()
             continue
 
-        searcher.timeout()
+        if stage is not None:
+            stage.record(time.monotonic() - started)
 
-        logging.info("Serializing Raw Data for %s" % log_asins)
-        serialize_data_to_json(asin_data_dict['raw_data'], Path.home() / config.DATA_DIRECTORY)
+        try:
+            if prices is not None:
+                prices.record(rows)
+            serialize_data_to_csv(rows, scratch_dir, extension='prc')
+            logging.info("Priced %d ASINs", len(rows), extra=HOT_PATH)
+        except Exception:
+            logging.exception("Saving prices for %d ASINs failed", len(asins))
+        finally:
+            for _ in asins:
+                pricing_q.task_done()
+
+
+def requeue_failed(frontier: Frontier, retries: RetryTracker, asins: List[str],
+                   error: Exception):
+    """
+    Count a failed attempt for ASINs and requeue them after their backoff, or dead-letter
+    them at the attempt cap
 
-        logging.info("Save complete")
+    Args:
+        frontier: Frontier the ASINs came from
+        retries: Attempt counts, backoff and dead-lettering
+        asins: ASINs that failed
+        error: Why they failed
 
-        attributes = []
-        relationships = []
-        for data in asin_data_dict['raw_data']:
-            attributes.append(flatten_item_attributes(
-                data['Product']['AttributeSets']['ItemAttributes']
-            ))
-            relationships = relationships + extract_relationships_from_json(data['ASIN']['value'],
-                                                                            data['Product'][
-                                                                                'Relationships'])
+    """
+    retry, dead = retries.failed(asins, error)
+    for asin, delay in retry:
+        frontier.requeue([asin], delay=delay)
+    if dead:
+        logging.warning("Dead-lettered after %d attempts: %s",
+                        retries.policy.max_attempts, ', '.join(dead))
 
-        write_path = Path.home() / config.DATA_DIRECTORY
 
-        logging.info('Serializing Raw JSON Response')
-        serialize_data_to_json(asin_data_dict['raw_data'], write_path)
-        logging.info('Saved Raw JSON')
+def api_worker(frontier: Frontier,
+               processed_q: Queue,
+               retries: RetryTracker,
+               marketplace_id: str,
+               scratch_dir: Path,
+               detail_q: Queue = None,
+               detail_seen: set = None,
+               detector: ChangeDetector = None,
+               pause: bool = True,
+               prices: PriceStore = None,
+               pricing_q: Queue = None,
+               graph: FamilyGraph = None,
+               budget: JobBudget = None,
+               index: AsinIndex = None,
+               limiter: TokenBucket = None,
+               stage: Stage = None):  # pragma: no cover
+    """
+    Worker function for threading out api calls
 
-        logging.info('Serializing Two Dimensional Representation of Attributes')
-        serialize_data_to_csv(attributes, write_path, extension='txt')
-        logging.info('Saved Two Dimensional Representation of Attributes')
+    Args:
+        frontier: Frontier of ASINs to be processed on MWS API
+        processed_q: ASINs that have already been processed
+        retries: Attempt counts, backoff and dead-lettering for failed ASINs
+        marketplace_id: String represeentation
+        scratch_dir: Job scratch directory to write results to
 
-        logging.info('Serializing Relationships')
-        serialize_data_to_csv(relationships, write_path, extension='dat')
-        logging.info('Saved Relationships')
+    Keyword Args:
+        detail_q: Queue feeding the detail page stage, if enabled
+        detail_seen: ASINs already queued for the detail page stage
+        detector: Change detector for incremental runs, only new or changed ASINs are written
+        pause: Sleep a random interval after each request
+        prices: Price history store to append price changes to
+        pricing_q: Queue feeding the competitive pricing stage, if enabled
+        graph: Variation family graph to record relationships in and expand families from
+        budget: Job budget every MWS request is taken from, batches past it are deferred
+        index: ASIN index the fetched ASINs are recorded in.  With a detector, family
+            members it holds a fresh fetch of are not queued
+        limiter: Token bucket of the GetMatchingProduct quota, shared by concurrent jobs
+        stage: Concurrency stage to report to and retire from
 
-        logging.info('Serializing target values to csv')
-        serialize_data_to_csv(asin_data_dict['target_values'], write_path)
-        logging.info('Saved target values')
+    """
+    while True:
+        if stage is not None and stage.should_retire():
+            return
+
+        queue_asin = frontier.get_batch(config.GROUP_COUNT)
+        if not queue_asin:
+            # Only a stopped frontier hands out nothing
+            return
+
+        if detector is not None:
+            queue_asin, skipped = detector.skip_fresh(queue_asin)
+            for asin in skipped:
+                processed_q.put(asin, block=False)
+            if skipped:
+                # Skipped ASINs are not fetched, so their siblings can only come from the graph
+                if graph is not None:
+                    queue_families(frontier, graph.families(skipped), index, graph.max_age)
+                frontier.task_done(len(skipped))
+            if not queue_asin:
+                continue
+
+        if budget is not None and not budget.take_api_calls():
+            budget.defer('asins', [(asin, frontier.depth(asin)) for asin in queue_asin])
+            frontier.task_done(len(queue_asin))
+            continue
 
-        for asin in queue_asin:
-            processed_q.put(asin, block=False)
+        logging.info("Processing ASINs: %s", ', '.join(queue_asin), extra=HOT_PATH)
 
-        related_asins = [related_dict['asin'] for related_dict in relationships]
-        asins_add = grouper(5, related_asins)
+        if limiter is not None:
+            limiter.acquire()
+        started = time.monotonic()
+        try:
+            asin_data_dict = mws_api.acquire_mws_product_data(marketplace_id, queue_asin)
+        except Exception as e:
+            logging.error(e)
+            if stage is not None:
+                stage.record(time.monotonic() - started, error=True,
+                             throttled=mws_api.is_throttled(e))
+            requeue_failed(frontier, retries, queue_asin, e)
+            frontier.task_done(len(queue_asin))
+            continue
 
-        for group in asins_add:
-            for asin in group:
-                if asin in processed_q.queue:
-                    group.remove(asin)
-            if group:
-                asin_q.put(group)
+        elapsed = time.monotonic() - started
+        batch_size = len(queue_asin)
+        failed = True
+        written = False
+        try:
+            # Error results and ASINs missing from the response go back through the retries
+            returned = {row['asin'] for row in asin_data_dict['target_values']}
+            for asin in queue_asin:
+                if asin not in returned:
+                    message = asin_data_dict['errors'].get(asin, 'missing from the response')
+                    logging.warning("No product for %s: %s", asin, message)
+                    requeue_failed(frontier, retries, [asin], mws_api.ProductError(message))
+            queue_asin = [asin for asin in queue_asin if asin in returned]
+
+            if pause:
+                searcher.timeout()
+
+            write_path = scratch_dir
+
+            raw_data = asin_data_dict['raw_data']
+            target_values = target_values_all = asin_data_dict['target_values']
+            if prices is not None:
+                prices.record(target_values)
+            if detector is not None:
+                changes = detector.detect(raw_data, target_values)
+                logging.info("%d of %d ASINs new or changed", len(changes), len(target_values),
+                             extra=HOT_PATH)
+                raw_data = [data for data in raw_data if data['ASIN']['value'] in changes]
+                target_values = [row for row in target_values if row['asin'] in changes]
+                if changes:
+                    serialize_data_to_csv(list(changes.values()), write_path, extension='chg')
+
+            attributes = []
+            relationships = []
+            for row, data_relationships, data_attributes in zip(target_values_all,
+                                                                asin_data_dict['relationships'],
+                                                                asin_data_dict['attributes']):
+                relationships.extend(data_relationships)
+                if data_attributes is not None and (detector is None or row['asin'] in changes):
+                    attributes.append(data_attributes)
+
+            if graph is not None:
+                graph.record(relationships)
+                families = graph.families(queue_asin)
+                max_age = graph.max_age
+            else:
+                families = relationship_families(relationships)
+                max_age = config.FAMILY_MAX_AGE_HOURS
+            # Only incremental runs may leave out fresh members, a plain run writes them all
+            queue_families(frontier, families, index if detector is not None else None,
+                           max_age)
+
+            if raw_data:
+                serialize_data_to_json(raw_data, write_path)
+                serialize_data_to_csv(attributes, write_path, extension='txt')
+                serialize_data_to_csv([row for row in relationships
+                                       if detector is None or row['asin'] in changes
+                                       or row['relative'] in changes],
+                                      write_path, extension='dat')
+                serialize_data_to_csv(target_values, write_path)
+                logging.info('Saved raw JSON, attributes, relationships and target values '
+                             'for %d ASINs', len(raw_data), extra=HOT_PATH)
+
+            # Only a batch whose outputs are written counts as fetched.  Everything that
+            # can fail runs before this point, so a failed batch is retried without
+            # writing its rows twice
+            written = True
+            retries.succeeded(queue_asin)
+            if index is not None:
+                index.record(queue_asin)
+
+            for asin in queue_asin:
+                processed_q.put(asin, block=False)
 
-        asin_q.task_done()
+            if detail_q is not None:
+                queue_for_details(queue_asin, detail_q, detail_seen)
+
+            if pricing_q is not None:
+                for asin in queue_asin:
+                    pricing_q.put(asin)
+
+            failed = False
+        except Exception as e:
+            # Anything raised past the fetch must still mark the batch done, or the
+            # frontier never drains and the job waits on it forever
+            logging.exception("Processing results for ASINs %s failed", ', '.join(queue_asin))
+            if not written:
+                requeue_failed(frontier, retries, queue_asin, e)
+        finally:
+            if stage is not None:
+                stage.record(elapsed, error=failed)
+            frontier.task_done(batch_size)
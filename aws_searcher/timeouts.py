@@ -0,0 +1,134 @@
+"""
+Job deadlines and hedged requests
+
+A job can be given a deadline (its max_duration budget, see
+aws_searcher.budget): once it passes the pipeline stops waiting for the
+stages, defers the work still queued and finalizes what was gathered.
+Requests in flight at that point are bounded by the connect and read
+timeouts every outbound request now carries.
+
+Hedging cuts the tail latency of the search page stage.  Recent response
+latencies are kept in a window; a request still unanswered after their
+HEDGE_PERCENTILE is sent a second time and whichever response arrives first
+is used.  The slower request is left to finish in the background so that its
+latency still counts towards the window.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+import aws_searcher.config as config
+
+
+class Deadline(object):
+    """
+    Point in time a job has to finish by
+
+    Keyword Args:
+        seconds: Seconds from now, no deadline if not given
+    """
+
+    def __init__(self, seconds: float = None):
+        self.seconds = seconds
+        self.expires = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """
+        Seconds left
+
+        Returns:
+            Seconds until the deadline (not below 0), infinity without a deadline
+        """
+        if self.expires is None:
+            return float('inf')
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        """
+        Whether the deadline has passed
+
+        Returns:
+            True once the deadline has passed
+        """
+        return self.expires is not None and time.monotonic() >= self.expires
+
+
+class Hedger(object):
+    """
+    Runs requests with a duplicate sent when the first is slower than most
+
+    Keyword Args:
+        percentile: Percentile of recent latencies after which the duplicate is sent
+        min_samples: Latencies recorded before any request is hedged
+        window: Recent latencies kept
+        max_workers: Threads running requests
+    """
+
+    def __init__(self, percentile: float = config.HEDGE_PERCENTILE,
+                 min_samples: int = config.HEDGE_MIN_SAMPLES,
+                 window: int = config.HEDGE_WINDOW,
+                 max_workers: int = config.HEDGE_MAX_WORKERS):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0}
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='hedge')
+
+    def threshold(self) -> Optional[float]:
+        """
+        Seconds after which a request is hedged
+
+        Returns:
+            The percentile latency of the window, None until min_samples were recorded
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))]
+
+    def _timed(self, fetch: Callable, args: tuple):
+        started = time.monotonic()
+        result = fetch(*args)
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+        return result
+
+    def call(self, fetch: Callable, *args):
+        """
+        Call fetch(*args), calling it again if the first call is slow
+
+        Args:
+            fetch: Request function, has to be safe to call twice
+
+        Returns:
+            Result of the first call to succeed
+
+        Raises:
+            Exception: The first call's error when no call succeeded
+        """
+        threshold = self.threshold()
+        with self._lock:
+            self.stats['requests'] += 1
+        primary = self._executor.submit(self._timed, fetch, args)
+        if threshold is None or wait([primary], timeout=threshold).done:
+            return primary.result()
+
+        hedge = self._executor.submit(self._timed, fetch, args)
+        with self._lock:
+            self.stats['hedged'] += 1
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [future for future in done if future.exception() is None]
+            if succeeded:
+                winner = primary if primary in succeeded else hedge
+                if winner is hedge:
+                    with self._lock:
+                        self.stats['hedge_wins'] += 1
+                return winner.result()
+        return primary.result()
@@ -0,0 +1,127 @@
+"""
+Pooled keep-alive HTTP sessions shared by the page and MWS fetchers
+
+Module-level requests.get builds a new Session, and with it a new TCP (and
+TLS) connection, for every page.  A Transport instead keeps one Session per
+thread, since Sessions are not safe to share between threads, each with a
+connection pool per host that stays open between requests.  Pools of every
+thread are tracked so that the number of connections opened can be compared
+with the number of requests sent.
+"""
+import threading
+from typing import Dict
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import aws_searcher.config as config
+
+
+class Transport(object):
+    """
+    Thread local pooled Sessions with request timeouts and compressed transfer
+
+    Keyword Args:
+        base_url: Scheme and host every request is sent to instead of the one in its url,
+            e.g. a local stand-in, the path and query are kept
+        headers: Headers sent with every request
+        proxy: HTTP proxy url every request goes through
+        pool_connections: Hosts each thread keeps a connection pool for
+        pool_maxsize: Connections kept open per host and thread
+        timeout: (connect, read) timeout in seconds
+    """
+
+    def __init__(self, base_url: str = None, headers: Dict[str, str] = None,
+                 proxy: str = None,
+                 pool_connections: int = config.TRANSPORT_POOL_CONNECTIONS,
+                 pool_maxsize: int = config.TRANSPORT_POOL_MAXSIZE,
+                 timeout: tuple = (config.CONNECT_TIMEOUT, config.READ_TIMEOUT)):
+        self.base = urlsplit(base_url)[:2] if base_url else None
+        self.headers = dict(headers or {})
+        self.proxy = proxy
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._local = threading.local()
+        self._adapters = []
+        self._lock = threading.Lock()
+
+    def session(self) -> requests.Session:
+        """
+        Session of the calling thread, created on first use
+
+        Returns:
+            requests Session
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                                    'Connection': 'keep-alive'})
+            session.headers.update(self.headers)
+            if self.proxy is not None:
+                session.proxies = {'http': self.proxy, 'https': self.proxy}
+                session.trust_env = False
+            adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                  pool_maxsize=self.pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            with self._lock:
+                self._adapters.append(adapter)
+        return session
+
+    def url(self, url: str) -> str:
+        """
+        Url a request is actually sent to
+
+        Args:
+            url: Requested url
+
+        Returns:
+            url with the scheme and host replaced by base_url's, if given
+        """
+        if self.base is None:
+            return url
+        return urlunsplit(self.base + urlsplit(url)[2:])
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        GET a url on the calling thread's Session
+
+        Args:
+            url: Url to request
+
+        Keyword Args:
+            kwargs: Passed on to Session.get, e.g. headers or params
+
+        Returns:
+            Response
+
+        Raises:
+            requests.Timeout: Connecting or reading took longer than the timeout
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session().get(self.url(url), **kwargs)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Requests sent and connections opened over the pools of every thread
+
+        Returns:
+            Dict of 'requests', 'connections' and 'reuse' (share of requests sent on an
+            already open connection)
+        """
+        requests_sent = connections = 0
+        with self._lock:
+            adapters = list(self._adapters)
+        managers = [manager for adapter in adapters
+                    for manager in [adapter.poolmanager] + list(adapter.proxy_manager.values())]
+        for manager in managers:
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    requests_sent += pool.num_requests
+                    connections += pool.num_connections
+        reuse = 1 - connections / requests_sent if requests_sent else 0.0
+        return {'requests': requests_sent, 'connections': connections, 'reuse': reuse}
@@ -0,0 +1,96 @@
+"""
+Benchmark GetMatchingProduct response extraction
+
+Compares the mws library's DictWrapper parse followed by the dict walks for
+target values, relationships and item attributes against the lxml based
+extraction.extract_products, on responses of GROUP_COUNT products rendered
+by the simulator from the API response fixture.  Both must give the same
+results before any timing is reported.
+
+    PYTHONPATH=. python benchmarks/bench_extraction.py [--responses 2000]
+"""
+import argparse
+import time
+
+from mws.mws import DictWrapper
+
+import aws_searcher.config as config
+import aws_searcher.extraction as extraction
+import aws_searcher.mws_api as mws_api
+import aws_searcher.simulator as simulator
+import aws_searcher.tasks as tasks
+
+
+def parsed_extraction(xml: bytes) -> dict:
+    """
+    Extraction as done before extraction.py: DictWrapper, then one walk per output
+
+    Args:
+        xml: Raw response body
+
+    Returns:
+        Dict in the shape returned by extraction.extract_products
+    """
+    product_data = DictWrapper(xml.decode('utf-8'), 'GetMatchingProductResult').parsed
+    if isinstance(product_data, dict):
+        product_data = [product_data]
+    return {'raw_data': product_data,
+            'target_values': [mws_api._extract_target_data(data) for data in product_data],
+            'relationships': [tasks.extract_relationships_from_json(
+                data['ASIN']['value'], data['Product']['Relationships'])
+                for data in product_data],
+            'attributes': [tasks.flatten_item_attributes(
+                data['Product']['AttributeSets']['ItemAttributes'])
+                for data in product_data],
+            'errors': {}}
+
+
+def best_of(function, responses, repeat: int = 3) -> float:
+    """
+    Best wall time of extracting every response
+
+    Args:
+        function: Extraction function
+        responses: Response bodies
+
+    Keyword Args:
+        repeat: Timed rounds
+
+    Returns:
+        Seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for xml in responses:
+            function(xml)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--responses', type=int, default=2000, help='Responses per round')
+    args = parser.parse_args()
+
+    sim = simulator.Simulator(variation_children=3)
+    responses = []
+    for number in range(args.responses):
+        asins = [simulator.search_asin(number + 1, index) for index in range(config.GROUP_COUNT)]
+        asins[-1] = simulator.child_asin(asins[0], 0)
+        responses.append(simulator.render_matching_product_response(
+            [sim.product(asin) for asin in asins]).encode('utf-8'))
+
+    for xml in responses[:50]:
+        assert parsed_extraction(xml) == extraction.extract_products(xml)
+
+    parsed = best_of(parsed_extraction, responses)
+    streamed = best_of(extraction.extract_products, responses)
+    products = args.responses * config.GROUP_COUNT
+    print('DictWrapper + walks: %.3fs (%.1f us/product)' % (parsed, parsed / products * 1e6))
+    print('lxml extraction:     %.3fs (%.1f us/product)' % (streamed, streamed / products * 1e6))
+    print('speedup:             %.2fx' % (parsed / streamed))
+
+
+if __name__ == '__main__':
+    main()
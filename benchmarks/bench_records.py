@@ -0,0 +1,129 @@
+"""
+Benchmark row records against per-row dicts
+
+Measures the memory held by a million target and relationship rows built as
+dicts and as records.py records from the same values (tracemalloc, so only
+the row containers are counted), and the time searcher.serialize_to_csv
+takes to write them both ways.  Both must write the same csv rows before
+any timing is reported.
+
+    PYTHONPATH=. python benchmarks/bench_records.py [--rows 1000000]
+"""
+import argparse
+import csv
+import gc
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import aws_searcher.searcher as searcher
+from aws_searcher.records import RelationshipRow, TargetRow
+
+
+def sample_values(rows: int) -> dict:
+    """
+    Column values of target and relationship rows, shared by both row kinds
+
+    Args:
+        rows: Rows of each schema
+
+    Returns:
+        Dict of value tuples by Record subclass
+    """
+    target = [('B%09d' % number, 'Brand %d' % (number % 500), 'Product title %d' % number,
+               '%d.99' % (number % 200), 'USD') for number in range(rows)]
+    relationship = [('B%09d' % number, 'child', 'B%09d' % (number - number % 4))
+                    for number in range(rows)]
+    return {TargetRow: target, RelationshipRow: relationship}
+
+
+def build(row_type, values, as_dict: bool) -> list:
+    """
+    Rows of one schema
+
+    Args:
+        row_type: Record subclass naming the columns
+        values: Column value tuples
+        as_dict: Build dicts instead of records
+
+    Returns:
+        List of rows
+    """
+    if as_dict:
+        return [dict(zip(row_type.fields, row)) for row in values]
+    return [row_type(*row) for row in values]
+
+
+def held(row_type, values, as_dict: bool) -> int:
+    """
+    Bytes allocated for the rows and the list holding them
+
+    Returns:
+        Bytes
+    """
+    gc.collect()
+    tracemalloc.start()
+    rows = build(row_type, values, as_dict)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rows
+    return size
+
+
+def best_of(rows, path: Path, repeat: int = 3) -> float:
+    """
+    Best wall time of writing the rows with searcher.serialize_to_csv
+
+    Args:
+        rows: Rows
+        path: Output file
+
+    Keyword Args:
+        repeat: Timed rounds
+
+    Returns:
+        Seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        searcher.serialize_to_csv(rows, path)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def written(path: Path) -> list:
+    with path.open() as infile:
+        return sorted(csv.DictReader(infile), key=lambda row: tuple(sorted(row.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='Rows of each schema')
+    args = parser.parse_args()
+
+    scale = 1000000 / args.rows
+    with tempfile.TemporaryDirectory() as directory:
+        dict_path, record_path = Path(directory) / 'dicts.csv', Path(directory) / 'records.csv'
+        for row_type, values in sample_values(args.rows).items():
+            dicts, records = build(row_type, values, True), build(row_type, values, False)
+            searcher.serialize_to_csv(dicts[:1000], dict_path)
+            searcher.serialize_to_csv(records[:1000], record_path)
+            assert written(dict_path) == written(record_path)
+
+            dict_bytes, record_bytes = held(row_type, values, True), held(row_type, values, False)
+            dict_seconds, record_seconds = best_of(dicts, dict_path), best_of(records,
+                                                                              record_path)
+            print('%s (%d columns)' % (row_type.__name__, len(row_type.fields)))
+            print('  memory per 1M rows: dicts %.0f MB, records %.0f MB (%.1fx)'
+                  % (dict_bytes * scale / 1e6, record_bytes * scale / 1e6,
+                     dict_bytes / record_bytes))
+            print('  csv write:          dicts %.0f rows/s, records %.0f rows/s (%.2fx)'
+                  % (args.rows / dict_seconds, args.rows / record_seconds,
+                     dict_seconds / record_seconds))
+            del dicts, records
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Unit tests for asin_index.py
+"""
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aws_searcher.asin_index as asin_index
+import aws_searcher.models as models
+
+
+def test_merge(tmpdir):
+    """
+    Test that merges keep the ASINs sorted, add new ones and keep the later fetch time
+
+    """
+    path = Path(str(tmpdir)) / 'US.idx'
+    empty = asin_index.AsinIndex(path)
+    assert len(empty) == 0
+    assert 'B000000001' not in empty
+
+    assert asin_index.merge_index(path, {'B000000005': 500, 'B000000001': 100,
+                                         'B000000003': 300}) == 3
+    assert asin_index.merge_index(path, {'B000000000': 50, 'B000000003': 250,
+                                         'B000000004': 400, 'B000000009': 900,
+                                         'B000000005': 550}) == 6
+
+    index = asin_index.AsinIndex(path)
+    assert len(index) == 6
+    assert [index._keys[position].decode() for position in range(6)] == \
+        ['B000000000', 'B000000001', 'B000000003', 'B000000004', 'B000000005', 'B000000009']
+    assert [index.fetched_at(asin) for asin in ['B000000000', 'B000000001', 'B000000003',
+                                                'B000000004', 'B000000005', 'B000000009']] == \
+        [50, 100, 300, 400, 550, 900]
+    assert index.fetched_at('B000000002') is None
+    assert index.known(['B000000002', 'B000000009', 'short']) == ['B000000009']
+    assert path.stat().st_size == asin_index.HEADER.size + 6 * 14
+
+
+def test_record(tmpdir):
+    """
+    Test that recorded ASINs are looked up only once merged, count as fresh and are
+    ordered after new ASINs, and that values that cannot be ASINs are not recorded
+
+    """
+    path = Path(str(tmpdir)) / 'US.idx'
+    index = asin_index.AsinIndex(path)
+    index.record(['B000000002', 'B000000001', 'not an asin', 'B00000000\u00e9'])
+    index.record(['B000000003'], fetched_at=time.time() - 7200)
+    assert 'B000000001' not in index
+
+    assert index.merge() == 3
+    assert len(index) == 3
+    assert 'B00000000\u00e9' not in index
+    assert index.fresh(['B000000001', 'B000000003', 'B000000004', 'B000000002'], 3600) == \
+        ['B000000001', 'B000000002']
+    assert index.merge() == 0
+    assert index.new_first(['B000000002', 'B000000004', 'B000000001', 'B000000005']) == \
+        (['B000000004', 'B000000005', 'B000000002', 'B000000001'], 2)
+    index.close()
+
+
+def test_build_index(tmpdir):
+    """
+    Test rebuilding an index from the snapshots of one marketplace
+
+    """
+    engine = models.get_engine(Path(str(tmpdir)) / 'amazon.db')
+    models.create_tables(engine)
+    checked_at = datetime(2020, 1, 1)
+    rows = [{'marketplace': marketplace, 'asin': asin, 'payload_hash': '', 'checked_at': checked_at}
+            for marketplace, asin in [('US', 'B000000002'), ('US', 'B000000001'),
+                                      ('UK', 'B000000003')]]
+    engine.execute(models.AsinSnapshots.__table__.insert(), rows)
+
+    path = Path(str(tmpdir)) / 'US.idx'
+    assert asin_index.build_index(engine, 'US', path) == 2
+    index = asin_index.AsinIndex(path)
+    assert index.known(['B000000001', 'B000000002', 'B000000003']) == ['B000000001',
+                                                                       'B000000002']
+    assert index.fetched_at('B000000001') == int(checked_at.timestamp())
@@ -0,0 +1,100 @@
+"""
+Unit tests for budget.py
+"""
+import time
+from pathlib import Path
+
+import aws_searcher.budget as budget
+
+
+def test_unlimited():
+    """
+    Test that a job without budgets never stops
+
+    """
+    job_budget = budget.JobBudget()
+    assert not job_budget.limited
+    assert all(job_budget.take_page() for _ in range(100))
+    assert all(job_budget.take_api_calls(2) for _ in range(100))
+    assert not job_budget.stopped()
+    assert job_budget.reason is None
+    assert job_budget.usage() == {'pages': 100, 'api_calls': 200}
+
+
+def test_page_budget():
+    """
+    Test that running out of pages stops page intake but not the API calls
+
+    """
+    job_budget = budget.JobBudget(max_pages=3)
+    assert not job_budget.limited
+    assert [job_budget.take_page() for _ in range(5)] == [True, True, True, False, False]
+    assert job_budget.reason == budget.MAX_PAGES
+    assert not job_budget.stopped()
+    assert job_budget.take_api_calls()
+
+
+def test_api_call_budget():
+    """
+    Test that running out of API calls stops the job, and that it replaces the page
+    budget as the reason
+
+    """
+    job_budget = budget.JobBudget(max_pages=1, max_api_calls=5)
+    assert job_budget.limited
+    job_budget.take_page()
+    job_budget.take_page()
+    assert job_budget.reason == budget.MAX_PAGES
+
+    assert job_budget.take_api_calls(2)
+    assert job_budget.take_api_calls(2)
+    assert not job_budget.take_api_calls(2)
+    assert job_budget.api_calls == 4
+    assert job_budget.stopped()
+    assert job_budget.reason == budget.MAX_API_CALLS
+    assert not job_budget.take_api_calls()
+    assert not job_budget.take_page()
+
+
+def test_duration_budget():
+    """
+    Test that the job stops once its time is up
+
+    """
+    job_budget = budget.JobBudget(max_duration=0.05)
+    assert job_budget.limited
+    assert job_budget.take_page()
+    time.sleep(0.06)
+    assert job_budget.stopped()
+    assert job_budget.reason == budget.MAX_DURATION
+    assert not job_budget.take_page()
+
+
+def test_state(tmpdir):
+    """
+    Test writing and reading back deferred work
+
+    """
+    job_dir = Path(str(tmpdir))
+    assert budget.load_state(job_dir) is None
+
+    job_budget = budget.JobBudget(max_api_calls=0)
+    job_budget.defer('asins', [('B000000001', 0), ('B000000002', 1)])
+    job_budget.defer('pages', [4, 5])
+    job_budget.defer('pricing', ['B000000003'])
+    assert job_budget.deferred() == 5
+
+    budget.save_state(job_dir, {'job': 1, 'asins': job_budget.pending['asins']})
+    assert budget.load_state(job_dir) == {'job': 1, 'asins': [['B000000001', 0],
+                                                              ['B000000002', 1]]}
+
+
+def test_first_pending_page():
+    """
+    Test where a resumed job starts reading search pages
+
+    """
+    assert budget.first_pending_page([7, 5, 6], 7, 20) == 5
+    assert budget.first_pending_page([], 7, 20) == 8
+    assert budget.first_pending_page([], 7) == 8
+    assert budget.first_pending_page([], 20, 20) is None
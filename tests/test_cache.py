@@ -0,0 +1,133 @@
+"""
+Unit tests for cache.py
+"""
+from pathlib import Path
+
+import pytest
+import requests_mock
+
+import aws_searcher.cache as cache
+import aws_searcher.searcher as searcher
+
+
+@pytest.fixture
+def response_cache(tmpdir) -> cache.ResponseCache:
+    """
+    Pytest fixture for a cache in a temporary directory
+
+    Returns:
+        ResponseCache object
+    """
+    return cache.ResponseCache(Path(str(tmpdir)) / 'responses.db', ttl=60)
+
+
+def test_get_and_set(response_cache):
+    """
+    Test that a stored body comes back and hits/misses are counted
+
+    """
+    assert response_cache.get('http://test/1') is None
+
+    response_cache.set('http://test/1', '<div>Wieners!</div>')
+
+    assert response_cache.get('http://test/1') == '<div>Wieners!</div>'
+
+    stats = response_cache.stats()
+    assert stats['entries'] == 1
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['total_hits'] == 1
+
+
+def test_expired_entry_is_a_miss(response_cache):
+    """
+    Test that entries older than the TTL are not served and are pruned
+
+    """
+    response_cache.set('http://test/1', 'old')
+    response_cache.ttl = -1
+
+    assert response_cache.get('http://test/1') is None
+    assert response_cache.prune() == 1
+    assert response_cache.stats()['entries'] == 0
+
+
+def test_lru_eviction(response_cache):
+    """
+    Test that the least recently used entry is evicted first when over size
+
+    """
+    response_cache.set('http://test/1', 'a' * 100)
+    response_cache.set('http://test/2', 'b' * 100)
+    response_cache.get('http://test/1')
+
+    response_cache.max_bytes = response_cache.stats()['bytes'] + 1
+    response_cache.set('http://test/3', 'c' * 100)
+
+    assert response_cache.get('http://test/1') == 'a' * 100
+    assert response_cache.get('http://test/2') is None
+    assert response_cache.get('http://test/3') == 'c' * 100
+
+
+def test_offline_mode(response_cache):
+    """
+    Test that offline mode replays expired entries and raises on a miss
+
+    """
+    response_cache.set('http://test/1', 'cached')
+    offline_cache = cache.ResponseCache(response_cache.cache_path, ttl=-1, offline=True)
+
+    assert offline_cache.get('http://test/1') == 'cached'
+
+    with pytest.raises(cache.CacheMiss):
+        offline_cache.get('http://test/2')
+
+
+def test_search_result_served_from_cache(response_cache):
+    """
+    Test that get_amazon_search_result only goes to network on a cache miss
+
+    """
+    url = 'https://www.amazon.com/s/ref=nb_sb_noss_1?' \
+          'url=search-alias=sporting&page=1&field-keywords=oakley'
+
+    searcher.configure_cache(response_cache)
+    try:
+        with requests_mock.mock() as m:
+            m.get(url, text="<div id='test'>Wieners!</div>")
+            searcher.get_amazon_search_result('Sports & Outdoors', 'oakley')
+            assert not searcher.last_response_cached()
+
+            soup = searcher.get_amazon_search_result('Sports & Outdoors', 'oakley')
+            assert searcher.last_response_cached()
+            assert m.call_count == 1
+
+        assert soup.find('div', {'id': 'test'}).text == 'Wieners!'
+    finally:
+        searcher.configure_cache(None)
+
+
+def test_batched_lookups_and_stored_size(tmpdir):
+    """
+    Test that lookups are written every flush_lookups lookups and that the stored total
+    follows replaced and pruned entries
+
+    """
+    path = Path(str(tmpdir)) / 'responses.db'
+    response_cache = cache.ResponseCache(path, ttl=60, flush_lookups=3)
+    other = cache.ResponseCache(path, ttl=60)
+    response_cache.set('http://test/1', 'a' * 100)
+    response_cache.set('http://test/1', 'b' * 1000)
+    response_cache.set('http://test/2', 'c')
+
+    response_cache.get('http://test/1')
+    response_cache.get('http://test/3')
+    assert other.stats()['total_hits'] == 0
+    response_cache.get('http://test/2')
+    assert other.stats()['total_hits'] == 2
+    assert other.stats()['total_misses'] == 1
+
+    sizes = response_cache._connection().execute('SELECT SUM(size) FROM responses').fetchone()[0]
+    assert other.stats()['bytes'] == sizes
+    response_cache.prune(clear=True)
+    assert other.stats()['bytes'] == 0
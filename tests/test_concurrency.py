@@ -0,0 +1,124 @@
+"""
+Unit tests for concurrency.py
+"""
+from queue import Queue
+
+import pytest
+
+import aws_searcher.concurrency as concurrency
+
+
+@pytest.fixture
+def stage() -> concurrency.Stage:
+    """
+    Pytest fixture for a stage with small bounds
+
+    Returns:
+        Stage object
+    """
+    return concurrency.Stage('test', min_workers=1, max_workers=6, initial_workers=4,
+                             latency_target=1.0, error_threshold=0.2)
+
+
+def test_additive_increase(stage):
+    """
+    Test that healthy observations add a worker up to the maximum
+
+    """
+    for _ in range(3):
+        for _ in range(10):
+            stage.record(0.1)
+        stage.adjust()
+
+    assert stage.target == 6
+
+
+def test_multiplicative_decrease(stage):
+    """
+    Test that throttling, errors and slow tasks halve the workers down to the minimum
+
+    """
+    stage.record(0.1, throttled=True)
+    assert stage.adjust() == 2
+
+    stage.record(0.1, error=True)
+    stage.record(0.1)
+    assert stage.adjust() == 1
+
+    stage.record(5.0)
+    assert stage.adjust() == 1
+
+
+def test_no_observations_keeps_target(stage):
+    """
+    Test that an idle stage is left alone
+
+    """
+    assert stage.adjust() == 4
+
+
+def test_workers_retire_when_target_shrinks(stage):
+    """
+    Test that workers leave when there are more than the target
+
+    """
+    stage.active = 4
+    stage.target = 2
+
+    assert [stage.should_retire() for _ in range(3)] == [True, True, False]
+    assert stage.active == 2
+
+
+def test_controller_starts_workers(stage):
+    """
+    Test that the controller starts the target number of workers and they process a queue
+
+    """
+    work, done = Queue(), Queue()
+
+    def worker(in_q, out_q, stage=None):
+        while not stage.should_retire():
+            out_q.put(in_q.get() * 2)
+            in_q.task_done()
+
+    for number in range(10):
+        work.put(number)
+
+    controller = concurrency.ConcurrencyController(interval=60)
+    controller.add_stage(stage, worker, (work, done))
+    work.join()
+
+    assert stage.active == 4
+    assert sorted(done.queue) == [number * 2 for number in range(10)]
+
+
+def test_shutdown_wakes_blocked_workers(stage):
+    """
+    Test that shutdown stops workers blocked on an empty queue and joins them
+
+    """
+    work, done = Queue(), Queue()
+
+    def worker(in_q, out_q, stage=None):
+        while not stage.should_retire():
+            item = in_q.get()
+            if item is concurrency.STOP:
+                in_q.task_done()
+                return
+            out_q.put(item)
+            in_q.task_done()
+
+    controller = concurrency.ConcurrencyController(interval=60)
+    controller.start()
+    controller.add_stage(stage, worker, (work, done), wake=concurrency.queue_waker(work))
+    work.put('a')
+    work.join()
+
+    assert controller.shutdown(timeout=5) == 0
+    assert stage.target == 0
+    assert list(done.queue) == ['a']
+    assert work.unfinished_tasks == 0
+
+    # Shutting down again, as run_job's cleanup does, wakes nothing
+    assert controller.shutdown(timeout=5) == 0
+    assert work.empty()
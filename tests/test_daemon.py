@@ -0,0 +1,86 @@
+"""
+Unit tests for daemon.py
+"""
+import threading
+from pathlib import Path
+
+import pytest
+
+import aws_searcher.daemon as daemon
+import aws_searcher.models as models
+
+
+@pytest.fixture
+def running_daemon(tmpdir):
+    """
+    Pytest fixture for a daemon with a stand-in job function on a free port
+
+    Returns:
+        Tuple of JobManager, daemon url and the event releasing the stand-in jobs
+    """
+    release = threading.Event()
+
+    def run_job(category, terms, market, engine=None, progress=None, stage_targets=None,
+                **params):
+        progress.job_id = 41
+        progress.phase = 'crawling'
+        # Every job paces its requests with the daemon's limiters
+        assert params['pricing_scheduler'] is manager.pricing_scheduler
+        assert params['detail_limiter'] is manager.detail_limiter
+        assert params['product_limiter'] is manager.product_limiter
+        release.wait(5)
+        if terms == 'broken':
+            raise RuntimeError('MWS credentials missing')
+        stage_targets['api'] = params['max_depth']
+        progress.phase = 'complete'
+        return 41
+
+    manager = daemon.JobManager(engine=models.get_engine(Path(str(tmpdir)) / 'amazon.db'),
+                                run_job=run_job)
+    server = daemon.start(manager)
+    yield manager, 'http://%s:%d' % server.server_address[:2], release
+    release.set()
+    server.shutdown()
+    server.server_close()
+    manager.shutdown()
+
+
+def test_submit_and_wait(running_daemon):
+    """
+    Test that submitted jobs run, report progress and share learned stage targets
+
+    """
+    manager, url, release = running_daemon
+
+    submitted = daemon.submit_job(url, {'category': 'All Departments', 'terms': 'oakley',
+                                        'max_depth': 3})
+    assert submitted['id'] == 1
+    assert submitted['state'] in ('queued', 'running')
+
+    release.set()
+    finished = daemon.wait_for_job(url, submitted['id'], interval=0.01)
+    assert finished['state'] == 'complete'
+    assert finished['progress'] == {'job_id': 41, 'phase': 'complete'}
+    assert manager.stage_targets == {'api': 3}
+
+    failed = daemon.submit_job(url, {'category': 'All Departments', 'terms': 'broken'})
+    failed = daemon.wait_for_job(url, failed['id'], interval=0.01)
+    assert failed['state'] == 'failed'
+    assert failed['error'] == 'MWS credentials missing'
+    assert [job['id'] for job in daemon.job_status(url)] == [1, 2]
+
+
+def test_rejected_requests(running_daemon):
+    """
+    Test that bad submissions and unknown ids are refused with the daemon's message
+
+    """
+    _, url, _ = running_daemon
+
+    with pytest.raises(daemon.DaemonError, match='Unknown category'):
+        daemon.submit_job(url, {'category': 'Nowhere', 'terms': 'oakley'})
+    with pytest.raises(daemon.DaemonError, match='Unknown parameters: profile'):
+        daemon.submit_job(url, {'category': 'All Departments', 'terms': 'oakley',
+                                'profile': True})
+    with pytest.raises(daemon.DaemonError, match='Not found'):
+        daemon.job_status(url, 7)
@@ -0,0 +1,90 @@
+"""
+Unit tests for egress.py
+"""
+import pytest
+
+import aws_searcher.egress as egress
+import aws_searcher.simulator as simulator
+
+PAGE_URL = 'http://www.amazon.invalid/s/ref=sr_pg_1?page=1&field-keywords=oakley'
+
+
+@pytest.fixture
+def proxies():
+    """
+    Pytest fixture for two local proxy stand-ins: a healthy one and one that only
+    serves robot check pages
+
+    Returns:
+        Tuple of (healthy proxy url, blocked proxy url)
+    """
+    healthy = simulator.Simulator(page_count=3, results_per_page=4)
+    blocked = simulator.Simulator(page_count=3, results_per_page=4, block_rate=1.0)
+    urls = (healthy.start()[0], blocked.start()[0])
+    yield urls
+    healthy.stop()
+    blocked.stop()
+
+
+def test_is_blocked(proxies):
+    """
+    Test that robot check pages count as blocked and ordinary pages do not
+
+    """
+    healthy, blocked = proxies
+
+    assert not egress.is_blocked(egress.Route(healthy).transport.get(PAGE_URL))
+    assert egress.is_blocked(egress.Route(blocked).transport.get(PAGE_URL))
+
+
+def test_from_proxies():
+    """
+    Test that header profiles are handed to the routes in turn
+
+    """
+    pool = egress.EgressPool.from_proxies([egress.DIRECT, 'http://a:1', 'http://b:2'],
+                                          profiles=[{'User-Agent': 'one'},
+                                                    {'User-Agent': 'two'}])
+
+    assert [route.transport.headers['User-Agent'] for route in pool.routes] == \
+        ['one', 'two', 'one']
+    assert pool.routes[0].transport.proxy is None
+    assert pool.routes[1].transport.proxy == 'http://a:1'
+
+
+def test_traffic_moves_to_healthy_route(proxies):
+    """
+    Test that a route serving block pages loses health and most of the traffic, and that
+    its refused pages are fetched over the healthy route
+
+    """
+    healthy, blocked = proxies
+    pool = egress.EgressPool([egress.Route(healthy, rate=1000, burst=1000, alpha=0.2),
+                              egress.Route(blocked, rate=1000, burst=1000, alpha=0.2)])
+
+    for _ in range(60):
+        assert not egress.is_blocked(pool.get(PAGE_URL))
+    stats = pool.stats()
+    for _ in range(100):
+        pool.get(PAGE_URL)
+    later = pool.stats()
+
+    assert stats[blocked]['blocked'] == stats[blocked]['requests'] > 0
+    assert later[blocked]['health'] < 0.5
+    assert later[healthy]['health'] == 1.0
+    assert later[blocked]['requests'] - stats[blocked]['requests'] < 10
+
+
+def test_route_rate_limit(proxies):
+    """
+    Test that requests wait for the chosen route's token bucket
+
+    """
+    healthy, _ = proxies
+    route = egress.Route(healthy, rate=0.001, burst=2)
+    pool = egress.EgressPool([route])
+
+    pool.get(PAGE_URL)
+    pool.get(PAGE_URL)
+
+    assert route.bucket.wait_time() > 100
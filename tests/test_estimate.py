@@ -0,0 +1,52 @@
+"""
+Unit tests for estimate.py
+"""
+import aws_searcher.config as config
+import aws_searcher.estimate as estimate
+
+
+def test_pages_to_sample():
+    """
+    Test that sampled pages are spread up to the last page
+
+    """
+    assert estimate.pages_to_sample(20, 3) == [11, 20]
+    assert estimate.pages_to_sample(20, 5) == [6, 11, 15, 20]
+    assert estimate.pages_to_sample(2, 5) == [2]
+    assert estimate.pages_to_sample(1, 3) == []
+    assert estimate.pages_to_sample(None, 3) == [2]
+
+
+def test_related_asins():
+    """
+    Test that parents and children count as related, stand-alone rows do not
+
+    """
+    rows = [{'asin': 'B01', 'relationship': 'child', 'relative': 'B00'},
+            {'asin': 'B03', 'relationship': 'parent', 'relative': 'B02'},
+            {'asin': 'B04', 'relationship': 'parent', 'relative': 'B02'},
+            {'asin': 'B05', 'relationship': 'stand-alone', 'relative': ''}]
+    assert estimate.related_asins(rows) == {'B00', 'B01', 'B02', 'B03', 'B04'}
+
+
+def test_extrapolate(monkeypatch):
+    """
+    Test size, MWS request and runtime extrapolation
+
+    """
+    monkeypatch.setattr(config, 'REQUEST_DELAY', (0, 0))
+    result = estimate.extrapolate(20, 10.0, [0.5, 2.0], page_seconds=1.0, api_seconds=0.5)
+    assert result['pages'] == 20
+    assert result['asins_by_depth'] == [200, 100, 200]
+    assert result['search_asins'] == 200
+    assert result['variation_asins'] == 300
+    assert result['asins'] == 500
+    assert result['api_calls'] == 100
+    # 100 requests with a quota of 20 restored at 2 a second outlast 4 workers at 0.5s
+    assert result['runtime_seconds'] == 40.0
+
+    result = estimate.extrapolate(20, 10.0, [0.5, 2.0], page_seconds=1.0, api_seconds=0.5,
+                                  asin_budget=50, pricing=True)
+    assert result['asins'] == 50
+    assert result['api_calls'] == 10 + 2 * 3
+    assert result['runtime_seconds'] == 5.0
@@ -0,0 +1,63 @@
+"""
+Unit tests for extraction.py
+"""
+import pytest
+
+import aws_searcher.extraction as extraction
+import aws_searcher.mws_api as api
+import aws_searcher.simulator as simulator
+import aws_searcher.tasks as tasks
+
+
+@pytest.fixture
+def products() -> list:
+    """
+    Pytest fixture for parsed products built from the API response fixture: a parent with
+    two variation children, one child and one stand-alone product
+
+    Returns:
+        List of product dicts in the shape of the mws parsed response
+    """
+    sim = simulator.Simulator(variation_children=2)
+    parent = simulator.search_asin(1, 0)
+    standalone = simulator.Simulator().product(simulator.search_asin(1, 1))
+    return [sim.product(parent), sim.product(simulator.child_asin(parent, 1)), standalone]
+
+
+def test_matches_parsed_extraction(products):
+    """
+    Test that extraction from the lxml tree gives the same results as walking the parsed dicts
+
+    """
+    xml = simulator.render_matching_product_response(products).encode('utf-8')
+
+    result = extraction.extract_products(xml)
+
+    assert result['raw_data'] == products
+    assert result['target_values'] == [api._extract_target_data(product) for product in products]
+    assert result['relationships'] == [
+        tasks.extract_relationships_from_json(product['ASIN']['value'],
+                                              product['Product']['Relationships'])
+        for product in products]
+    assert result['attributes'] == [
+        tasks.flatten_item_attributes(product['Product']['AttributeSets']['ItemAttributes'])
+        for product in products]
+    assert [row['relationship'] for row in result['relationships'][0]] == ['parent', 'parent']
+
+
+def test_error_result(products):
+    """
+    Test that error results are reported by ASIN and left out of the product lists
+
+    """
+    xml = simulator.render_matching_product_response(products[:1]).encode('utf-8')
+    error = b'<GetMatchingProductResult ASIN="B000000000" status="ClientError"><Error>' \
+            b'<Type>Sender</Type><Code>InvalidParameterValue</Code>' \
+            b'<Message>Invalid ASIN</Message></Error></GetMatchingProductResult>'
+    xml = xml.replace(b'</GetMatchingProductResponse>', error + b'</GetMatchingProductResponse>')
+
+    result = extraction.extract_products(xml)
+
+    assert [row['asin'] for row in result['target_values']] == [products[0]['ASIN']['value']]
+    assert len(result['raw_data']) == len(result['relationships']) == 1
+    assert result['errors'] == {'B000000000': 'ClientError: InvalidParameterValue: Invalid ASIN'}
@@ -0,0 +1,105 @@
+"""
+Unit tests for family.py
+"""
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+import aws_searcher.asin_index as asin_index
+import aws_searcher.family as family
+import aws_searcher.frontier as frontier
+import aws_searcher.models as models
+
+MARKET = 'ATVPDKIKX0DER'
+
+# A child's response names its parent, the parent's response lists its children
+CHILD_ROWS = [{'asin': 'C1', 'relationship': 'child', 'relative': 'P'}]
+PARENT_ROWS = [{'asin': child, 'relationship': 'parent', 'relative': 'P'}
+               for child in ['C1', 'C2', 'C3']]
+
+
+@pytest.fixture
+def graph(tmpdir) -> family.FamilyGraph:
+    """
+    Pytest fixture for a family graph in a temporary results db
+
+    Returns:
+        FamilyGraph object
+    """
+    engine = models.get_engine(Path(str(tmpdir)) / 'amazon.db')
+    models.BASE.metadata.create_all(bind=engine)
+    return family.FamilyGraph(engine, MARKET, job_id=1)
+
+
+def test_resolve_from_any_member(graph):
+    """
+    Test that a family is resolved from its parent or any child, and that stand-alone
+    rows and other families are left out
+
+    """
+    assert graph.record(PARENT_ROWS + CHILD_ROWS +
+                        [{'asin': 'S', 'relationship': 'stand-alone', 'relative': ''},
+                         {'asin': 'X1', 'relationship': 'child', 'relative': 'X'}]) == 4
+
+    assert graph.family('P') == ['P', 'C1', 'C2', 'C3']
+    assert graph.family('C3') == ['P', 'C1', 'C2', 'C3']
+    assert graph.family('S') == []
+    assert graph.families(['C2', 'X1']) == {'P': ('P', ['C1', 'C2', 'C3']),
+                                            'X': ('X', ['X1'])}
+
+
+def test_stale_edges_and_marketplace(graph):
+    """
+    Test that edges older than max_age and other marketplaces are ignored
+
+    """
+    graph.record(PARENT_ROWS)
+    with graph.engine.begin() as connection:
+        connection.execute(graph.table.update().where(graph.table.c.child == 'C3')
+                           .values(seen_at=datetime.now() - timedelta(hours=graph.max_age + 1)))
+
+    assert graph.family('C1') == ['P', 'C1', 'C2']
+    assert graph.family('C3') == []
+    assert family.FamilyGraph(graph.engine, 'A1F83G8C2ARO7P').family('P') == []
+
+
+def test_queue_families():
+    """
+    Test that a family reached from a child seed is queued parent first, then the
+    children together, one hop apart as when MWS reveals them
+
+    """
+    crawl_frontier = frontier.Frontier(max_depth=2)
+    crawl_frontier.put(['seed', 'C2'], depth=0)
+
+    admitted = family.queue_families(crawl_frontier,
+                                     family.relationship_families(PARENT_ROWS))
+
+    assert admitted == 3
+    assert crawl_frontier.get_batch(10) == ['seed', 'C2', 'P', 'C1', 'C3']
+    assert [crawl_frontier.depth(asin) for asin in ['P', 'C1', 'C3']] == [1, 2, 2]
+    assert family.queue_families(crawl_frontier, {'Q': ('Q', ['unknown'])}) == 0
+
+
+def test_queue_families_skips_fresh_members(tmpdir):
+    """
+    Test that family members an earlier job fetched recently are not queued, while
+    stale and unknown members are
+
+    """
+    path = Path(str(tmpdir)) / 'US.idx'
+    now = time.time()
+    asin_index.merge_index(path, {'B00000000P': now, 'B000000001': now,
+                                  'B000000002': now - 2 * 3600})
+    index = asin_index.AsinIndex(path)
+    crawl_frontier = frontier.Frontier(max_depth=2)
+    crawl_frontier.put(['B000000003'], depth=0)
+
+    families = {'B00000000P': ('B00000000P', ['B000000001', 'B000000002', 'B000000003',
+                                              'B000000004'])}
+    assert family.queue_families(crawl_frontier, families, index, max_age=1) == 2
+    assert crawl_frontier.get_batch(10) == ['B000000003', 'B000000002', 'B000000004']
+    assert [crawl_frontier.depth(asin) for asin in ['B000000002', 'B000000004']] == [2, 2]
+    index.close()
@@ -0,0 +1,144 @@
+"""
+Unit tests for frontier.py
+"""
+import threading
+from pathlib import Path
+
+import pytest
+
+import aws_searcher.frontier as frontier
+
+
+@pytest.fixture
+def asin_frontier(tmpdir) -> frontier.Frontier:
+    """
+    Pytest fixture for a small frontier that spills to a temporary directory
+
+    Returns:
+        Frontier object
+    """
+    crawl_frontier = frontier.Frontier(max_depth=2, budget=10, memory_limit=3, max_pending=4,
+                                       spill_path=Path(str(tmpdir)) / 'test.frontier')
+    yield crawl_frontier
+    crawl_frontier.close()
+
+
+def test_priority_order(asin_frontier):
+    """
+    Test that seeds come out before relationship ASINs, in arrival order per depth
+
+    """
+    asin_frontier.put(['child1', 'child2'], depth=1)
+    asin_frontier.put(['seed1', 'seed2'], depth=0)
+    asin_frontier.put(['grandchild'], depth=2)
+
+    assert asin_frontier.get_batch(10) == ['seed1', 'seed2', 'child1', 'child2', 'grandchild']
+    assert asin_frontier.stats['spilled'] == 2
+
+
+def test_dedupe_depth_and_budget(asin_frontier):
+    """
+    Test that duplicates, over depth and over budget ASINs are dropped
+
+    """
+    assert asin_frontier.put(['a', 'b', 'a']) == 2
+    assert asin_frontier.put(['c'], depth=3) == 0
+    assert asin_frontier.put([str(number) for number in range(20)], depth=1) == 8
+
+    assert asin_frontier.stats == {'admitted': 10, 'duplicates': 1, 'over_depth': 1,
+                                   'over_budget': 12, 'spilled': 7}
+    assert asin_frontier.depth('0') == 1
+    assert 'a' in asin_frontier
+
+
+def test_task_accounting(asin_frontier):
+    """
+    Test that join waits for every admitted and requeued ASIN
+
+    """
+    asin_frontier.put(['a', 'b'])
+    batch = asin_frontier.get_batch(5)
+    asin_frontier.requeue(batch)
+    asin_frontier.task_done(len(batch))
+
+    assert asin_frontier.unfinished_tasks == 2
+    assert asin_frontier.get_batch(5) == ['a', 'b']
+
+    asin_frontier.task_done(2)
+    asin_frontier.join()
+
+
+def test_backpressure(asin_frontier):
+    """
+    Test that a blocking producer waits until a consumer makes room
+
+    """
+    asin_frontier.put(['a', 'b', 'c', 'd'])
+    done = threading.Event()
+
+    def producer():
+        asin_frontier.put(['e'], block=True)
+        done.set()
+
+    threading.Thread(target=producer, daemon=True).start()
+
+    assert not done.wait(0.2)
+    asin_frontier.get_batch(1)
+    assert done.wait(2)
+
+
+def test_delayed_requeue(asin_frontier):
+    """
+    Test that a delayed ASIN is held back until its backoff has passed
+
+    """
+    asin_frontier.put(['a'])
+    asin_frontier.requeue(asin_frontier.get_batch(1), delay=0.2)
+    asin_frontier.task_done()
+
+    assert asin_frontier.get_batch(1, block=False) == []
+    assert asin_frontier.get_batch(1, timeout=2) == ['a']
+
+
+def test_cancel(asin_frontier):
+    """
+    Test that cancelling removes queued, spilled and delayed ASINs and admits no more
+
+    """
+    asin_frontier.put(['a', 'b', 'c', 'd'])
+    batch = asin_frontier.get_batch(1)
+    asin_frontier.requeue(['x'], delay=60)
+
+    assert sorted(asin_frontier.cancel()) == ['b', 'c', 'd', 'x']
+    assert asin_frontier.unfinished_tasks == 1
+
+    asin_frontier.requeue(batch)
+    assert asin_frontier.put(['e']) == 0
+    asin_frontier.task_done()
+    asin_frontier.join()
+    assert asin_frontier.get_batch(1, block=False) == []
+
+
+def test_stop(asin_frontier):
+    """
+    Test that stopping wakes blocked consumers and producers
+
+    """
+    full = frontier.Frontier(max_pending=1)
+    full.put(['a'])
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(asin_frontier.get_batch(1)),
+                                daemon=True),
+               threading.Thread(target=lambda: results.append(full.put(['b'], block=True)),
+                                daemon=True)]
+    for thread in threads:
+        thread.start()
+    assert not results
+
+    asin_frontier.stop()
+    full.stop()
+    for thread in threads:
+        thread.join(2)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert sorted(results, key=str) == [0, []]
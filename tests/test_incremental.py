@@ -0,0 +1,115 @@
+"""
+Unit tests for incremental.py
+"""
+import copy
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+import aws_searcher.asin_index as asin_index
+import aws_searcher.incremental as incremental
+import aws_searcher.models as models
+import aws_searcher.mws_api as api
+from aws_searcher.records import TargetRow
+
+
+@pytest.fixture
+def engine(tmpdir):
+    """
+    Pytest fixture for a results db in a temporary directory
+
+    Returns:
+        SQLAlchemy engine
+    """
+    engine = models.get_engine(Path(str(tmpdir)) / 'amazon.db')
+    models.BASE.metadata.create_all(bind=engine)
+    return engine
+
+
+@pytest.fixture
+def product() -> dict:
+    """
+    Pytest fixture for an MWS product payload
+
+    Returns:
+        Parsed product dict
+    """
+    file = Path(__file__).parent / 'resources' / 'product_api_response.json'
+    with file.open() as infile:
+        return json.load(infile)
+
+
+def _detect(detector: incremental.ChangeDetector, product: dict) -> dict:
+    return detector.detect([product], [api._extract_target_data(product)])
+
+
+def test_payload_hash_ignores_sales_rank(product):
+    """
+    Test that volatile keys do not change the payload hash
+
+    """
+    reranked = copy.deepcopy(product)
+    reranked['Product']['SalesRankings'] = {}
+
+    assert incremental.payload_hash(product) == incremental.payload_hash(reranked)
+
+
+def test_detect_new_changed_unchanged(engine, product):
+    """
+    Test classification across jobs and the changed field list
+
+    """
+    first = _detect(incremental.ChangeDetector(engine, 'US', 1), product)
+    assert first['B00D69E120']['change'] == 'new'
+
+    assert _detect(incremental.ChangeDetector(engine, 'US', 2), product) == {}
+
+    repriced = copy.deepcopy(product)
+    repriced['Product']['AttributeSets']['ItemAttributes']['ListPrice']['Amount']['value'] = '99.00'
+    third = _detect(incremental.ChangeDetector(engine, 'US', 3), repriced)
+
+    assert third['B00D69E120'] == {'asin': 'B00D69E120', 'change': 'changed', 'fields': 'price'}
+
+
+def test_detect_skips_error_results(engine):
+    """
+    Test that error results without a Product element are neither changes nor snapshots
+
+    """
+    error = {'ASIN': {'value': 'B000000000'}, 'status': {'value': 'ClientError'},
+             'Error': {'Code': {'value': 'InvalidParameterValue'}}}
+    detector = incremental.ChangeDetector(engine, 'US', job_id=1)
+
+    assert detector.detect([error], [TargetRow(asin='B000000000')]) == {}
+    assert detector._snapshots(['B000000000']) == {}
+
+
+def test_skip_fresh(engine, product):
+    """
+    Test that ASINs checked by an earlier job are skipped within the refresh interval
+
+    """
+    _detect(incremental.ChangeDetector(engine, 'US', 1), product)
+
+    assert incremental.ChangeDetector(engine, 'US', 2, refresh_interval=3600).skip_fresh(
+        ['B00D69E120', 'NEWASIN']) == (['NEWASIN'], ['B00D69E120'])
+
+    assert incremental.ChangeDetector(engine, 'US', 2).skip_fresh(
+        ['B00D69E120']) == (['B00D69E120'], [])
+
+
+def test_skip_fresh_index(engine, tmpdir):
+    """
+    Test that the refresh interval is checked against the ASIN index when one is given
+
+    """
+    index = asin_index.AsinIndex(Path(str(tmpdir)) / 'US.idx')
+    index.record(['B00D69E120'])
+    index.record(['B000000001'], fetched_at=time.time() - 7200)
+    index.merge()
+
+    detector = incremental.ChangeDetector(engine, 'US', 2, refresh_interval=3600, index=index)
+    assert detector.skip_fresh(['B000000001', 'B00D69E120', 'NEWASIN']) == \
+        (['B000000001', 'NEWASIN'], ['B00D69E120'])
@@ -0,0 +1,82 @@
+"""
+Unit tests for logger.py
+"""
+import io
+import json
+import logging
+import queue
+import time
+
+import pytest
+
+import aws_searcher.logger as logger
+
+
+def _record(message: str, level: int = logging.INFO, sampled: bool = True) -> logging.LogRecord:
+    record = logging.LogRecord('test', level, __file__, 1, message, (), None)
+    record.sampled = sampled
+    return record
+
+
+@pytest.fixture
+def root_handlers():
+    """
+    Pytest fixture restoring the root logger after configure_logging
+
+    """
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_sampling_filter():
+    """
+    Test that hot-path records are sampled per template and the next one carries the count
+
+    """
+    sampler = logger.SamplingFilter(rate=20, burst=1)
+
+    assert [sampler.filter(_record('Processing page: %d')) for _ in range(3)] == [True, False, False]
+    assert sampler.filter(_record('Saved %d ASINs'))
+    assert sampler.filter(_record('Processing page: %d', sampled=False))
+    assert sampler.filter(_record('Processing page: %d', level=logging.ERROR))
+
+    time.sleep(0.1)
+    record = _record('Processing page: %d')
+    assert sampler.filter(record)
+    assert record.suppressed == 2
+
+
+def test_queue_handler_drops_when_full():
+    """
+    Test that a full queue drops records instead of blocking or raising
+
+    """
+    handler = logger.DroppingQueueHandler(queue.Queue(1))
+    handler.handle(_record('first'))
+    handler.handle(_record('second'))
+
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().msg == 'first'
+
+
+def test_configure_logging_json(root_handlers):
+    """
+    Test that records are written as JSON by the listener thread
+
+    """
+    stream = io.StringIO()
+    listener = logger.configure_logging(json_output=True, stream=stream)
+    logging.getLogger('aws_scanner').info('Processing page: %d', 2, extra=logger.HOT_PATH)
+    logging.warning('Done')
+    listener.stop()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(line['level'], line['message']) for line in lines] == [('INFO', 'Processing page: 2'),
+                                                                   ('WARNING', 'Done')]
+    assert lines[0]['logger'] == 'aws_scanner'
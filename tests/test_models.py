@@ -0,0 +1,94 @@
+"""
+Unit tests for models.py
+"""
+import threading
+from pathlib import Path
+
+import aws_searcher.models as models
+
+
+def test_concurrent_writers(tmpdir):
+    """
+    Test that engines of separate jobs can write to one db at the same time
+
+    """
+    db_path = Path(str(tmpdir)) / 'amazon.db'
+    models.create_tables(models.get_engine(db_path))
+    errors = []
+
+    def write(terms: str):
+        engine = models.get_engine(db_path)
+        try:
+            for _ in range(50):
+                with engine.begin() as connection:
+                    connection.execute(models.Jobs.__table__.insert(),
+                                       [{'category': 'Sports & Outdoors', 'terms': terms}] * 10)
+        except Exception as e:
+            errors.append(e)
+
+    writers = [threading.Thread(target=write, args=('job%d' % number,)) for number in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    engine = models.get_engine(db_path)
+    with engine.begin() as connection:
+        assert connection.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.execute('SELECT count(*) FROM jobs').scalar() == 2000
+    assert errors == []
+
+
+def test_concurrent_create_tables(tmpdir):
+    """
+    Test that jobs starting at the same time can all create the schema
+
+    """
+    db_path = Path(str(tmpdir)) / 'amazon.db'
+    errors = []
+
+    def create():
+        try:
+            models.create_tables(models.get_engine(db_path))
+        except Exception as e:
+            errors.append(e)
+
+    creators = [threading.Thread(target=create) for _ in range(4)]
+    for creator in creators:
+        creator.start()
+    for creator in creators:
+        creator.join()
+
+    assert errors == []
+
+
+def test_add_missing_columns(tmpdir):
+    """
+    Test that columns added since a db was created are added to it
+
+    """
+    db_path = Path(str(tmpdir)) / 'amazon.db'
+    engine = models.get_engine(db_path)
+    with engine.begin() as connection:
+        connection.execute('CREATE TABLE jobs (id INTEGER PRIMARY KEY, category VARCHAR, '
+                           'terms VARCHAR, run_date DATETIME)')
+        connection.execute("INSERT INTO jobs (category, terms) VALUES ('Toys & Games', 'lego')")
+        connection.execute('CREATE TABLE price_history (id INTEGER PRIMARY KEY, '
+                           'marketplace VARCHAR NOT NULL, asin VARCHAR NOT NULL, '
+                           'observed_at DATETIME NOT NULL, price INTEGER, currency VARCHAR(3))')
+        connection.execute('CREATE INDEX ix_price_history_covering ON price_history '
+                           '(marketplace, asin, observed_at, price, currency)')
+        connection.execute("INSERT INTO price_history (marketplace, asin, observed_at, price) "
+                           "VALUES ('US', 'A', '2020-01-01 00:00:00.000000', 100)")
+
+    models.create_tables(engine)
+    models.create_tables(engine)
+
+    with engine.begin() as connection:
+        assert connection.execute('SELECT terms, stop_reason FROM jobs').fetchall() == \
+            [('lego', None)]
+        assert connection.execute('SELECT asin, source FROM price_history').fetchall() == \
+            [('A', 'list')]
+        indexes = {row[1] for row in connection.execute('PRAGMA index_list(price_history)')}
+        assert 'ix_price_history_source_covering' in indexes
+        assert 'ix_price_history_covering' not in indexes
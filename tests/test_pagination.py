@@ -0,0 +1,92 @@
+"""
+Unit tests for pagination.py
+"""
+from queue import Queue
+
+import aws_searcher.pagination as pagination
+
+
+def _crawl(page_count: int, shows_last_page: bool, **kwargs) -> tuple:
+    """
+    Drain a paginator against a fake search with page_count pages of results
+
+    Returns:
+        Tuple of (pages fetched in order, paginator)
+    """
+    page_q = Queue()
+    paginator = pagination.Paginator(page_q, 'Sports & Outdoors', 'oakley', **kwargs)
+    paginator.start()
+    fetched = []
+    while not page_q.empty():
+        page = page_q.get()['page_number']
+        if paginator.wanted(page):
+            fetched.append(page)
+            paginator.seen(page, 10 if page <= page_count else 0,
+                           page_count if shows_last_page and page <= page_count else None)
+        page_q.task_done()
+    return fetched, paginator
+
+
+def test_last_page_known():
+    """
+    Test that every page up to the last one shown is fetched and nothing past it
+
+    """
+    fetched, paginator = _crawl(10, True, probe_ahead=4)
+    assert fetched == list(range(1, 11))
+    assert paginator.last_page == 10
+
+    fetched, paginator = _crawl(2, True, probe_ahead=4)
+    assert fetched == [1, 2]
+    assert paginator.skipped == 2
+
+
+def test_probe_without_pagination():
+    """
+    Test that probing runs until pages come back empty when no last page is shown
+
+    """
+    fetched, _ = _crawl(1, False, probe_ahead=3)
+    assert fetched == [1, 2, 3, 4]
+
+    fetched, _ = _crawl(6, False, probe_ahead=2)
+    assert fetched == list(range(1, 9))
+
+    fetched, _ = _crawl(0, False, probe_ahead=2)
+    assert fetched == [1, 2]
+
+
+def test_max_pages():
+    """
+    Test that the page cap holds even if pages never run out
+
+    """
+    fetched, _ = _crawl(1000, False, probe_ahead=4, max_pages=7)
+    assert fetched == list(range(1, 8))
+
+
+def test_stop():
+    """
+    Test that a stopped paginator queues no further pages
+
+    """
+    page_q = Queue()
+    paginator = pagination.Paginator(page_q, 'Sports & Outdoors', 'oakley', probe_ahead=2)
+    paginator.start()
+    paginator.stop()
+    paginator.seen(1, 10, 20)
+
+    assert paginator.queued == 2
+    assert page_q.qsize() == 2
+
+
+def test_first_page():
+    """
+    Test that a resumed crawl starts from the first page not read
+
+    """
+    fetched, _ = _crawl(10, True, probe_ahead=2, first_page=6)
+    assert fetched == list(range(6, 11))
+
+    fetched, _ = _crawl(10, True, probe_ahead=2, first_page=6, last_page=10)
+    assert fetched == list(range(6, 11))
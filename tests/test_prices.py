@@ -0,0 +1,94 @@
+"""
+Unit tests for prices.py
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+
+import aws_searcher.models as models
+import aws_searcher.prices as prices
+
+
+@pytest.fixture
+def store(tmpdir) -> prices.PriceStore:
+    """
+    Pytest fixture for a price store in a temporary results db
+
+    Returns:
+        PriceStore object
+    """
+    engine = models.get_engine(Path(str(tmpdir)) / 'amazon.db')
+    models.BASE.metadata.create_all(bind=engine)
+    return prices.PriceStore(engine, 'US')
+
+
+def test_to_minor_units():
+    """
+    Test decimal amounts, zero decimal currencies and missing values
+
+    """
+    assert prices.to_minor_units('129.99', 'USD') == 12999
+    assert prices.to_minor_units(0.1, 'USD') == 10
+    assert prices.to_minor_units('1500', 'JPY') == 1500
+    assert prices.to_minor_units('', 'USD') is None
+    assert prices.to_minor_units(float('nan'), 'USD') is None
+    assert prices.to_minor_units('n/a', 'USD') is None
+
+
+def test_record_only_changes(store):
+    """
+    Test that unchanged prices are not appended and history comes back in order
+
+    """
+    start = datetime(2018, 3, 1)
+    assert store.record([{'asin': 'A', 'price': '10.00', 'currency': 'USD'},
+                         {'asin': 'B', 'price': '5.00', 'currency': 'USD'},
+                         {'asin': 'C', 'price': None, 'currency': None}], start) == 2
+    assert store.record([{'asin': 'A', 'price': '10.00', 'currency': 'USD'},
+                         {'asin': 'B', 'price': '4.50', 'currency': 'USD'}],
+                        start + timedelta(days=1)) == 1
+    assert store.record([{'asin': 'A', 'price': '10.00', 'currency': 'USD'}],
+                        start + timedelta(days=2)) == 0
+
+    assert [entry['price'] for entry in store.history('B')] == [500, 450]
+    assert store.latest(['A', 'B', 'C']) == {
+        'A': {'observed_at': start, 'price': 1000, 'currency': 'USD'},
+        'B': {'observed_at': start + timedelta(days=1), 'price': 450, 'currency': 'USD'}}
+
+
+def test_latest_uses_covering_index(store):
+    """
+    Test that the latest price lookup is answered from the covering index
+
+    """
+    compiled = store._latest_query(['A'], 'list').compile(store.engine,
+                                                   compile_kwargs={'literal_binds': True})
+    with store.engine.begin() as connection:
+        plan = ' '.join(str(row[-1]) for row in
+                        connection.execute(text('EXPLAIN QUERY PLAN %s' % compiled)))
+
+    assert 'COVERING INDEX ix_price_history_source_covering' in plan
+
+
+def test_record_sources_across_stores(store):
+    """
+    Test that pricing rows are kept per source and that stores of other jobs do not
+    append the same change again
+
+    """
+    start = datetime(2018, 3, 1)
+    other = prices.PriceStore(store.engine, 'US')
+    row = {'asin': 'A', 'competitive_price': '9.50', 'competitive_currency': 'USD',
+           'offer_count': '3', 'lowest_offer_price': '9.00', 'lowest_offer_currency': 'USD'}
+
+    assert store.record([row], start) == 2
+    assert other.record([row], start) == 0
+    assert other.record([row], start + timedelta(hours=1)) == 0
+    assert other.record([dict(row, lowest_offer_price='8.75')], start + timedelta(hours=2)) == 1
+    assert store.record([{'asin': 'A', 'price': '10.00', 'currency': 'USD'}], start) == 1
+
+    assert [entry['price'] for entry in store.history('A', 'lowest_offer')] == [900, 875]
+    assert store.latest(['A'], 'competitive')['A']['price'] == 950
+    assert store.latest(['A'])['A']['price'] == 1000
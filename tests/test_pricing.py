@@ -0,0 +1,123 @@
+"""
+Unit tests for pricing.py
+"""
+import threading
+import time
+from queue import Queue
+
+import pytest
+
+import aws_searcher.config as config
+import aws_searcher.pricing as pricing
+import aws_searcher.simulator as simulator
+from aws_searcher.retry import RetryPolicy
+
+
+@pytest.fixture
+def mws_simulator(monkeypatch):
+    """
+    Pytest fixture for a simulator answering MWS requests, with credentials set
+
+    Returns:
+        Running Simulator
+    """
+    sim = simulator.Simulator(pricing_quota=1, pricing_restore_rate=0.001)
+    _, mws_url = sim.start()
+    monkeypatch.setattr(config, 'MWS_DOMAIN', mws_url)
+    for variable in ('MWS_ACCESS_KEY', 'MWS_SECRET_KEY', 'SELLER_ID'):
+        monkeypatch.setenv(variable, 'test')
+    yield sim
+    sim.stop()
+
+
+def test_take_batch():
+    """
+    Test that a batch is cut at the size limit, a partial batch is returned after the wait
+    and a stop sentinel ends the batch
+
+    """
+    q = Queue()
+    for number in range(25):
+        q.put(number)
+
+    assert pricing.take_batch(q, size=20, wait=1) == list(range(20))
+    assert pricing.take_batch(q, size=20, wait=0.05) == list(range(20, 25))
+
+    threading.Timer(0.05, q.put, args=('late',)).start()
+    assert pricing.take_batch(q, size=20, wait=0.01) == ['late']
+
+    # A stop sentinel ends the batch and is left for the next worker
+    for item in ('a', pricing.STOP):
+        q.put(item)
+    assert pricing.take_batch(q, size=20, wait=1) == ['a']
+    assert pricing.take_batch(q, size=20, wait=1) == []
+    assert q.empty()
+
+
+def test_parse_responses():
+    """
+    Test the buy box price, offer count and lowest offer of each ASIN
+
+    """
+    offers = {'B000000001': ['12.00', '9.50', '10.00'], 'B000000002': ['5.00']}
+
+    competitive = pricing.parse_competitive_pricing(
+        simulator.render_competitive_pricing_response(offers).encode('utf-8'))
+    lowest = pricing.parse_lowest_offers(
+        simulator.render_lowest_offers_response(offers).encode('utf-8'))
+
+    assert competitive == {
+        'B000000001': {'competitive_price': '12.00', 'competitive_currency': 'USD',
+                       'offer_count': '3'},
+        'B000000002': {'competitive_price': '5.00', 'competitive_currency': 'USD',
+                       'offer_count': '1'}}
+    assert lowest['B000000001'] == {'lowest_offer_price': '9.50', 'lowest_offer_currency': 'USD'}
+
+
+def test_price_through_simulator(mws_simulator):
+    """
+    Test a batch against the simulator and that each operation keeps its own quota
+
+    """
+    scheduler = pricing.PricingScheduler(quota=1, restore_rate=0.001)
+    asins = [simulator.search_asin(1, index) for index in range(20)]
+
+    rows = scheduler.price(config.MARKETPLACE_IDS['US'], asins)
+
+    assert [row['asin'] for row in rows] == asins
+    offers = mws_simulator.offers(asins[0])
+    assert rows[0]['competitive_price'] == offers[0]
+    assert rows[0]['lowest_offer_price'] == min(offers, key=float)
+    assert mws_simulator.counts['pricing_requests'] == 2
+    assert scheduler.buckets[pricing.LOWEST_OFFERS].wait_time() > 0
+
+
+def test_failed_attempt_cap():
+    """
+    Test that ASINs are retried until the attempt cap and then dropped
+
+    """
+    scheduler = pricing.PricingScheduler(policy=RetryPolicy(max_attempts=2, base_delay=0.5))
+
+    retry, delay = scheduler.failed(['A', 'B'])
+    assert retry == ['A', 'B'] and 0 <= delay <= 0.5
+    retry, delay = scheduler.failed(['A'])
+    assert retry == [] and 0 <= delay <= 1.0
+
+
+def test_backoff_not_before():
+    """
+    Test that retried ASINs are held back until their backoff has passed, while other
+    ASINs of the same batch are ready at once
+
+    """
+    scheduler = pricing.PricingScheduler(policy=RetryPolicy(max_attempts=2))
+    scheduler.policy.delay = lambda attempt: 0.2
+
+    assert scheduler.failed(['A', 'B']) == (['A', 'B'], 0.2)
+    ready, waiting, wait = scheduler.ready(['A', 'C', 'B'])
+    assert (ready, waiting) == (['C'], ['A', 'B']) and 0 < wait <= 0.2
+
+    time.sleep(0.25)
+    assert scheduler.ready(['A', 'B']) == (['A', 'B'], [], 0.0)
+    assert scheduler.not_before == {}
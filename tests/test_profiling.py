@@ -0,0 +1,66 @@
+"""
+Unit tests for profiling.py
+"""
+import pstats
+import threading
+from pathlib import Path
+
+import aws_searcher.profiling as profiling
+
+
+def _wait_here(event: threading.Event):
+    event.wait()
+
+
+def test_thread_group():
+    """
+    Test that worker numbers are stripped from thread names
+
+    """
+    assert profiling.thread_group('api-worker-12') == 'api-worker'
+    assert profiling.thread_group('MainThread') == 'MainThread'
+
+
+def test_samples_written(tmpdir):
+    """
+    Test that a sampled thread shows up under its stage in both output files
+
+    """
+    release = threading.Event()
+    worker = threading.Thread(target=_wait_here, args=(release,), name='page-worker-1')
+    worker.start()
+
+    profiler = profiling.SamplingProfiler(interval=0.01)
+    profiler.sample()
+    profiler.sample()
+    release.set()
+    worker.join()
+
+    directory = Path(str(tmpdir))
+    profiler.write(directory)
+
+    collapsed = (directory / 'profile.collapsed').read_text().splitlines()
+    waiting = [line for line in collapsed if line.startswith('page-worker;')]
+    assert len(waiting) == 1
+    assert '_wait_here (test_profiling.py:' in waiting[0]
+    assert waiting[0].endswith(' 2')
+
+    stats = pstats.Stats((directory / 'profile.pstats').as_posix())
+    functions = {function[2]: values for function, values in stats.stats.items()}
+    assert functions['_wait_here'][1] == 2
+    assert abs(functions['_wait_here'][3] - 0.02) < 1e-9
+
+
+def test_trace_memory(tmpdir):
+    """
+    Test that allocations inside the block are reported
+
+    """
+    report = Path(str(tmpdir)) / 'memory.txt'
+    with profiling.trace_memory(report, limit=5):
+        blocks = [bytearray(1024) for _ in range(1000)]
+
+    lines = report.read_text().splitlines()
+    assert lines[0].startswith('Peak traced memory:')
+    assert 'test_profiling.py' in lines[2]
+    assert blocks
@@ -0,0 +1,102 @@
+"""
+Unit tests for query.py
+"""
+import io
+import json
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+
+import aws_searcher.models as models
+import aws_searcher.query as query
+
+
+@pytest.fixture
+def engine(tmpdir):
+    """
+    Pytest fixture for a results db with three jobs of two ASINs each
+
+    Returns:
+        SQLAlchemy engine
+    """
+    engine = models.get_engine(Path(str(tmpdir)) / 'amazon.db')
+    models.BASE.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(models.Jobs.__table__.insert(),
+                           [{'category': 'Sports & Outdoors', 'terms': 'oakley'}] * 3)
+        connection.execute(models.ProductResults.__table__.insert(), [
+            {'job': job, 'asin': asin, 'brand': brand, 'product': asin.lower(),
+             'price': price + job, 'currency': 'USD'}
+            for job in (1, 2, 3)
+            for asin, brand, price in [('B000000001', 'Oakley', 100.0),
+                                       ('B000000002', 'Ray-Ban', 150.0)]])
+    return engine
+
+
+def _asin_jobs(engine, **filters) -> list:
+    return [(row['asin'], row['job']) for row in query.iter_results(engine, batch_size=2,
+                                                                    **filters)]
+
+
+def test_filters(engine):
+    """
+    Test ASIN, brand, job range and price range filters
+
+    """
+    assert _asin_jobs(engine, asins=['B000000001']) == [('B000000001', 1), ('B000000001', 2),
+                                                       ('B000000001', 3)]
+    assert _asin_jobs(engine, brands=['Ray-Ban'], job_from=2) == [('B000000002', 2),
+                                                                  ('B000000002', 3)]
+    assert _asin_jobs(engine, job_to=1) == [('B000000001', 1), ('B000000002', 1)]
+    assert _asin_jobs(engine, min_price=102, max_price=151.5) == [('B000000002', 1),
+                                                               ('B000000001', 2),
+                                                               ('B000000001', 3)]
+    assert _asin_jobs(engine, limit=1) == [('B000000001', 1)]
+    assert query.last_jobs_start(engine, 2) == 2
+
+
+def test_asin_lookup_uses_index(engine):
+    """
+    Test that an ASIN lookup is an index search rather than a table scan
+
+    """
+    compiled = query.select_results(asins=['B000000001']).compile(
+        engine, compile_kwargs={'literal_binds': True})
+    with engine.begin() as connection:
+        plan = ' '.join(str(row[-1]) for row in
+                        connection.execute(text('EXPLAIN QUERY PLAN %s' % compiled)))
+
+    assert 'ix_product_results_asin_job' in plan
+
+
+def test_writers(engine):
+    """
+    Test CSV and JSON lines output
+
+    """
+    csv_out = io.StringIO()
+    assert query.write_csv(query.iter_results(engine, job_from=3), csv_out) == 2
+    lines = csv_out.getvalue().splitlines()
+    assert lines[0] == ','.join(query.COLUMNS)
+    assert lines[1].startswith('3,') and lines[1].endswith(',B000000001,Oakley,b000000001,103.0,USD')
+
+    json_out = io.StringIO()
+    assert query.write_json(query.iter_results(engine, job_from=3), json_out) == 2
+    assert json.loads(json_out.getvalue().splitlines()[1])['price'] == 153.0
+
+
+def test_backfill(engine):
+    """
+    Test that per-job annotated tables are copied once
+
+    """
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE annotated_data_7 '
+                                '(asin TEXT, brand TEXT, product TEXT, price TEXT, currency TEXT)'))
+        connection.execute(text("INSERT INTO annotated_data_7 VALUES "
+                                "('B000000009', 'Oakley', 'Frogskins', '89.99', 'USD')"))
+
+    assert query.backfill(engine) == 1
+    assert query.backfill(engine) == 0
+    assert [row['price'] for row in query.iter_results(engine, job_from=7)] == [89.99]
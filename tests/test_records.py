@@ -0,0 +1,54 @@
+"""
+Unit tests for records.py
+"""
+import csv
+from pathlib import Path
+
+import pytest
+
+import aws_searcher.records as records
+import aws_searcher.searcher as searcher
+
+
+def test_record_mapping():
+    """
+    Test that records read like dicts of their columns and hold no dict of their own
+
+    """
+    row = records.RelationshipRow('B000000001', 'child', relative='B000000000')
+    assert not hasattr(row, '__dict__')
+    assert row == {'asin': 'B000000001', 'relationship': 'child', 'relative': 'B000000000'}
+    assert row['relative'] == row.relative == 'B000000000'
+    assert list(row) == ['asin', 'relationship', 'relative']
+    assert row.row() == ('B000000001', 'child', 'B000000000')
+    assert dict(row, depth=1)['depth'] == 1
+    assert row.get('missing', '') == '' and 'missing' not in row
+    with pytest.raises(KeyError):
+        row['missing']
+
+    assert records.TargetRow(asin='B000000001')['price'] == ''
+    with pytest.raises(TypeError):
+        records.TargetRow(missing='')
+    with pytest.raises(TypeError):
+        records.RelationshipRow('a', 'b', 'c', 'd')
+    with pytest.raises(ValueError):
+        records.record_type('Broken', ['asin', 'asin'])
+
+
+def test_serialize_records(tmpdir):
+    """
+    Test that records are written in column order and appended without a header
+
+    """
+    path = Path(str(tmpdir)) / 'rows.csv'
+    rows = [records.RelationshipRow('B000000001', 'child', 'B000000000'),
+            records.RelationshipRow('B000000002', 'stand-alone', '')]
+    searcher.serialize_to_csv(rows, path)
+    searcher.serialize_to_csv(rows[:1], path, write_mode='a')
+
+    with path.open() as infile:
+        lines = list(csv.reader(infile))
+    assert lines == [['asin', 'relationship', 'relative'],
+                     ['B000000001', 'child', 'B000000000'],
+                     ['B000000002', 'stand-alone', ''],
+                     ['B000000001', 'child', 'B000000000']]
@@ -0,0 +1,67 @@
+"""
+Unit tests for retry.py
+"""
+from pathlib import Path
+
+import pytest
+
+import aws_searcher.models as models
+import aws_searcher.retry as retry
+
+
+@pytest.fixture
+def engine(tmpdir):
+    """
+    Pytest fixture for a results db in a temporary directory
+
+    Returns:
+        SQLAlchemy engine
+    """
+    engine = models.get_engine(Path(str(tmpdir)) / 'amazon.db')
+    models.BASE.metadata.create_all(bind=engine)
+    return engine
+
+
+def test_policy_delay_bounds():
+    """
+    Test that the jittered delay stays under the doubling ceiling and the cap
+
+    """
+    policy = retry.RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=5.0)
+
+    for attempt, ceiling in [(1, 1.0), (2, 2.0), (3, 4.0), (4, 5.0), (10, 5.0)]:
+        for _ in range(50):
+            assert 0 <= policy.delay(attempt) <= ceiling
+
+
+def test_tracker_dead_letters(engine):
+    """
+    Test that ASINs are requeued until the attempt cap, then dead-lettered to the db
+
+    """
+    tracker = retry.RetryTracker(engine, 1, 'US', retry.RetryPolicy(max_attempts=2))
+
+    requeue, dead = tracker.failed(['a', 'b'], ValueError('throttled'))
+    assert [asin for asin, _ in requeue] == ['a', 'b']
+    assert dead == []
+
+    tracker.succeeded(['a'])
+    requeue, dead = tracker.failed(['a', 'b'], ValueError('throttled'))
+    assert [asin for asin, _ in requeue] == ['a']
+    assert dead == ['b']
+    assert tracker.dead[0]['last_error'] == 'throttled'
+
+    assert retry.dead_lettered_asins(engine, 1) == ['b']
+
+
+def test_mark_retried(engine):
+    """
+    Test that retried dead letters are no longer returned
+
+    """
+    tracker = retry.RetryTracker(engine, 1, 'US', retry.RetryPolicy(max_attempts=1))
+    tracker.failed(['a', 'b'], ValueError('error'))
+
+    retry.mark_retried(engine, 1, 2)
+
+    assert retry.dead_lettered_asins(engine, 1) == []
@@ -129,6 +129,23 @@ def test_get_pagination():
     page_number = searcher.get_pagination(soup) == 79
 
 
+def test_get_pagination_without_last_page():
+    """
+    Test get_pagination when only page links or no pagination bar are shown
+
+    """
+    linked = searcher.BeautifulSoup('<div id="pagn"><span class="pagnCur">1</span>'
+                                    '<span class="pagnLink"><a>2</a></span>'
+                                    '<span class="pagnLink"><a>3</a></span></div>', 'lxml')
+    truncated = searcher.BeautifulSoup('<div id="pagn"><span class="pagnCur">1</span>'
+                                       '<span class="pagnMore">...</span></div>', 'lxml')
+    single = searcher.BeautifulSoup('<ul id="s-results-list-atf"></ul>', 'lxml')
+
+    assert searcher.get_pagination(linked) == 3
+    assert searcher.get_pagination(truncated) is None
+    assert searcher.get_pagination(single) is None
+
+
 def test_serialize_to_csv(tmpdir):
     """
     Test serialize_to_csv
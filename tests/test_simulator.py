@@ -0,0 +1,88 @@
+"""
+Unit tests for simulator.py
+"""
+import xml.etree.ElementTree as ET
+
+import pytest
+import requests
+
+import aws_searcher.config as config
+import aws_searcher.searcher as searcher
+import aws_searcher.simulator as simulator
+
+
+@pytest.fixture
+def running_simulator():
+    """
+    Pytest fixture that runs a small simulator on free ports
+
+    Returns:
+        Tuple of Simulator, search url and MWS url
+    """
+    sim = simulator.Simulator(page_count=3, results_per_page=4, variation_children=2, quota=2,
+                              restore_rate=0.001)
+    search_url, mws_url = sim.start()
+    yield sim, search_url, mws_url
+    sim.stop()
+
+
+def test_search_pages(running_simulator, monkeypatch):
+    """
+    Test that the searcher parses simulated search pages and pagination
+
+    """
+    sim, search_url, _ = running_simulator
+    monkeypatch.setattr(config, 'AMAZON_SEARCH_URL_TEMPLATE',
+                        config.AMAZON_SEARCH_URL_TEMPLATE.replace(config.AMAZON_BASE_URL,
+                                                                  search_url))
+
+    soup = searcher.get_amazon_search_result('Sports & Outdoors', 'oakley', 2)
+
+    assert searcher.get_pagination(soup) == 3
+    assert searcher.collect_target_pages_from_search_response(soup) == [
+        simulator.search_asin(2, index) for index in range(4)]
+
+    past_last = searcher.get_amazon_search_result('Sports & Outdoors', 'oakley', 4)
+    assert searcher.collect_target_pages_from_search_response(past_last) == []
+
+
+def test_matching_product_and_throttling(running_simulator):
+    """
+    Test GetMatchingProduct responses, relationships and quota enforcement
+
+    """
+    sim, _, mws_url = running_simulator
+    parent = simulator.search_asin(1, 0)
+    url = mws_url + '/Products/2011-10-01'
+
+    response = requests.get(url, params={'Action': 'GetMatchingProduct',
+                                         'ASINList.ASIN.1': parent,
+                                         'ASINList.ASIN.2': simulator.child_asin(parent, 1)})
+    assert response.status_code == 200
+
+    results = [element for element in ET.fromstring(response.text)
+               if element.tag.endswith('GetMatchingProductResult')]
+    assert [result.get('ASIN') for result in results] == [parent,
+                                                         simulator.child_asin(parent, 1)]
+    assert 'VariationParent' in response.text
+    assert 'VariationChildren' in response.text
+
+    requests.get(url, params={'Action': 'GetMatchingProduct', 'ASINList.ASIN.1': parent})
+    throttled = requests.get(url, params={'Action': 'GetMatchingProduct',
+                                          'ASINList.ASIN.1': parent})
+
+    assert throttled.status_code == 503
+    assert 'RequestThrottled' in throttled.text
+    assert sim.counts['throttled'] == 1
+
+
+def test_child_asin_round_trip():
+    """
+    Test that variation child ASINs map back to their parent
+
+    """
+    parent = simulator.search_asin(12, 3)
+    child = simulator.child_asin(parent, 7)
+
+    assert len(child) == 10
+    assert simulator.parent_asin(child) == parent
@@ -0,0 +1,69 @@
+"""
+Cold start benchmark for cli.py
+"""
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+
+# Cumulative import time allowed for aws_searcher.cli, in microseconds
+STARTUP_BUDGET_US = 250000
+
+HEAVY_MODULES = ['pandas', 'sqlalchemy', 'bs4', 'lxml', 'mws', 'requests', 'numpy']
+
+ROOT = Path(__file__).parent.parent
+
+
+def _import_times(module: str) -> Dict[str, int]:
+    """
+    Import a module in a fresh interpreter with -X importtime
+
+    Args:
+        module: Dotted module name
+
+    Returns:
+        Cumulative import time in microseconds keyed by every module imported
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=ROOT.as_posix(), stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_does_not_import_heavy_modules():
+    """
+    Test that loading the CLI leaves pandas, SQLAlchemy, bs4, lxml and mws unimported
+
+    """
+    imported = {name.split('.')[0] for name in _import_times('aws_searcher.cli')}
+
+    assert sorted(imported.intersection(HEAVY_MODULES)) == []
+
+
+def test_cli_startup_budget():
+    """
+    Test that the CLI imports within the startup budget (best of three runs)
+
+    """
+    best = min(_import_times('aws_searcher.cli')['aws_searcher.cli'] for _ in range(3))
+
+    assert best < STARTUP_BUDGET_US, 'CLI import took %dus' % best
+
+
+def test_help_lists_commands():
+    """
+    Test that --help runs without the heavy dependencies and lists every command
+
+    """
+    result = subprocess.run([sys.executable, '-m', 'aws_searcher.cli', '--help'],
+                            cwd=ROOT.as_posix(), stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+
+    for command in ['run', 'retry', 'cache', 'simulate']:
+        assert command in result.stdout
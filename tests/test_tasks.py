@@ -5,10 +5,17 @@ from pathlib import Path
 import typing
 import csv
 import json
+import threading
+from queue import Queue
 
 import pytest
+import requests_mock
 
 import aws_searcher.tasks as TASKS
+from aws_searcher.asin_index import AsinIndex
+from aws_searcher.frontier import Frontier
+from aws_searcher.records import RelationshipRow, TargetRow
+from aws_searcher.retry import RetryPolicy, RetryTracker
 
 
 @pytest.fixture(autouse=True)
@@ -184,3 +191,155 @@ def test_grouper():
     assert groups[0] == [0, 1, 2, 3, 4]
     assert groups[1] == [5, 6, 7, 8, 9]
     assert groups[2] == [10, 11, 12]
+
+
+def test_queue_for_details():
+    """
+    Assert that ASINs are only queued for the detail stage once
+
+    """
+    detail_q = Queue()
+    detail_seen = set()
+
+    assert TASKS.queue_for_details(['A', 'B', 'A'], detail_q, detail_seen) == 2
+    assert TASKS.queue_for_details(['B', 'C'], detail_q, detail_seen) == 1
+    assert list(detail_q.queue) == ['A', 'B', 'C']
+
+
+def test_get_product_details():
+    """
+    Assert that a detail page is parsed into a buy box row and related ASINs
+
+    """
+    detail_page = Path(__file__).parent / 'resources' / 'aws_searcher_test_product.htm'
+    url = TASKS.searcher.urljoin(TASKS.config.AMAZON_BASE_URL, 'dp/B075CYFMMT')
+
+    with requests_mock.mock() as m:
+        m.get(url, text=detail_page.read_text())
+        page_data = TASKS.get_product_details('B075CYFMMT')
+
+    assert page_data['details'] == {'asin': 'B075CYFMMT',
+                                    'buy_box_price': '$203.00',
+                                    'sellers': 'A24JA0AG016EJ8'}
+    assert isinstance(page_data['related_asins'], list)
+
+
+def test_combine_json_files(tmpdir):
+    """
+    Test that only the job's scratch files are combined into the output directory
+
+    """
+    scratch_dir = Path(str(tmpdir)) / 'job-1'
+    output_dir = Path(str(tmpdir)) / 'out'
+    scratch_dir.mkdir()
+    output_dir.mkdir()
+    for rows in ([{'ASIN': 'A'}], [{'ASIN': 'B'}]):
+        TASKS.serialize_data_to_json(rows, scratch_dir)
+
+    TASKS.combine_json_files('oakley', scratch_dir, output_dir)
+
+    with (output_dir / 'oakley.json').open() as infile:
+        assert sorted(row['ASIN'] for row in json.load(infile)) == ['A', 'B']
+    assert list(scratch_dir.glob('*.json')) == []
+
+
+PARENT = 'B00000000P'
+CHILDREN = ['B000000001', 'B000000002']
+
+
+def fake_product_data(marketplace_id, asins):
+    """
+    Stand-in for mws_api.acquire_mws_product_data: the parent's response lists its children
+
+    Returns:
+        Product data dict for the ASINs
+    """
+    return {'target_values': [TargetRow(asin=asin) for asin in asins],
+            'raw_data': [{'ASIN': {'value': asin}} for asin in asins],
+            'relationships': [[RelationshipRow(child, 'parent', PARENT) for child in CHILDREN]
+                              if asin == PARENT else [] for asin in asins],
+            'attributes': [None for _ in asins],
+            'errors': {}}
+
+
+def run_api_worker(scratch_dir: Path, seeds, **kwargs) -> RetryTracker:
+    """
+    Run one api_worker until the frontier drains
+
+    Args:
+        scratch_dir: Scratch directory the worker writes to
+        seeds: ASINs queued at depth 0
+
+    Keyword Args:
+        kwargs: Further api_worker keyword arguments
+
+    Returns:
+        The worker's retry tracker
+    """
+    crawl_frontier = Frontier()
+    crawl_frontier.put(seeds)
+    retries = RetryTracker(None, 1, 'US', RetryPolicy(base_delay=0, max_delay=0))
+    worker = threading.Thread(target=TASKS.api_worker,
+                              args=(crawl_frontier, Queue(), retries, 'US', scratch_dir),
+                              kwargs=dict(kwargs, pause=False), daemon=True)
+    worker.start()
+    crawl_frontier.join()
+    crawl_frontier.stop()
+    worker.join(5)
+    assert not worker.is_alive()
+    return retries
+
+
+def written_asins(scratch_dir: Path) -> typing.List[str]:
+    rows = []
+    for path in scratch_dir.glob('*.csv'):
+        with path.open() as infile:
+            rows.extend(row['asin'] for row in csv.DictReader(infile))
+    return sorted(rows)
+
+
+def test_plain_run_writes_fresh_family_members(tmpdir, monkeypatch):
+    """
+    Test that a plain run fetches and writes family members an earlier job fetched
+    recently, which only an incremental run leaves out
+
+    """
+    monkeypatch.setattr(TASKS.mws_api, 'acquire_mws_product_data', fake_product_data)
+    index = AsinIndex(Path(str(tmpdir)) / 'US.idx')
+    index.record([PARENT] + CHILDREN)
+    index.merge()
+
+    scratch_dir = Path(str(tmpdir)) / 'job-2'
+    scratch_dir.mkdir()
+    run_api_worker(scratch_dir, [PARENT], index=index)
+
+    assert written_asins(scratch_dir) == sorted([PARENT] + CHILDREN)
+    index.close()
+
+
+def test_failed_batch_is_retried_before_counting_as_fetched(tmpdir, monkeypatch):
+    """
+    Test that a batch whose outputs fail to save is requeued, and is recorded as fetched
+    only once they are written
+
+    """
+    monkeypatch.setattr(TASKS.mws_api, 'acquire_mws_product_data', fake_product_data)
+    serialize, failures = TASKS.serialize_data_to_csv, []
+
+    def fail_once(data, directory, extension='csv'):
+        if not failures:
+            failures.append((extension, list(index._recorded)))
+            raise OSError('disk full')
+        serialize(data, directory, extension=extension)
+
+    monkeypatch.setattr(TASKS, 'serialize_data_to_csv', fail_once)
+    index = AsinIndex(Path(str(tmpdir)) / 'US.idx')
+    scratch_dir = Path(str(tmpdir)) / 'job-1'
+    scratch_dir.mkdir()
+    retries = run_api_worker(scratch_dir, ['B000000009'], index=index)
+
+    assert failures == [('txt', [])]
+    assert written_asins(scratch_dir) == ['B000000009']
+    assert list(index._recorded) == ['B000000009']
+    assert retries.attempts == {}
+    index.close()
@@ -0,0 +1,100 @@
+"""
+Unit tests for timeouts.py
+"""
+import threading
+import time
+
+import pytest
+
+import aws_searcher.timeouts as timeouts
+
+
+def test_deadline():
+    """
+    Test remaining time and expiry, with and without a deadline
+
+    """
+    unbounded = timeouts.Deadline()
+    assert not unbounded.expired()
+    assert unbounded.remaining() == float('inf')
+
+    deadline = timeouts.Deadline(0.05)
+    assert 0 < deadline.remaining() <= 0.05
+    time.sleep(0.06)
+    assert deadline.expired()
+    assert deadline.remaining() == 0
+
+
+def _warm(hedger: timeouts.Hedger, latency: float = 0.01):
+    """
+    Record enough fast requests for the hedger to start hedging
+
+    """
+    for _ in range(hedger.min_samples):
+        hedger.call(time.sleep, latency)
+
+
+def test_threshold():
+    """
+    Test that no request is hedged before min_samples latencies are recorded
+
+    """
+    hedger = timeouts.Hedger(percentile=50, min_samples=4, max_workers=4)
+    assert hedger.threshold() is None
+    _warm(hedger)
+
+    assert 0.01 <= hedger.threshold() < 0.5
+    assert hedger.stats == {'requests': 4, 'hedged': 0, 'hedge_wins': 0}
+
+
+def test_hedge_wins():
+    """
+    Test that a stalled request is duplicated and the duplicate's result is used
+
+    """
+    hedger = timeouts.Hedger(percentile=50, min_samples=4, max_workers=4)
+    _warm(hedger)
+    calls = []
+    release = threading.Event()
+
+    def fetch(url):
+        calls.append(url)
+        if len(calls) == 1:
+            release.wait(5)
+            return 'stalled'
+        return 'hedge'
+
+    started = time.monotonic()
+    assert hedger.call(fetch, 'page') == 'hedge'
+    assert time.monotonic() - started < 1
+    assert calls == ['page', 'page']
+    assert hedger.stats == {'requests': 5, 'hedged': 1, 'hedge_wins': 1}
+    release.set()
+
+
+def test_errors():
+    """
+    Test that a failed hedge leaves the slow request to answer, and that the first
+    request's error is raised when both fail
+
+    """
+    hedger = timeouts.Hedger(percentile=50, min_samples=4, max_workers=4)
+    _warm(hedger)
+    calls = []
+
+    def slow_then_failing(url):
+        calls.append(url)
+        if len(calls) == 1:
+            time.sleep(0.2)
+            return 'slow'
+        raise IOError('hedge failed')
+
+    assert hedger.call(slow_then_failing, 'page') == 'slow'
+    assert hedger.stats['hedge_wins'] == 0
+
+    def failing(url):
+        time.sleep(0.1)
+        raise IOError(url)
+
+    with pytest.raises(IOError, match='page'):
+        hedger.call(failing, 'page')
@@ -0,0 +1,59 @@
+"""
+Unit tests for transport.py
+"""
+import threading
+
+import pytest
+
+import aws_searcher.simulator as simulator
+import aws_searcher.transport as transport
+
+
+@pytest.fixture
+def search_url():
+    """
+    Pytest fixture that runs a small simulator on free ports
+
+    Returns:
+        Base url of the simulated search pages
+    """
+    sim = simulator.Simulator(page_count=3, results_per_page=4)
+    url, _ = sim.start()
+    yield url
+    sim.stop()
+
+
+def test_base_url():
+    """
+    Test that only the scheme and host of a url are replaced
+
+    """
+    pooled = transport.Transport(base_url='http://127.0.0.1:8080/ignored')
+
+    assert pooled.url('https://www.amazon.com/s/ref=nb?page=2') == \
+        'http://127.0.0.1:8080/s/ref=nb?page=2'
+    assert transport.Transport().url('https://www.amazon.com/dp/A') == \
+        'https://www.amazon.com/dp/A'
+
+
+def test_connection_reuse(search_url):
+    """
+    Test that each thread keeps its own session whose connection is reused
+
+    """
+    pooled = transport.Transport(base_url=search_url, headers={'User-Agent': 'test'})
+    page_url = 'https://www.amazon.com/s/ref=sr_pg_1?page=1&field-keywords=oakley'
+
+    def fetch():
+        for _ in range(5):
+            response = pooled.get(page_url)
+            assert response.ok
+            assert response.request.headers['User-Agent'] == 'test'
+
+    threads = [threading.Thread(target=fetch) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pooled.stats() == {'requests': 10, 'connections': 2, 'reuse': 0.8}